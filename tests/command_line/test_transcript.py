@@ -0,0 +1,68 @@
+from math import inf
+from pathlib import Path
+
+import pytest
+
+from wright.command_line import (
+    BaudRateEvent,
+    CommandResult,
+    SerialCommandLine,
+    Transcript,
+    TranscriptEvent,
+    replay_transcript,
+)
+
+# Recorded against a U-boot-like shell. See `_run_session` for the commands.
+_UBOOT_SESSION = Path(__file__).parent / "transcripts" / "uboot_session.jsonl"
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_replay_uboot_session(tmp_path: Path) -> None:
+    transcript = Transcript.load(_UBOOT_SESSION)
+    # Record the replay as well. This way, we also test the recorder.
+    replay_file = tmp_path / "replay.jsonl"
+    async with replay_transcript(transcript, speed=inf) as tty:
+        async with SerialCommandLine.run_in_background(
+            tty,
+            transcript.prompt,
+            baud_rate=transcript.baud_rate,
+            nonce_prefix=transcript.nonce_prefix,
+            transcript=replay_file,
+        ) as serial:
+            await _run_session(serial)
+    # We send the exact same data as in the original session
+    replay = Transcript.load(replay_file)
+    assert _tx_data(replay) == _tx_data(transcript)
+    assert replay.baud_rate == 115200
+    assert [
+        event.baud_rate for event in replay.events if isinstance(event, BaudRateEvent)
+    ] == [921600]
+
+
+async def _run_session(serial: SerialCommandLine) -> None:
+    await serial.force_prompt()
+    assert await serial.run("version") == "U-Boot 2021.04 (fake)"
+    results = await serial.run_many(
+        ["setenv a 1", "echo hello", "false"], check_error_code=False
+    )
+    assert results == [
+        CommandResult("setenv a 1", "", 0),
+        CommandResult("echo hello", "hello", 0),
+        CommandResult("false", "", 1),
+    ]
+    assert await serial.switch_baud_rate(921600, "setenv baudrate 921600")
+    assert serial.baud_rate == 921600
+    assert await serial.run("echo world") == "world"
+
+
+def _tx_data(transcript: Transcript) -> bytes:
+    return b"".join(
+        event.data
+        for event in transcript.events
+        if isinstance(event, TranscriptEvent) and event.direction == "tx"
+    )
@@ -1,3 +1,10 @@
-from ._command_line import CommandLine
-from ._serial_command_line import SerialCommandLine
+from ._command_line import CommandLine, CommandResult
+from ._serial_command_line import DEFAULT_BAUD_RATE, SerialCommandLine
 from ._ssh_command_line import SshCommandLine
+from ._transcript import (
+    BaudRateEvent,
+    Transcript,
+    TranscriptEvent,
+    TranscriptRecorder,
+    replay_transcript,
+)
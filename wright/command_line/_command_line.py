@@ -1,9 +1,25 @@
 from __future__ import annotations
 
 import logging
+import secrets
 from abc import abstractmethod
-from typing import Any, AsyncContextManager, Type, TypeVar
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from math import inf
+from typing import (
+    Any,
+    AsyncContextManager,
+    AsyncIterator,
+    Iterator,
+    Optional,
+    Sequence,
+    Type,
+    TypeVar,
+    Union,
+)
 
+import anyio
+from anyio.streams.memory import MemoryObjectReceiveStream
 from pydantic import parse_raw_as
 
 _LOGGER = logging.getLogger(__name__)
@@ -11,6 +27,60 @@ _LOGGER = logging.getLogger(__name__)
 ParseType = TypeVar("ParseType")
 
 
+@dataclass(frozen=True)
+class CommandResult:
+    """Response and error code of a single command."""
+
+    command: str
+    response: str
+    error_code: int
+
+
+class ResponseStream(AsyncIterator[str]):
+    """Lines of a command response as they arrive.
+
+    Iterate over this instance to get each line (without the end-line characters).
+    The error code is available when the iteration stops.
+
+    The producer (i.e., the command line) sends each line as a `str` followed by
+    the error code as an `int`.
+    """
+
+    def __init__(
+        self,
+        receive: MemoryObjectReceiveStream[Union[str, int]],
+        command: str,
+        *,
+        check_error_code: bool = True,
+    ) -> None:
+        self._receive = receive
+        self._command = command
+        self._check_error_code = check_error_code
+        self._error_code: Optional[int] = None
+
+    @property
+    def error_code(self) -> Optional[int]:
+        """Return the error code of the command (if it completed)."""
+        return self._error_code
+
+    async def __anext__(self) -> str:
+        # Early out if we already got the error code (end of the response)
+        if self._error_code is not None:
+            raise StopAsyncIteration
+        try:
+            item = await self._receive.receive()
+        except anyio.EndOfStream as exc:
+            raise RuntimeError(
+                f'The response to "{self._command}" ended prematurely'
+            ) from exc
+        if isinstance(item, str):
+            return item
+        self._error_code = item
+        if self._check_error_code and self._error_code != 0:
+            raise RuntimeError(f"Command failed with error code {self._error_code}")
+        raise StopAsyncIteration
+
+
 class CommandLine(AsyncContextManager["CommandLine"]):
     """Abstract base class for a command line."""
 
@@ -24,3 +94,161 @@ class CommandLine(AsyncContextManager["CommandLine"]):
         """Run command and wait for the parsed response."""
         response = await self.run(command, **kwargs)
         return parse_raw_as(parse_as, response)
+
+    @asynccontextmanager
+    async def run_stream(
+        self, command: str, *, check_error_code: bool = True
+    ) -> AsyncIterator[ResponseStream]:
+        """Run command and get the response line by line as it arrives.
+
+        Use this for long-running commands (e.g., `mkfs.ext4`) or commands with
+        large outputs (e.g., `cat`). Example:
+
+            async with command_line.run_stream("cat big.log") as lines:
+                async for line in lines:
+                    ...
+
+        If `check_error_code` is set, the iteration raises an error at the end of
+        the response if the command failed.
+
+        This default implementation waits for the entire response before it
+        yields the first line. Derived classes override this with an actual
+        streaming implementation.
+        """
+        (result,) = await self.run_many([command], check_error_code=False)
+        send, receive = anyio.create_memory_object_stream(inf, Union[str, int])
+        with send:
+            for line in result.response.splitlines():
+                send.send_nowait(line)
+            send.send_nowait(result.error_code)
+        with receive:
+            yield ResponseStream(receive, command, check_error_code=check_error_code)
+
+    async def run_many(
+        self,
+        commands: Sequence[str],
+        *,
+        check_error_code: bool = True,
+        strip_trailing_white_space: bool = True,
+    ) -> list[CommandResult]:
+        """Run the commands in a batch and return the result of each command.
+
+        We join the commands into as few command lines as possible. E.g.:
+
+            a; echo __RC_<nonce0>=$?; b; echo __RC_<nonce1>=$?
+
+        Each marker (e.g., "__RC_<nonce0>=") separates the response of a command
+        from the next and carries the command's error code. This way, a batch of
+        commands costs a single round trip.
+
+        Note that we run all commands in a batch even if one of them fails. If
+        `check_error_code` is set, we raise an error for the first failed command
+        after the fact.
+
+        A command that is too long to carry a marker (see `_get_max_line_length`)
+        goes on its own. We get its error code with a separate "echo $?" command.
+        """
+        results: list[CommandResult] = []
+        for batch in self._batch(commands):
+            markers = [f"__RC_{self._next_nonce()}=" for _ in batch]
+            line = "; ".join(
+                f"{command}; echo {marker}$?" for command, marker in zip(batch, markers)
+            )
+            if self._is_too_long(line):
+                # Note that `_batch` only gives us a single command in this case
+                (command,) = batch
+                _LOGGER.debug('Get the error code of "%s" separately', command)
+                results.append(
+                    await self._run_unembedded(command, strip_trailing_white_space)
+                )
+                continue
+            response = await self.run(
+                line, check_error_code=False, strip_trailing_white_space=False
+            )
+            results += _demultiplex(
+                response, batch, markers, strip_trailing_white_space
+            )
+        if check_error_code:
+            for result in results:
+                if result.error_code != 0:
+                    raise RuntimeError(
+                        f'Command "{result.command}" failed with '
+                        f"error code {result.error_code}"
+                    )
+        return results
+
+    def _batch(self, commands: Sequence[str]) -> Iterator[list[str]]:
+        """Split the commands into batches that each fit on a single command line.
+
+        A command that doesn't fit (with its marker) gets a batch of its own.
+        """
+        max_line_length = self._get_max_line_length()
+        # Early out if there is no limit
+        if max_line_length is None:
+            yield list(commands)
+            return
+        batch: list[str] = []
+        length = 0
+        for command in commands:
+            # Rough estimate of the length that the command (with the marker
+            # and separators) adds to the command line.
+            command_length = len(command) + 32
+            if batch and length + command_length > max_line_length:
+                yield batch
+                batch = []
+                length = 0
+            batch.append(command)
+            length += command_length
+        if batch:
+            yield batch
+
+    async def _run_unembedded(
+        self, command: str, strip_trailing_white_space: bool
+    ) -> CommandResult:
+        """Run the command as is and get the error code in a separate round trip."""
+        response = await self.run(
+            command,
+            check_error_code=False,
+            strip_trailing_white_space=strip_trailing_white_space,
+        )
+        error_code = await self.run("echo $?", check_error_code=False)
+        return CommandResult(command, response, int(error_code.strip()))
+
+    def _get_max_line_length(self) -> Optional[int]:
+        """Return the maximum length of a single command line (if any)."""
+        return None
+
+    def _is_too_long(self, line: str) -> bool:
+        """Return true if the line exceeds the maximum line length (if any)."""
+        max_line_length = self._get_max_line_length()
+        return max_line_length is not None and len(line) > max_line_length
+
+    def _next_nonce(self) -> str:
+        """Return a nonce that we use to tag, e.g., error codes in a response."""
+        return secrets.token_hex(4)
+
+
+def _demultiplex(
+    response: str,
+    commands: Sequence[str],
+    markers: Sequence[str],
+    strip_trailing_white_space: bool,
+) -> list[CommandResult]:
+    """Split the response of a batch into the result of each command."""
+    results: list[CommandResult] = []
+    position = 0
+    for command, marker in zip(commands, markers):
+        index = response.find(marker, position)
+        if index == -1:
+            raise RuntimeError(f'Could not find the response for "{command}"')
+        command_response = response[position:index]
+        if strip_trailing_white_space:
+            command_response = command_response.rstrip("\r\n")
+        # The error code runs until the end of the line
+        end_of_line = response.find("\n", index)
+        if end_of_line == -1:
+            end_of_line = len(response)
+        error_code = int(response[index + len(marker) : end_of_line].strip())
+        results.append(CommandResult(command, command_response, error_code))
+        position = end_of_line + 1
+    return results
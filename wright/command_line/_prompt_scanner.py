@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import codecs
+from typing import Optional
+
+
+class PromptScanner:
+    """Split a stream of bytes into the responses that precede each prompt.
+
+    We only scan the newly arrived bytes for the prompt (plus a few bytes of
+    overlap in case a prompt straddles two chunks). Consequently, the total cost
+    is linear in the amount of data. Even for, e.g., a large `cat` or a boot log
+    that arrives in many small chunks.
+
+    We decode each complete response with an incremental decoder. Multi-byte
+    characters that are split across chunks are thus no problem. Invalid bytes
+    become replacement characters ("�"). We never drop data.
+    """
+
+    def __init__(self, prompt: str, *, encoding: Optional[str] = None) -> None:
+        if encoding is None:
+            encoding = "utf-8"
+        self._encoding = encoding
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._buffer = bytearray()
+        # Number of bytes at the start of the buffer that we know doesn't contain
+        # (the start of) the prompt.
+        self._scanned = 0
+        self._prompt = prompt
+        self._prompt_bytes = prompt.encode(encoding)
+
+    @property
+    def prompt(self) -> str:
+        """Return the prompt that delimits the responses."""
+        return self._prompt
+
+    @prompt.setter
+    def prompt(self, value: str) -> None:
+        """Set the prompt that delimits the responses.
+
+        We rescan the buffered data (if any) for the new prompt.
+        """
+        self._prompt = value
+        self._prompt_bytes = value.encode(self._encoding)
+        self._scanned = 0
+
+    def feed(self, data: bytes) -> list[str]:
+        """Push data into the scanner and return the completed responses (if any)."""
+        self._buffer += data
+        responses: list[str] = []
+        start = 0
+        while True:
+            index = self._buffer.find(self._prompt_bytes, max(start, self._scanned))
+            if index == -1:
+                break
+            responses.append(self._decode(self._buffer[start:index]))
+            start = index + len(self._prompt_bytes)
+        # Remove the completed responses from the buffer. What remains is a
+        # partial response.
+        del self._buffer[:start]
+        # Only the last few bytes of the partial response can be the beginning of
+        # a prompt. We skip the rest when we scan the next time.
+        self._scanned = max(0, len(self._buffer) - len(self._prompt_bytes) + 1)
+        return responses
+
+    def take_partial(self) -> str:
+        """Remove and return the part of the partial response that we already scanned.
+
+        That is, the part that can't contain (the beginning of) a prompt. Use this
+        to, e.g., stream a long response before it is complete. The remainder of
+        the response is part of the next response that `feed` returns.
+        """
+        data = self._buffer[: self._scanned]
+        del self._buffer[: self._scanned]
+        self._scanned = 0
+        # The partial response may end in the middle of a multi-byte character.
+        # The decoder keeps said bytes until we decode the next part.
+        return self._decoder.decode(data, final=False)
+
+    def _decode(self, data: bytearray) -> str:
+        # Each response ends right before a prompt. Therefore, the response ends on
+        # a character boundary (given that the prompt itself is valid text).
+        return self._decoder.decode(data, final=True)
@@ -1,23 +1,41 @@
 from __future__ import annotations
 
+import codecs
 import itertools
 import logging
+import re
+import secrets
+import time
 from contextlib import AsyncExitStack, asynccontextmanager
 from math import inf
 from pathlib import Path
 from types import TracebackType
-from typing import Any, AsyncIterator, Optional, Type
+from typing import Any, AsyncIterator, Optional, Pattern, Type, Union
 
 import anyio
 import serial
 from anyio.abc import TaskGroup, TaskStatus
-from anyio.lowlevel import checkpoint
+from anyio.streams.memory import MemoryObjectSendStream
 
 from ..util import DelimitedBuffer
-from ._command_line import CommandLine
+from ._command_line import CommandLine, ResponseStream
+from ._prompt_scanner import PromptScanner
+from ._transcript import TranscriptRecorder
 
 _LOGGER = logging.getLogger(__name__)
 
+# Where Linux lists the USB-serial adapters (e.g., FTDI-based ones)
+_USB_SERIAL_DEVICES = Path("/sys/bus/usb-serial/devices")
+# Lowest possible latency timer value [ms]
+_LATENCY_TIMER = "1"
+# Time [s] that we give the device to switch baud rate
+_BAUD_RATE_SETTLE_TIME = 0.2
+# Number of characters of serial input that we search for output patterns (see
+# `wait_for_output`). This must exceed the length of the longest match.
+_OUTPUT_WINDOW = 4096
+
+DEFAULT_BAUD_RATE = 115200
+
 
 class SerialCommandLine(CommandLine):
     """Serial command line used to send commands to the device."""
@@ -29,23 +47,55 @@ class SerialCommandLine(CommandLine):
         prompt: str,
         *,
         baud_rate: Optional[int] = None,
+        embed_error_code: Optional[bool] = None,
+        max_line_length: Optional[int] = None,
+        low_latency: Optional[bool] = None,
+        nonce_prefix: Optional[str] = None,
+        transcript: Optional[Path] = None,
         logger: Optional[logging.Logger] = None,
     ):
         # Argument defaults
         if baud_rate is None:
-            baud_rate = 115200
+            baud_rate = DEFAULT_BAUD_RATE
+        if embed_error_code is None:
+            embed_error_code = True
+        if max_line_length is None:
+            # U-boot's command line buffer (CONFIG_SYS_CBSIZE) is the limiting
+            # factor. It defaults to 256 characters. Linux accepts lines up to
+            # 4095 characters but the shell may wrap long lines (see
+            # `Linux._get_max_line_length`).
+            max_line_length = 256
+        if low_latency is None:
+            low_latency = True
+        if nonce_prefix is None:
+            nonce_prefix = secrets.token_hex(3)
         if logger is None:
             logger = _LOGGER
         # Note that we intentionally do not give the `port` argument to
         # `Serial.__init__`. This is because the constructor opens the port if given
         # and we want to defer that.
-        self._serial = serial.Serial(baudrate=baud_rate)
+        #
+        # We use a blocking read (`timeout=None`) in a dedicated worker thread. See
+        # `_read_blocking` for details.
+        self._serial = serial.Serial(baudrate=baud_rate, timeout=None)
         self._serial.port = str(tty)
         # Internals
         self._tg = tg
         self._cancel_scope = anyio.CancelScope()
         self._logger = logger
-        self._prompt = prompt
+        self._scanner = PromptScanner(prompt)
+        self._embed_error_code = embed_error_code
+        self._max_line_length = max_line_length
+        self._low_latency = low_latency
+        # Time [s] from when we send a command until we get the response. We
+        # measure this in `force_prompt`.
+        self._round_trip_time: Optional[float] = None
+        # We use nonces to tag the error code in a response (see `run`). The
+        # random prefix ensures that we don't mistake the response of a previous
+        # command line instance (on the same TTY) for our own. Only use a fixed
+        # prefix to, e.g., replay a transcript.
+        self._nonce_prefix = nonce_prefix
+        self._nonce_counter = itertools.count()
         (
             self._responses_send,
             self._responses_receive,
@@ -53,7 +103,21 @@ class SerialCommandLine(CommandLine):
             inf, str
         )  # [1]
         # TODO: Submit a pull request to anyio that adds types to `anyio.Lock`.
-        self._serial_lock = anyio.Lock()
+        #
+        # Note that we only guard writes. The reader thread (see `_read_blocking`)
+        # never holds this lock so reads and writes don't block each other.
+        self._write_lock = anyio.Lock()
+        # Each command line gets its own worker thread for reads. This way, the
+        # blocked reader doesn't eat into the default thread limiter regardless
+        # of how many command lines we open.
+        self._read_limiter = anyio.CapacityLimiter(1)
+        # Receives the response as it arrives (see `run_stream`)
+        self._response_sink: Optional[_ResponseSink] = None
+        # Look for patterns in the serial input (see `wait_for_output`)
+        self._output_watchers: set[_OutputWatcher] = set()
+        # Records the raw serial traffic (if enabled)
+        self._transcript = transcript
+        self._recorder: Optional[TranscriptRecorder] = None
 
     @classmethod
     @asynccontextmanager
@@ -68,6 +132,34 @@ class SerialCommandLine(CommandLine):
             async with cls(tg, *args, **kwargs) as command_line:
                 yield command_line
 
+    @property
+    def prompt(self) -> str:
+        """Return the prompt that delimits the responses."""
+        return self._scanner.prompt
+
+    @prompt.setter
+    def prompt(self, value: str) -> None:
+        """Set the prompt that delimits the responses.
+
+        E.g., use this to wait for a log-in prompt.
+        """
+        self._scanner.prompt = value
+
+    @property
+    def baud_rate(self) -> int:
+        """Return the current baud rate of the host side of the serial port."""
+        result = self._serial.baudrate
+        assert isinstance(result, int)
+        return result
+
+    @property
+    def round_trip_time(self) -> Optional[float]:
+        """Return the round-trip time [s] of a simple command (if measured yet).
+
+        We measure this with the final (successful) "echo" in `force_prompt`.
+        """
+        return self._round_trip_time
+
     async def force_prompt(self) -> None:
         """Force the prompt to appear.
 
@@ -87,7 +179,9 @@ class SerialCommandLine(CommandLine):
                 # Use a small timeout so that we really do spam the
                 # line and are able to interrupt a boot process.
                 with anyio.fail_after(0.5):
+                    start = time.perf_counter()
                     resp = await self.run(f"echo {i}")
+                    end = time.perf_counter()
             except (RuntimeError, TimeoutError):
                 # If the command fails we simply try again
                 continue
@@ -98,8 +192,72 @@ class SerialCommandLine(CommandLine):
             # If we got this far, we have successfully entered a command
             # and recieved the appropriate response. This means that we
             # are at the prompt.
+            #
+            # This also gives us a measure of the round-trip time.
+            self._round_trip_time = end - start
+            self._logger.info("Round-trip time: %.1f ms", self._round_trip_time * 1000)
             return
 
+    async def switch_baud_rate(
+        self,
+        baud_rate: int,
+        command: str,
+        *,
+        confirm: Optional[bytes] = None,
+    ) -> bool:
+        """Switch the device and then the host to the given baud rate.
+
+        We run the given command on the device (e.g., "stty 921600") without
+        waiting for a response. Then we switch the host side of the serial port
+        and verify the connection with an echo probe. Some devices (e.g.,
+        U-boot) wait for a confirmation (e.g., `b"\r"`) at the new baud rate
+        before they continue.
+
+        If the probe fails, we fall back on the old baud rate. Returns `True` if
+        we switched and `False` if we fell back. Raises `RuntimeError` if
+        neither baud rate works.
+        """
+        old_baud_rate = self.baud_rate
+        self._logger.info("Switch baud rate from %d to %d", old_baud_rate, baud_rate)
+        await self.run_nowait(command)
+        # Give the device time to echo the command and switch
+        await anyio.sleep(_BAUD_RATE_SETTLE_TIME)
+        await self._set_host_baud_rate(baud_rate)
+        if await self._probe(confirm):
+            return True
+        self._logger.warning(
+            "The device does not respond at %d baud. We fall back on %d baud.",
+            baud_rate,
+            old_baud_rate,
+        )
+        await self._set_host_baud_rate(old_baud_rate)
+        if await self._probe(confirm):
+            return False
+        raise RuntimeError(
+            f"The device responds neither at {baud_rate} nor {old_baud_rate} baud"
+        )
+
+    async def _set_host_baud_rate(self, baud_rate: int) -> None:
+        def _set() -> None:
+            self._serial.baudrate = baud_rate
+            # Whatever is in the input buffer is most likely garbage from the
+            # transition.
+            self._serial.reset_input_buffer()
+
+        await anyio.to_thread.run_sync(_set)
+        if self._recorder is not None:
+            self._recorder.on_baud_rate(baud_rate)
+
+    async def _probe(self, confirm: Optional[bytes] = None) -> bool:
+        """Return `True` if we get a response from the device."""
+        for _ in range(3):
+            if confirm is not None:
+                await self._write(confirm)
+            with anyio.move_on_after(1):
+                await self.force_prompt()
+                return True
+        return False
+
     async def wait_for_prompt(self) -> str:
         """Wait for the prompt to appear.
 
@@ -122,6 +280,25 @@ class SerialCommandLine(CommandLine):
                 break
         return result
 
+    async def wait_for_output(
+        self, *patterns: Union[str, Pattern[str]]
+    ) -> re.Match[str]:
+        """Wait until the serial input matches one of the given regex patterns.
+
+        We only search the input that arrives after the call. Returns the match.
+
+        Use this to, e.g., wait for a milestone in the boot log (like the
+        "login:" prompt) instead of a fixed sleep.
+        """
+        watcher = _OutputWatcher([re.compile(pattern) for pattern in patterns])
+        self._output_watchers.add(watcher)
+        try:
+            await watcher.event.wait()
+        finally:
+            self._output_watchers.discard(watcher)
+        assert watcher.match is not None
+        return watcher.match
+
     async def run(
         self,
         command: str,
@@ -130,19 +307,42 @@ class SerialCommandLine(CommandLine):
         strip_trailing_white_space: bool = True,
         **_: Any,
     ) -> str:
-        """Run command and wait for the response."""
-        await self.run_nowait(command)
+        """Run command and wait for the response.
+
+        Per default, we append an `echo` of the error code to the command itself.
+        E.g., "ls" becomes "ls; echo __RC_<nonce>=$?". This way, we get both the
+        response and the error code in a single round trip. Disable this with
+        `embed_error_code=False` (constructor argument) to fall back on a separate
+        "echo $?" command. We also fall back if the embedded error code makes the
+        line too long (see `max_line_length`).
+        """
+        embed_error_code = check_error_code and self._embed_error_code
+        if embed_error_code:
+            marker = f"__RC_{self._next_nonce()}="
+            line = f"{command}; echo {marker}$?"
+            # The device may wrap or truncate a line that is too long. In turn,
+            # we don't get the line back as is (see [2]).
+            if self._is_too_long(line):
+                embed_error_code = False
+                line = command
+        else:
+            line = command
+        await self.run_nowait(line)
         resp = await self.wait_for_prompt()
         # raw = resp.encode("unicode_escape").decode("utf-8")
         # self._logger.debug(f"raw resp: <<{raw}>>")
         # Check that we got our command back. Note that even though we submit
         # the command suffixed with a single "\n" (see [3]), we get it back
         # suffixed with "\r\n".
-        returned_command = command + "\r\n"
+        returned_command = line + "\r\n"
         if not resp.startswith(returned_command):  # [2]
             raise RuntimeError("Could not send command")
         # Remove the returned command from the response
         resp = resp[len(returned_command) :]
+        # Separate the embedded error code from the actual response
+        error_code: Optional[str] = None
+        if embed_error_code:
+            resp, error_code = _split_error_code(resp, marker)
         # Strip any trailing "new line" characters.
         #
         # Most commands output trailing new lines for formatting purposes.
@@ -158,13 +358,53 @@ class SerialCommandLine(CommandLine):
         # Early out
         if not check_error_code:
             return resp
-        # Check error code via recursive call
-        error_code = await self.run("echo $?", check_error_code=False)
+        # Check error code via recursive call (unless we already got it)
+        if error_code is None:
+            error_code = await self.run("echo $?", check_error_code=False)
         assert error_code is not None
         if error_code.strip() != "0":
             raise RuntimeError(f"Command failed with error code {error_code}")
         return resp
 
+    @asynccontextmanager
+    async def run_stream(
+        self, command: str, *, check_error_code: bool = True
+    ) -> AsyncIterator[ResponseStream]:
+        """Run command and get the response line by line as it arrives.
+
+        We forward the response directly from the serial input. Consequently, we
+        never hold the entire response in memory.
+
+        Wait for the iteration to stop before you issue the next command. If you
+        exit the context early, we discard the rest of the response.
+
+        We need the embedded error code to find the end of the response. If that
+        makes the line too long (see `max_line_length`), we fall back on the
+        default implementation. The latter waits for the entire response.
+        """
+        if self._response_sink is not None:
+            raise RuntimeError("Another command streams its response already")
+        marker = f"__RC_{self._next_nonce()}="
+        line = f"{command}; echo {marker}$?"
+        if self._is_too_long(line):
+            async with super().run_stream(
+                command, check_error_code=check_error_code
+            ) as stream:
+                yield stream
+            return
+        send, receive = anyio.create_memory_object_stream(inf, Union[str, int])
+        # Install the sink before we send the command. Otherwise, we may miss the
+        # first part of the response.
+        self._response_sink = _ResponseSink(line, marker, send)
+        try:
+            await self.run_nowait(line)
+        except BaseException:
+            self._response_sink = None
+            send.close()
+            raise
+        with receive:
+            yield ResponseStream(receive, command, check_error_code=check_error_code)
+
     async def run_nowait(self, command: str) -> None:
         """Run command but don't wait for a response."""
         if "\n" in command:
@@ -182,73 +422,146 @@ class SerialCommandLine(CommandLine):
         If you want to run a command on the device, use `run` instead. The latter
         has optional error checks and result parsing.
         """
-        async with self._serial_lock:
-            self._serial.write((text + "\n").encode())  # [3]
+        await self._write((text + "\n").encode())  # [3]
+
+    async def _write(self, data: bytes) -> None:
+        async with self._write_lock:
+            if self._recorder is not None:
+                self._recorder.on_tx(data)
+            self._serial.write(data)
 
     async def _run(self, task_status: TaskStatus) -> None:
         """Parse input from this command line.
 
         Put data in `_responses` whenever the prompt is found in the input.
 
-        The implementation is not optimized at all. It will hog the CPU while it
-        continuously polls for data. It is certainly not meant for applications
-        with limited resources.
+        We don't poll for data. Instead, a worker thread blocks on the serial port
+        until data arrives (see `_read_blocking`). This way, an idle command line
+        costs (next to) no CPU and we react to new data right away.
         """
-        # Early out
-        if self._prompt is None:
-            await checkpoint()
-            raise RuntimeError("You must specify the prompt first")
         async with AsyncExitStack() as stack:
             stack.enter_context(self._cancel_scope)
             await stack.enter_async_context(self._responses_send)
             logger_info = DelimitedBuffer(self._logger.info)
             stack.enter_context(logger_info)
+            # The log gets the data in arbitrary chunks. Therefore, we use an
+            # incremental decoder so that we don't choke on multi-byte characters
+            # that are split across chunks.
+            log_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
             self._logger.info("Opening serial connection")
             # We call `Serial.open` in a worker thread since it may block the event
             # loop otherwise. In turn, this means that `Serial.__enter__` becomes a
             # no-op (which is what we want).
             await anyio.to_thread.run_sync(self._serial.open)
             stack.enter_context(self._serial)
+            if self._low_latency:
+                await anyio.to_thread.run_sync(self._tune_port)
+            if self._transcript is not None:
+                self._logger.info("Record serial traffic to %s", self._transcript)
+                self._recorder = stack.enter_context(
+                    TranscriptRecorder(
+                        self._transcript,
+                        prompt=self.prompt,
+                        baud_rate=self.baud_rate,
+                        nonce_prefix=self._nonce_prefix,
+                    )
+                )
+            # Wake up the reader thread (if it's blocked) before we close the
+            # serial port. Note that the exit stack calls this before
+            # `Serial.__exit__` (LIFO order).
+            stack.callback(self._serial.cancel_read)
             self._logger.info("Opened serial connection")
             task_status.started()
 
-            buffer = ""
             while True:
-                async with self._serial_lock:
-                    # Ideally, there should be something like async_read so that
-                    # we wouldn't have to continuously poll for data.
-                    try:
-                        raw_serial_data = self._serial.read(
-                            self._serial.in_waiting
-                        ).decode()
-                    except UnicodeDecodeError:
-                        self._logger.warning(
-                            "Could not decode data from command line. Skipping said data."
-                        )
-                        continue
-                    if raw_serial_data:
-                        logger_info.on_next(raw_serial_data)
-                    # The raw serial data may contain partial responses. Therefore,
-                    # we buffer it until we can recognize the prompt in it.
-                    buffer += raw_serial_data
-                    assert self._prompt is not None
-                    if self._prompt in buffer:
-                        # Split the buffer into individual responses (separated by
-                        # the prompt).
-                        responses = buffer.split(self._prompt)
-                        # Note that `"x".split("x")` returns ["", ""]. Consequently,
-                        # there are at least two responses in the buffer.
-                        assert len(responses) >= 2
-                        # Put all responses in the queue except for the last one.
-                        for response in responses[:-1]:
-                            # We're not afraid of `anyio.WouldBlock` since the response
-                            # stream is not bounded (see [1]).
-                            self._responses_send.send_nowait(response)
-                        # The last response may be partial, so we re-initialize the
-                        # buffer with it and wait until it is complete in a future
-                        # iteration.
-                        buffer = responses[-1]
-                await anyio.sleep(0.01)
+                # Note that we abandon the worker thread on cancellation. This is
+                # fine since `cancel_read` (see above) unblocks it.
+                raw_serial_data = await anyio.to_thread.run_sync(
+                    self._read_blocking, cancellable=True, limiter=self._read_limiter
+                )
+                if self._recorder is not None:
+                    self._recorder.on_rx(raw_serial_data)
+                if text := log_decoder.decode(raw_serial_data):
+                    logger_info.on_next(text)
+                    for watcher in self._output_watchers:
+                        watcher.feed(text)
+                # The raw serial data may contain partial responses. The scanner
+                # buffers it until it recognizes the prompt in it.
+                responses = self._scanner.feed(raw_serial_data)
+                # Forward the response as it arrives if someone streams it
+                # (see `run_stream`).
+                if self._response_sink is not None:
+                    if responses:
+                        self._response_sink.on_completed(responses.pop(0))
+                        self._response_sink = None
+                    else:
+                        self._response_sink.on_next(self._scanner.take_partial())
+                for response in responses:
+                    # We're not afraid of `anyio.WouldBlock` since the response
+                    # stream is not bounded (see [1]).
+                    self._responses_send.send_nowait(response)
+
+    def _tune_port(self) -> None:
+        """Reduce the latency of the serial port (as far as we're permitted).
+
+        USB-serial adapters (e.g., FTDI) buffer the incoming data for up to
+        `latency_timer` milliseconds (default is 16 ms) before they pass it
+        on to the host. This adds to the round-trip time of each command.
+
+        Note that we already read all the available data in one go (see
+        `_read_blocking`) so there is no read size to tune on our side.
+        """
+        # The ASYNC_LOW_LATENCY flag (same as `setserial <tty> low_latency`)
+        try:
+            self._serial.set_low_latency_mode(True)
+        except (AttributeError, ValueError, OSError) as exc:
+            # E.g., on non-Linux platforms or pseudo-terminals
+            self._logger.debug("Could not set the ASYNC_LOW_LATENCY flag: %s", exc)
+        # The latency timer of the USB-serial adapter itself. Note that
+        # the TTY is often a symbolic link (e.g., "/dev/ttyGreenMango0"). We need
+        # the actual name (e.g., "ttyUSB0") to find the adapter in sysfs.
+        tty_name = Path(self._serial.port).resolve().name
+        latency_timer = _USB_SERIAL_DEVICES / tty_name / "latency_timer"
+        try:
+            old_value = latency_timer.read_text().strip()
+            if old_value != _LATENCY_TIMER:
+                latency_timer.write_text(_LATENCY_TIMER)
+                self._logger.info(
+                    "Changed the latency timer from %s ms to %s ms",
+                    old_value,
+                    _LATENCY_TIMER,
+                )
+        except OSError as exc:
+            # E.g., the adapter doesn't have a latency timer or we are not
+            # permitted to change it.
+            self._logger.debug("Could not change the latency timer: %s", exc)
+
+    def _get_max_line_length(self) -> Optional[int]:
+        """Return the maximum length of a single command line."""
+        return self._max_line_length
+
+    def _next_nonce(self) -> str:
+        """Return a nonce that is unique to this command line instance."""
+        return f"{self._nonce_prefix}{next(self._nonce_counter)}"
+
+    def _read_blocking(self) -> bytes:
+        """Block until there is data on the serial port and return said data.
+
+        Returns all the data that is available. Call this from a worker thread.
+
+        Returns an empty `bytes` object if someone called `cancel_read` on the
+        serial port.
+        """
+        # Wait for the first byte. This blocks indefinitely since `timeout=None`.
+        data = self._serial.read(1)
+        # Early out if someone cancelled the read
+        if not data:
+            return data
+        # Get the rest of the data (if any) while we're at it
+        in_waiting = self._serial.in_waiting
+        if in_waiting:
+            data += self._serial.read(in_waiting)
+        return data
 
     async def __aenter__(self) -> SerialCommandLine:
         await self._tg.start(self._run)
@@ -261,3 +574,108 @@ class SerialCommandLine(CommandLine):
         traceback: Optional[TracebackType],
     ) -> None:
         self._cancel_scope.cancel()
+
+
+class _OutputWatcher:
+    """Search the serial input for patterns (see `wait_for_output`)."""
+
+    def __init__(self, patterns: list[Pattern[str]]) -> None:
+        self._patterns = patterns
+        self._buffer = ""
+        self.event = anyio.Event()
+        self.match: Optional[re.Match[str]] = None
+
+    def feed(self, text: str) -> None:
+        """Search the given text (and the tail of the previous text)."""
+        # Early out if we already found a match
+        if self.match is not None:
+            return
+        # A match may span several chunks of input. Therefore, we keep the tail
+        # of the previous input around.
+        self._buffer = (self._buffer + text)[-_OUTPUT_WINDOW:]
+        for pattern in self._patterns:
+            match = pattern.search(self._buffer)
+            if match is not None:
+                self.match = match
+                self.event.set()
+                return
+
+
+class _ResponseSink:
+    """Forward a response line by line to a `ResponseStream`.
+
+    Strips the returned command (first line) and the embedded error code (last
+    line) from the response.
+    """
+
+    def __init__(
+        self,
+        line: str,
+        marker: str,
+        send: MemoryObjectSendStream[Union[str, int]],
+    ) -> None:
+        self._returned_command = line
+        self._marker = marker
+        self._send = send
+        self._lines = DelimitedBuffer(self._on_line)
+        self._got_returned_command = False
+        self._error_code: Optional[int] = None
+
+    def on_next(self, text: str) -> None:
+        """Push part of the response into the sink."""
+        self._lines.on_next(text)
+
+    def on_completed(self, text: str) -> None:
+        """Push the last part of the response into the sink."""
+        self._lines.on_next(text)
+        self._lines.flush()
+        # If we didn't get the error code, we simply close the stream. In turn,
+        # the receiver gets an error.
+        if self._error_code is not None:
+            self._forward(self._error_code)
+        self._send.close()
+
+    def _on_line(self, line: str) -> None:
+        line = line.rstrip("\r")
+        # The first line is the returned command itself (see [2])
+        if not self._got_returned_command:
+            self._got_returned_command = True
+            if line != self._returned_command:
+                # Let the receiver know that something went wrong
+                self._send.close()
+            return
+        index = line.find(self._marker)
+        # Most lines are part of the actual response
+        if index == -1:
+            self._forward(line)
+            return
+        # The error code follows the marker. Note that some commands (e.g., `cat`)
+        # don't output a trailing end-line character. Therefore, the marker may
+        # come after some actual response.
+        if index > 0:
+            self._forward(line[:index])
+        self._error_code = int(line[index + len(self._marker) :].strip())
+
+    def _forward(self, item: Union[str, int]) -> None:
+        # The receiver may have left early (or we closed the stream due to an
+        # error). We discard the rest of the response in that case.
+        try:
+            self._send.send_nowait(item)
+        except (anyio.BrokenResourceError, anyio.ClosedResourceError):
+            pass
+
+
+def _split_error_code(response: str, marker: str) -> tuple[str, str]:
+    """Split the response into the actual response and the embedded error code.
+
+    The error code follows the (last occurrence of the) marker. E.g.:
+
+        "hello\r\n__RC_abc0=0\r\n"
+
+    becomes `("hello\r\n", "0")`.
+    """
+    index = response.rfind(marker)
+    if index == -1:
+        raise RuntimeError("Could not find the error code in the response")
+    error_code = response[index + len(marker) :].strip()
+    return response[:index], error_code
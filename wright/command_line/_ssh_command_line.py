@@ -1,20 +1,24 @@
 from __future__ import annotations
 
+from contextlib import asynccontextmanager, suppress
 from logging import Logger, getLogger
 from types import TracebackType
-from typing import Any, Optional, Type
+from typing import Any, AsyncIterator, Optional, Type, Union
 
+import anyio
 import asyncssh
+from anyio.streams.memory import MemoryObjectSendStream
 from asyncssh import (
     ProcessError,
     SSHClientConnection,
+    SSHClientProcess,
     SSHCompletedProcess,
     SSHKnownHosts,
 )
 
 _LOGGER = getLogger(__name__)
 
-from ._command_line import CommandLine
+from ._command_line import CommandLine, ResponseStream
 
 
 class SshCommandLine(CommandLine):
@@ -53,6 +57,49 @@ class SshCommandLine(CommandLine):
         assert isinstance(response, str)
         return response
 
+    @asynccontextmanager
+    async def run_stream(
+        self, command: str, *, check_error_code: bool = True
+    ) -> AsyncIterator[ResponseStream]:
+        """Run command and get the response line by line as it arrives.
+
+        We merge stderr into stdout so that the lines arrive in the same order as
+        they would on a terminal.
+
+        The stream is bounded. I.e., if you don't keep up with the response, SSH
+        flow control pauses the remote process.
+        """
+        if self._conn is None:
+            raise RuntimeError("Call __aenter__ before you issue a command")
+        send, receive = anyio.create_memory_object_stream(16, Union[str, int])
+        async with anyio.create_task_group() as tg:
+            async with self._conn.create_process(
+                command, stderr=asyncssh.STDOUT
+            ) as process:
+                tg.start_soon(_forward_lines, process, send)
+                with receive:
+                    try:
+                        yield ResponseStream(
+                            receive, command, check_error_code=check_error_code
+                        )
+                    finally:
+                        # Stop the forwarding if the receiver left early
+                        tg.cancel_scope.cancel()
+
+    @asynccontextmanager
+    async def create_process(
+        self, command: str
+    ) -> AsyncIterator[SSHClientProcess[str]]:
+        """Start command and talk to it over stdin/stdout/stderr.
+
+        Use this for long-lived processes that take requests over stdin. We
+        close the channel to the process when the context exits.
+        """
+        if self._conn is None:
+            raise RuntimeError("Call __aenter__ before you issue a command")
+        async with self._conn.create_process(command) as process:
+            yield process
+
     @property
     def _known_hosts(self) -> SSHKnownHosts:
         data = f"{self._host} {self._host_key}\n"
@@ -76,3 +123,18 @@ class SshCommandLine(CommandLine):
     ) -> None:
         assert self._conn is not None
         await self._conn.__aexit__(exc_type, exc_value, traceback)
+
+
+async def _forward_lines(
+    process: SSHClientProcess[str], send: MemoryObjectSendStream[Union[str, int]]
+) -> None:
+    """Forward the output of the process line by line followed by the exit status."""
+    # The receiver may leave early. We simply stop the forwarding in that case.
+    with suppress(anyio.BrokenResourceError):
+        async with send:
+            async for line in process.stdout:
+                await send.send(line.rstrip("\r\n"))
+            completed = await process.wait()
+            exit_status = completed.exit_status
+            # The exit status is `None` if a signal killed the process
+            await send.send(exit_status if exit_status is not None else -1)
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import json
+import os
+import queue
+import select
+import threading
+import time
+import tty as tty_utils
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from types import TracebackType
+from typing import Any, AsyncIterator, Literal, Optional, TextIO, Type, Union
+
+import anyio
+
+Direction = Literal["rx", "tx"]
+
+
+@dataclass(frozen=True)
+class TranscriptEvent:
+    """Chunk of raw serial data in a transcript."""
+
+    # Time since the start of the recording [s]
+    time: float
+    # "rx" is from the device to the host. "tx" is from the host to the device.
+    direction: Direction
+    data: bytes
+
+
+@dataclass(frozen=True)
+class BaudRateEvent:
+    """Switch of the host side of the serial port to another baud rate."""
+
+    # Time since the start of the recording [s]
+    time: float
+    baud_rate: int
+
+
+@dataclass(frozen=True)
+class Transcript:
+    """Recording of the raw serial traffic of a single command line session."""
+
+    prompt: str
+    # Baud rate at the start of the recording. See the `BaudRateEvent`s for any
+    # subsequent changes.
+    baud_rate: int
+    # Use the same nonce prefix on replay. Otherwise, the recorded responses
+    # won't match the commands that we send.
+    nonce_prefix: str
+    events: tuple[Union[TranscriptEvent, BaudRateEvent], ...]
+
+    @classmethod
+    def load(cls, path: Path) -> Transcript:
+        """Load a transcript from a file (as written by `TranscriptRecorder`)."""
+        with path.open("rt") as io:
+            header = json.loads(io.readline())
+            events = tuple(_parse_event(raw) for raw in map(json.loads, io))
+        return cls(
+            prompt=header["prompt"],
+            baud_rate=header["baud_rate"],
+            nonce_prefix=header["nonce_prefix"],
+            events=events,
+        )
+
+
+def _parse_event(raw: dict[str, Any]) -> Union[TranscriptEvent, BaudRateEvent]:
+    if "baud_rate" in raw:
+        return BaudRateEvent(time=raw["t"], baud_rate=raw["baud_rate"])
+    return TranscriptEvent(
+        time=raw["t"], direction=raw["dir"], data=bytes.fromhex(raw["data"])
+    )
+
+
+class TranscriptRecorder:
+    """Record raw serial traffic (both directions) with timestamps.
+
+    The file format is JSON lines. The first line is a header. Each subsequent
+    line is an event. E.g.:
+
+        {"prompt": "zeus> ", "baud_rate": 115200, "nonce_prefix": "a1b2c3"}
+        {"t": 0.513, "dir": "rx", "data": "552d426f6f74"}
+        {"t": 0.701, "dir": "tx", "data": "6563686f20300a"}
+        {"t": 0.902, "baud_rate": 921600}
+
+    We call the `on_*` methods from the event loop. Therefore, they never touch
+    the file. A worker thread writes the events to the file instead.
+    """
+
+    def __init__(
+        self, path: Path, *, prompt: str, baud_rate: int, nonce_prefix: str
+    ) -> None:
+        self._path = path
+        self._header = {
+            "prompt": prompt,
+            "baud_rate": baud_rate,
+            "nonce_prefix": nonce_prefix,
+        }
+        # Lines for the worker thread to write. `None` tells it to stop.
+        self._lines: queue.SimpleQueue[Optional[str]] = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        self._start = 0.0
+
+    def on_rx(self, data: bytes) -> None:
+        """Record data from the device to the host."""
+        self._record("rx", data)
+
+    def on_tx(self, data: bytes) -> None:
+        """Record data from the host to the device."""
+        self._record("tx", data)
+
+    def on_baud_rate(self, baud_rate: int) -> None:
+        """Record that the host switched to the given baud rate."""
+        self._put({"baud_rate": baud_rate})
+
+    def _record(self, direction: Direction, data: bytes) -> None:
+        self._put({"dir": direction, "data": data.hex()})
+
+    def _put(self, fields: dict[str, Any]) -> None:
+        # Early out if we don't record (anymore)
+        if self._writer is None:
+            return
+        event = {"t": round(time.perf_counter() - self._start, 6), **fields}
+        self._lines.put(json.dumps(event) + "\n")
+
+    def _write_lines(self, io: TextIO) -> None:
+        """Write lines to the file until we get `None`. Runs in a worker thread."""
+        with io:
+            while (line := self._lines.get()) is not None:
+                io.write(line)
+
+    def __enter__(self) -> TranscriptRecorder:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        io = self._path.open("wt")
+        io.write(json.dumps(self._header) + "\n")
+        self._writer = threading.Thread(
+            target=self._write_lines, args=(io,), name="transcript", daemon=True
+        )
+        self._writer.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        assert self._writer is not None
+        writer = self._writer
+        self._writer = None
+        self._lines.put(None)
+        # The worker thread only has the remaining lines to write
+        writer.join()
+
+
+@asynccontextmanager
+async def replay_transcript(
+    transcript: Transcript, *, speed: Optional[float] = None
+) -> AsyncIterator[Path]:
+    """Replay the device side of the transcript on a pseudo-terminal.
+
+    Yields the path of the pseudo-terminal. Open it with, e.g., `SerialCommandLine`
+    in place of an actual TTY. Remember to use the same nonce prefix as the
+    transcript. Example:
+
+        async with replay_transcript(transcript) as tty:
+            async with SerialCommandLine.run_in_background(
+                tty, transcript.prompt, nonce_prefix=transcript.nonce_prefix
+            ) as serial:
+                ...
+
+    We send the recorded device data ("rx") with the recorded delays. Said delays
+    are relative to the previous event. Scale them with `speed` (e.g., `speed=2`
+    replays twice as fast). Use `speed=math.inf` to skip the delays.
+
+    We wait for the host to send a line for each recorded line that the host sent
+    ("tx"). We don't require that the lines match exactly. E.g., the IP address
+    of the host may differ between the recording and the replay.
+
+    A pseudo-terminal has no baud rate. Therefore, we skip the `BaudRateEvent`s.
+    """
+    if speed is None:
+        speed = 1.0
+    master, slave = os.openpty()
+    try:
+        tty_utils.setraw(master)
+        replayer = _Replayer(transcript, master, speed)
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(anyio.to_thread.run_sync, replayer.run)
+            try:
+                yield Path(os.ttyname(slave))
+            finally:
+                # The worker thread notices this within a fraction of a second.
+                # We wait for it before we close the pseudo-terminal.
+                replayer.stop()
+    finally:
+        os.close(slave)
+        os.close(master)
+
+
+class _Replayer:
+    """Play the device side of a transcript on the master end of a pseudo-terminal.
+
+    Runs in a worker thread.
+    """
+
+    def __init__(self, transcript: Transcript, master: int, speed: float) -> None:
+        self._transcript = transcript
+        self._master = master
+        self._speed = speed
+        self._stopped = threading.Event()
+        # Data from the host that we didn't consume yet
+        self._buffer = bytearray()
+
+    def stop(self) -> None:
+        """Stop the replay (from any thread)."""
+        self._stopped.set()
+
+    def run(self) -> None:
+        """Replay the transcript until the end or until someone calls `stop`."""
+        previous_time = 0.0
+        for event in self._transcript.events:
+            if isinstance(event, BaudRateEvent):
+                continue
+            if event.direction == "rx":
+                delay = (event.time - previous_time) / self._speed
+                if self._stopped.wait(delay):
+                    return
+                os.write(self._master, event.data)
+            elif not self._wait_for_host(terminator=event.data[-1:]):
+                return
+            previous_time = event.time
+
+    def _wait_for_host(self, terminator: bytes) -> bool:
+        """Wait until the host sends the given terminator (e.g., end-line).
+
+        Returns `False` if someone called `stop` in the meantime.
+        """
+        while not self._stopped.is_set():
+            # The host may send several lines in one go. We consume one at a time.
+            index = self._buffer.find(terminator)
+            if index != -1:
+                del self._buffer[: index + 1]
+                return True
+            # Use a timeout so that we notice if someone calls `stop`
+            ready, _, _ = select.select([self._master], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                self._buffer += os.read(self._master, 1024)
+            except OSError:
+                # The slave end closed
+                return False
+        return False
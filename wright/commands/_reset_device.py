@@ -6,11 +6,13 @@ from logging import Logger, getLogger
 from pathlib import Path
 from typing import Optional, Union
 
+import anyio
+
 from ..config import create_config_image
 from ..device.models import Branding, HardwareIdentificationGroup
 from ..device import Device, DeviceCondition, DeviceDescription, DeviceType, recipes
 from ..progress import Idle, ProgressManager, StatusMap, StatusStream
-from ..swupdate import MultiBundle
+from ..swupdate import DiskImage, MultiBundle, decompress_file
 from ..util import TEMP_DIR
 from ._power_off_on_error import power_off_on_error
 from ._settings import ResetDeviceSettings
@@ -63,7 +65,7 @@ async def reset_device(
             device = device_or_desc
 
         # Prepare
-        multi_bundle, config_image = await run_step(
+        multi_bundle, config_image, ssh_host_key = await run_step(
             _prepare,
             device.device_type,
             device.version,
@@ -71,26 +73,48 @@ async def reset_device(
             device.hw_ids,
             bundle_or_swu,
             branding,
+            settings.delta,
             logger,  # This logger goes into `_prepare`
             progress_manager=progress_manager,
             logger=logger,  # This logger goes into `run_step`
         )
         device_bundle = multi_bundle.device_bundles[device.device_type.value]
 
+        # U-boot falls back on the uncompressed operating system image if it
+        # can't decompress the image itself ("gzwrite"). We decompress the image
+        # while we reset the firmware. This way, the fallback doesn't count
+        # against the time limit of `reset_operating_system`.
+        decompressed = anyio.Event()
+        task_group = await stack.enter_async_context(anyio.create_task_group())
+        task_group.start_soon(
+            _decompress_image,
+            device_bundle.operating_system,
+            decompressed,
+            logger.getChild("swu"),
+        )
+
         # Reset firmware
         await run_step(
             power_off_on_error(recipes.reset_firmware, device),
             device_bundle.firmware.file,
+            settings.delta,
+            settings.wipe_flash,
+            settings.update_flash,
+            settings.verify,
             progress_manager=progress_manager,
             logger=logger,
             settings=settings.reset_firmware,
         )
 
         # Reset operating system
+        await decompressed.wait()
         await run_step(
             power_off_on_error(recipes.reset_operating_system, device),
             device_bundle.operating_system.file,
             multi_bundle.version,
+            device_bundle.operating_system.compressed_file,
+            settings.delta,
+            settings.verify,
             progress_manager=progress_manager,
             logger=logger,
             settings=settings.reset_operating_system,
@@ -100,6 +124,9 @@ async def reset_device(
         await run_step(
             power_off_on_error(recipes.reset_config, device),
             config_image,
+            settings.delta,
+            settings.verify,
+            ssh_host_key,
             progress_manager=progress_manager,
             logger=logger,
             settings=settings.reset_config,
@@ -133,20 +160,28 @@ async def _prepare(
     hw_ids: Optional[HardwareIdentificationGroup],
     bundle_or_swu: Union[MultiBundle, Path],
     branding: Branding,
+    delta: bool,
     logger: Logger,
-) -> tuple[MultiBundle, Path]:
+) -> tuple[MultiBundle, Path, str]:
     if isinstance(bundle_or_swu, Path):
-        # Extract files from SWU
+        # Extract files from SWU. Unless we write deltas, U-boot decompresses
+        # the operating system image itself ("gzwrite"). Therefore, we don't
+        # wait for the decompression on the host (see `_decompress_image`).
         logger.info("Extract files from SWU")
         multi_bundle = await MultiBundle.from_swu(
-            bundle_or_swu, logger=logger.getChild("swu")
+            bundle_or_swu, decompress=delta, logger=logger.getChild("swu")
         )
     else:
         multi_bundle = bundle_or_swu
+    # We always write the firmware image as is. Therefore, we need the
+    # decompressed version of it.
+    firmware = multi_bundle.device_bundles[device_type.value].firmware
+    if firmware.compressed_file is not None and not firmware.file.exists():
+        await decompress_file(firmware.compressed_file, logger=logger.getChild("swu"))
     # Create config image
     logger.info("Create config image")
     config_image = TEMP_DIR / "config.img"
-    await create_config_image(
+    ssh_host_key = await create_config_image(
         config_image,
         device_type=device_type,
         device_version=device_version,
@@ -155,4 +190,13 @@ async def _prepare(
         hw_ids=hw_ids,
         logger=logger.getChild("config"),
     )
-    return multi_bundle, config_image
+    return multi_bundle, config_image, ssh_host_key
+
+
+async def _decompress_image(
+    image: DiskImage, decompressed: anyio.Event, logger: Logger
+) -> None:
+    """Decompress the image on the host unless we did so already."""
+    if image.compressed_file is not None and not image.file.exists():
+        await decompress_file(image.compressed_file, logger=logger)
+    decompressed.set()
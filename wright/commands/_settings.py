@@ -18,3 +18,20 @@ class ResetDeviceSettings:
     reset_operating_system: StepSettings = StepSettings()
     reset_config: StepSettings = StepSettings()
     reset_data: StepSettings = StepSettings()
+    # Only rewrite the parts of the FLASH and MMC that differ from the images.
+    # Use this to re-provision a device that was provisioned before (e.g., a
+    # returned unit).
+    delta: bool = False
+    # Erase the entire FLASH memory before we write the firmware. Otherwise, we
+    # only erase the sectors that we write to. The rest of the FLASH memory
+    # (e.g., an old U-boot environment) stays as is.
+    wipe_flash: bool = True
+    # Write the firmware with "sf update". This skips the FLASH sectors that
+    # already match the firmware. Like `wipe_flash=False`, this leaves the rest
+    # of the FLASH memory as is.
+    update_flash: bool = False
+    # Read back each part of the images that we write and compare checksums.
+    # We rewrite the chunks that differ. This way, a rare corruption only costs
+    # us a chunk and not an entire step. Note that this reads back everything
+    # that we write. Make sure that the step timeouts allow for that.
+    verify: bool = False
@@ -29,8 +29,12 @@ async def create_config_image(
     time_zone: Optional[str] = None,
     manufacturer: Optional[str] = None,
     logger: Optional[Logger] = None,
-) -> None:
-    """Create a config.img file in the current working directory."""
+) -> str:
+    """Create a config.img file in the current working directory.
+
+    Returns the public SSH host key of the device. This way, we can connect
+    over SSH without asking the device for said key first.
+    """
     # Default arguments
     if time_zone is None:
         time_zone = "Europe/Copenhagen"
@@ -54,13 +58,14 @@ async def create_config_image(
     create_file(etc / "hosts", f"127.0.0.1 localhost\n127.0.1.1 {hostname}\n")
     create_file(etc / "timezone", f"{time_zone}\n")
     (etc / "localtime").symlink_to(f"/usr/share/zoneinfo/{time_zone}")
-    create_ssh_key_pair(etc / "ssh")
+    ssh_host_key = create_ssh_key_pair(etc / "ssh")
     create_file(etc / "hwrevision", f"{device_type.value} {device_version}\n")
     if hw_ids is not None:
         create_file(etc / "hw-ids.json", hw_ids.json())
     create_file(etc / "hw-release", _hw_release(device_type, branding, manufacturer))
     create_splash_screen(root, branding)
     await create_image(root, dest, logger=logger)
+    return ssh_host_key
 
 
 async def create_image(
@@ -102,8 +107,11 @@ def create_file(path: Path, contents: Union[str, bytes]) -> None:
         io.write(contents)
 
 
-def create_ssh_key_pair(destination_dir: Path) -> None:
-    """Create an SSH private/public key pair."""
+def create_ssh_key_pair(destination_dir: Path) -> str:
+    """Create an SSH private/public key pair.
+
+    Returns the public key in the OpenSSH format (e.g., "ssh-ed25519 AAAA...").
+    """
     private_key = Ed25519PrivateKey.generate()
     public_key = private_key.public_key()
     base_name = "ssh_host_ed25519_key"
@@ -117,13 +125,13 @@ def create_ssh_key_pair(destination_dir: Path) -> None:
                 crypto_serialization.NoEncryption(),
             )
         )
+    raw_public_key = public_key.public_bytes(
+        crypto_serialization.Encoding.OpenSSH,
+        crypto_serialization.PublicFormat.OpenSSH,
+    )
     with (destination_dir / f"{base_name}.pub").open("wb") as io:
-        io.write(
-            public_key.public_bytes(
-                crypto_serialization.Encoding.OpenSSH,
-                crypto_serialization.PublicFormat.OpenSSH,
-            )
-        )
+        io.write(raw_public_key)
+    return raw_public_key.decode()
 
 
 # The image formats supported by the secondary boot loader (U-boot
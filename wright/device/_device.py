@@ -79,7 +79,7 @@ class Device(AsyncContextManager["Device"]):
     async def hard_power_off(self) -> None:
         """Turn this device off via a hard power cut."""
         # Clear the execution context
-        self.metadata = self.metadata.update(execution_context=None)
+        self.metadata = self.metadata.update(execution_context=None, baud_rate=None)
 
     @abstractmethod
     def _power_on(self) -> None:
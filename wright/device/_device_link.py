@@ -17,6 +17,15 @@ class DeviceCommunication(FrozenModel):
     hostname: str
     # Terminal for the UART serial command line
     tty: Path = Field(default_factory=get_first_tty)
+    # Switch the serial command line to this baud rate (e.g., 921600) once we
+    # reach the prompt. This is opt-in since not all USB-serial adapters (or
+    # cables) cope with high baud rates. Leave it at `None` to stay at the
+    # default baud rate.
+    baud_rate: Optional[int] = None
+    # Record the raw serial traffic of each serial command line into a separate
+    # file in this directory. Use this to, e.g., capture transcripts for replay
+    # (see `replay_transcript`).
+    serial_transcript_dir: Optional[Path] = None
     # We use the `jtag_usb_*` fields to identify the JTAG connection to the device.
     # You can either specify:
     #
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from typing import Optional, Type
 
-from .models import Branding
+from .models import Branding, WriteJournal
 from ..model import FrozenModel
 from ..swupdate import MultiBundle
 from ._device_condition import DeviceCondition
@@ -16,3 +16,12 @@ class DeviceMetadata(FrozenModel):
     branding: Optional[Branding] = None
     condition: DeviceCondition = DeviceCondition.UNKNOWN
     execution_context: Optional[Type[AnyExecutionContext]] = None
+    # Baud rate of the serial console in the current execution context. `None`
+    # means the default baud rate.
+    baud_rate: Optional[int] = None
+    # Extents of images that we wrote to the device. We use this to resume an
+    # interrupted write.
+    write_journal: WriteJournal = WriteJournal()
+    # Public SSH host key of the device (as in the config image that we wrote
+    # to the device). We use this to connect over SSH right away.
+    ssh_host_key: Optional[str] = None
@@ -100,7 +100,9 @@ class Base(AsyncContextManager["Base"]):
         self._exited = True
         # Invalidate context if we exit with an error
         if exc_type is not None:
-            self.device.metadata = self.device.metadata.update(execution_context=None)
+            self.device.metadata = self.device.metadata.update(
+                execution_context=None, baud_rate=None
+            )
 
     def __del__(self) -> None:
         if self._entered and not self._exited:
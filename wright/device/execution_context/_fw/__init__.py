@@ -1,3 +1,4 @@
 from ._device_uboot import DeviceUboot
 from ._uboot import Uboot
 from ._wright_live_uboot import WrightLiveUboot
+from ._write_report import ExtentReport, WriteReport
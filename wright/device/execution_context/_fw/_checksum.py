@@ -0,0 +1,29 @@
+import re
+from typing import Iterable
+
+from ....util import FileExtent
+
+# U-boot's "crc32" command prints, e.g.:
+#
+#     crc32 for 06000000 ... 0600ffff ==> 6d1e2f3a
+#
+_CRC32_PATTERN = re.compile(r"==> ([0-9a-fA-F]{8})")
+
+
+def merge_extents(extents: Iterable[FileExtent]) -> list[FileExtent]:
+    """Merge adjacent extents. Assumes that the extents are sorted."""
+    result: list[FileExtent] = []
+    for extent in extents:
+        if result and result[-1].end == extent.offset:
+            previous = result.pop()
+            extent = FileExtent(previous.offset, extent.end - previous.offset)
+        result.append(extent)
+    return result
+
+
+def parse_crc32(response: str) -> int:
+    """Return the checksum in the response from U-boot's "crc32" command."""
+    match = _CRC32_PATTERN.search(response)
+    if match is None:
+        raise RuntimeError(f'Could not parse "crc32" response: {response}')
+    return int(match.group(1), 16)
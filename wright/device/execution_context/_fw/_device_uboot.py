@@ -15,6 +15,14 @@ from ._uboot import Uboot
 if TYPE_CHECKING:
     from ..._device import Device
 
+# Partition layout of the MMC (as given to U-boot's "gpt" command)
+_PARTITIONS = (
+    "name=system0,size=150MiB;"
+    "name=system1,size=150MiB;"
+    "name=config,size=100MiB;"
+    "name=data,size=0"
+)
+
 
 class DeviceUboot(Uboot):
     """The U-boot distribution installed on the device.
@@ -33,17 +41,33 @@ class DeviceUboot(Uboot):
         """Return MMC partition overview for this device."""
         return self._mmc
 
+    async def partition_mmc(self, *, force: Optional[bool] = None) -> bool:
+        """Partition the device's MMC memory.
+
+        Does nothing if the MMC already has the partitions. Set `force=True`
+        to partition the MMC anyhow.
+
+        Returns true if we partitioned the MMC. In this case, we close this
+        context. U-boot won't recognize the new partitions until you restart
+        the device.
+        """
+        if force is None:
+            force = False
+        # Early out if the partitions are already in place
+        if not force:
+            (result,) = await self.run_many(
+                [f'gpt verify mmc 0 "{_PARTITIONS}"'], check_error_code=False
+            )
+            if result.error_code == 0:
+                self.logger.info("MMC memory is already partitioned")
+                return False
+        await self._write_partitions()
+        return True
+
     @deteriorate(DeviceCondition.USED)
-    async def partition_mmc(self) -> None:
-        """Partition the device's MMC memory."""
+    async def _write_partitions(self) -> None:
         self.logger.info("Partition MMC memory")
-        await self.run(
-            'gpt write mmc 0 "'
-            "name=system0,size=150MiB;"
-            "name=system1,size=150MiB;"
-            "name=config,size=100MiB;"
-            'name=data,size=0"'
-        )
+        await self.run(f'gpt write mmc 0 "{_PARTITIONS}"')
         # U-boot won't recognize the new partitioning right away.
         # No combination of `mmc dev 0`, `mmc rescan`, etc. will do.
         # We need to restart the entire device. Therefore, we close
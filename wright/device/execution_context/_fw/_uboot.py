@@ -1,26 +1,109 @@
 from __future__ import annotations
 
+import os
+import re
+import time
 from abc import ABC
+from dataclasses import replace
+from functools import partial
 from importlib import resources
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, Optional, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Iterable,
+    Literal,
+    Optional,
+    Sequence,
+    Union,
+)
 
 from anyio.abc import TaskGroup
 from anyio.lowlevel import checkpoint
+from anyio.to_thread import run_sync
 
+from ....command_line import DEFAULT_BAUD_RATE
+from ....swupdate import IMAGE_CACHE, decompress_file
 from ....tftp import AsyncTFTPServer
-from ....util import TEMP_DIR, get_local_ip, split_file
+from ....util import (
+    TEMP_DIR,
+    FileExtent,
+    crc32_chunks,
+    crc32_combine,
+    find_extents,
+    get_chunks,
+    get_local_ip,
+)
 from ... import assets
 from ..._device_condition import DeviceCondition
+from ...models import WriteTarget, WrittenExtent
 from .._deteriorate import deteriorate
 from .._serial_base import SerialBase
-from ._mmc import MmcPartition
+from ._checksum import merge_extents, parse_crc32
+from ._mmc import Mmc, MmcPartition
+from ._write_report import ExtentReport, WriteReport
 
 if TYPE_CHECKING:
     from ..._device import Device
 
 
 MemoryAddress = Union[str, int]
+# How to erase the FLASH memory before we write to it:
+#  * "full": Erase the entire FLASH memory (a "full wipe")
+#  * "extents": Only erase the sectors that we write to
+#  * "none": Don't erase at all (the caller erased the FLASH already)
+FlashErase = Literal["full", "extents", "none"]
+
+# Size of the buffer that "gzwrite" decompresses into before it writes to the MMC
+_GZWRITE_BUFFER_SIZE = 0x100000  # 1 MiB
+_FLASH_SIZE = 0x1000000  # 16 MiB
+# The FLASH can only erase entire sectors at a time
+_FLASH_SECTOR_SIZE = 0x10000  # 64 KiB
+_FLASH_SECTOR_COUNT = _FLASH_SIZE // _FLASH_SECTOR_SIZE
+_FLASH_ERASED_BYTE = 0xFF
+# U-boot's "sf update" command prints, e.g.:
+#
+#     1048576 bytes written, 65536 bytes skipped in 2.1s, speed 499321 B/s
+#
+_SF_UPDATE_PATTERN = re.compile(r"(\d+) bytes written, (\d+) bytes skipped")
+# Default chunk sizes for delta writes
+_FLASH_CHUNK_SIZE = _FLASH_SECTOR_SIZE
+_MMC_CHUNK_SIZE = 0x100000  # 1 MiB
+# How many times we write the chunks that fail verification again before we
+# give up
+_MAX_REWRITE_ROUNDS = 3
+# U-boot's "bdinfo" command prints the RAM layout. E.g.:
+#
+#     DRAM bank   = 0x00000000
+#     -> start    = 0x00000000
+#     -> size     = 0x20000000
+#     ...
+#     relocaddr   = 0x1ff2c000
+#     sp start    = 0x1eb0ced0
+#
+_BDINFO_PATTERN = re.compile(
+    r"^\s*(-> start|-> size|relocaddr|sp start)\s*=\s*(0x[0-9a-fA-F]+)",
+    re.MULTILINE,
+)
+# Space that we leave for U-boot's stack (which grows down from "sp start")
+_STACK_MARGIN = 0x100000  # 1 MiB
+# We stream images through device memory in windows of a multiple of this size.
+# This is a multiple of both the MMC and FLASH sector sizes.
+_MEMORY_WINDOW_ALIGNMENT = 0x100000  # 1 MiB
+# Window size if we can't make sense of "bdinfo"
+_DEFAULT_MEMORY_WINDOW_SIZE = 0x4000000  # 64 MiB
+# U-boot's "mmc info" command prints, e.g.:
+#
+#     Erase Group Size: 512 KiB
+#
+_MMC_ERASE_GROUP_PATTERN = re.compile(
+    r"Erase Group Size:\s*(\d+(?:\.\d+)?)\s*(Bytes|KiB|MiB|GiB)"
+)
+_SIZE_UNITS = {"Bytes": 1, "KiB": 0x400, "MiB": 0x100000, "GiB": 0x40000000}
+# Erase group size if we can't make sense of "mmc info". We err on the large side.
+_DEFAULT_MMC_ERASE_GROUP_SIZE = 0x800000  # 8 MiB
 
 
 class Uboot(SerialBase, ABC):
@@ -34,58 +117,1048 @@ class Uboot(SerialBase, ABC):
         self._initialized_network = False
         self._initialized_usb = False
         self._probed_flash = False
+        self._has_gzwrite: Optional[bool] = None
+        self._memory_window_size: Optional[int] = None
+        self._mmc_erase_group_size: Optional[int] = None
         # TFTP (for file transfers)
         self._tftp_host = get_local_ip()
         self._tftp_port = 6969
+        self._tftp_server: Optional[AsyncTFTPServer] = None
 
     @deteriorate(DeviceCondition.USED)
-    async def write_image_to_mmc(self, file: Path, *partitions: MmcPartition) -> None:
-        """Write file system image from host to device's MMC."""
-        await self.copy_to_memory(file)
+    async def write_image_to_mmc(
+        self,
+        file: Path,
+        *partitions: MmcPartition,
+        erase_remainder: Optional[bool] = None,
+        compressed_file: Optional[Path] = None,
+        delta: Optional[bool] = None,
+        verify: Optional[bool] = None,
+        chunk_size: Optional[int] = None,
+        cache: Optional[bool] = None,
+    ) -> WriteReport:
+        """Write file system image from host to device's MMC.
+
+        We only write the sectors that the image occupies. The rest of each
+        partition stays as is unless you set `erase_remainder=True`. In that
+        case, we erase the rest of each partition (see `_erase_mmc_region`).
+
+        We stream the image through device memory one window at a time (see
+        `_get_memory_window_size`). Therefore, the image doesn't have to fit in
+        device memory.
+
+        If you give us a gzip-compressed version of the image, we transfer that
+        instead and let the device decompress it. We fall back on the
+        uncompressed image if the device can't decompress it.
+
+        Set `delta=True` to only write the chunks (of `chunk_size` bytes) that
+        differ from what is already on the device. We compare CRC32 checksums.
+        Use this to, e.g., re-provision a device that already has (most of) the
+        image. This ignores `compressed_file`.
+
+        Set `verify=True` to read each written extent back and compare CRC32
+        checksums chunk by chunk (of `chunk_size` bytes). We write the chunks
+        that differ again.
+
+        We resume where a previous write left off (e.g., due to a USB timeout).
+        That is, we skip the extents that are in the device's write journal
+        (see `WriteJournal`) if the device still has them. Delta writes are
+        inherently resumable so they don't use the journal.
+
+        We look up the checksums of the image in `IMAGE_CACHE`. Set
+        `cache=False` for one-off images (e.g., a per-device config image).
+        """
+        if erase_remainder is None:
+            erase_remainder = False
+        if delta is None:
+            delta = False
+        if verify is None:
+            verify = False
+        if chunk_size is None:
+            chunk_size = _MMC_CHUNK_SIZE
+        if chunk_size % Mmc.sector_size != 0:
+            raise ValueError(f"Chunk size must be a multiple of {Mmc.sector_size}")
+        if cache is None:
+            cache = True
+        start = time.perf_counter()
+        report: Optional[WriteReport] = None
+        if compressed_file is not None and not delta:
+            report = await self._write_compressed_image_to_mmc(
+                file, compressed_file, partitions, verify, chunk_size
+            )
+        if report is None:
+            await self._decompress_on_host(file, compressed_file)
+            if delta:
+                report = await self._write_image_to_mmc_delta(
+                    file, partitions, verify, chunk_size, cache
+                )
+            else:
+                report = await self._write_image_to_mmc_full(
+                    file, partitions, verify, chunk_size, cache
+                )
+        if erase_remainder:
+            sector_count = -(-report.size // Mmc.sector_size)
+            for partition in partitions:
+                remainder = partition.length - sector_count
+                if remainder > 0:
+                    await self._erase_mmc_region(
+                        partition.offset + sector_count, remainder
+                    )
+        report = replace(report, duration=time.perf_counter() - start)
+        self.logger.info("Wrote %s to MMC: %s", str(file), report)
+        return report
+
+    async def _write_image_to_mmc_full(
+        self,
+        file: Path,
+        partitions: Sequence[MmcPartition],
+        verify: bool,
+        chunk_size: int,
+        cache: bool,
+    ) -> WriteReport:
+        _get_sector_count(file, partitions)
+        extent = FileExtent(0, file.stat().st_size)
+        return await self._write_extents_to_mmc(
+            file, [extent], partitions, verify, chunk_size, cache
+        )
+
+    async def _write_image_to_mmc_delta(
+        self,
+        file: Path,
+        partitions: Sequence[MmcPartition],
+        verify: bool,
+        chunk_size: int,
+        cache: bool,
+    ) -> WriteReport:
+        sector_size = Mmc.sector_size
+        _get_sector_count(file, partitions)
+        window_size = await self._get_memory_window_size()
+        size = file.stat().st_size
+        chunks = get_chunks(size, chunk_size)
+        expected = await _crc32_chunks(file, chunks, cache=cache)
+        address_hex = await self._resolve_memory_address_to_hex()
+        bytes_transferred = 0
+        bytes_written = 0
+        chunks_changed = 0
+        extent_reports: list[ExtentReport] = []
         for partition in partitions:
-            await self.write_memory_to_mmc(partition)
+            self.logger.info(f'Compare image with "{partition}"')
+            actual = await self._crc32_device_regions(
+                [
+                    f"mmc read {address_hex} "
+                    f"{hex(partition.offset + chunk.offset // sector_size)} "
+                    f"{hex(-(-chunk.length // sector_size))}"
+                    for chunk in chunks
+                ],
+                [chunk.length for chunk in chunks],
+            )
+            changed = [chunk for chunk, e, a in zip(chunks, expected, actual) if e != a]
+            chunks_changed += len(changed)
+            runs = _split_extents(merge_extents(changed), window_size)
+            for extent in runs:
+                extent_start = time.perf_counter()
+                await self.copy_range_to_memory(file, extent.offset, extent.length)
+                sector_count = -(-extent.length // sector_size)
+                await self.write_memory_to_mmc(
+                    partition,
+                    sector_offset=extent.offset // sector_size,
+                    sector_count=sector_count,
+                )
+                bytes_transferred += extent.length
+                bytes_written += sector_count * sector_size
+                retries = 0
+                if verify:
+                    retries = await self._verify_mmc_extent(
+                        file, extent, (partition,), chunk_size
+                    )
+                extent_reports.append(_extent_report(extent, retries, extent_start))
+        return WriteReport(
+            size=size,
+            bytes_transferred=bytes_transferred,
+            bytes_written=bytes_written,
+            chunks_compared=len(chunks) * len(partitions),
+            chunks_changed=chunks_changed,
+            extents=tuple(extent_reports),
+        )
+
+    @deteriorate(DeviceCondition.USED)
+    async def write_sparse_image_to_mmc(
+        self,
+        file: Path,
+        *partitions: MmcPartition,
+        erased: Optional[bool] = None,
+        compressed_file: Optional[Path] = None,
+        verify: Optional[bool] = None,
+        chunk_size: Optional[int] = None,
+        cache: Optional[bool] = None,
+    ) -> WriteReport:
+        """Write file system image from host to device's MMC but skip null extents.
+
+        We only transfer the non-null extents of the image. We fill the null
+        extents in between from a buffer of null bytes in device memory. Set
+        `erased=True` if the partitions already hold null bytes outside the
+        extents. In that case, we don't touch the null extents at all.
+
+        We never use "mmc erase" for the null extents. The MMC erases entire
+        erase groups (often 512 KiB or more) so an erase may hit the extents
+        next to it. Moreover, some MMCs read erased sectors back as 0xFF.
+
+        If you give us a gzip-compressed version of the image, we prefer that
+        over the sparse transfer (see `write_image_to_mmc`).
+
+        Set `verify=True` to verify each written extent. Like `write_image_to_mmc`,
+        we resume where a previous write left off and use `IMAGE_CACHE` unless
+        you set `cache=False`.
+        """
+        if erased is None:
+            erased = False
+        if verify is None:
+            verify = False
+        if chunk_size is None:
+            chunk_size = _MMC_CHUNK_SIZE
+        if chunk_size % Mmc.sector_size != 0:
+            raise ValueError(f"Chunk size must be a multiple of {Mmc.sector_size}")
+        if cache is None:
+            cache = True
+        start = time.perf_counter()
+        report: Optional[WriteReport] = None
+        if compressed_file is not None:
+            report = await self._write_compressed_image_to_mmc(
+                file, compressed_file, partitions, verify, chunk_size
+            )
+        if report is None:
+            await self._decompress_on_host(file, compressed_file)
+            report = await self._write_sparse_image_to_mmc(
+                file, partitions, erased, verify, chunk_size, cache
+            )
+        report = replace(report, duration=time.perf_counter() - start)
+        self.logger.info("Wrote %s to MMC: %s", str(file), report)
+        return report
+
+    async def _write_sparse_image_to_mmc(
+        self,
+        file: Path,
+        partitions: Sequence[MmcPartition],
+        erased: bool,
+        verify: bool,
+        chunk_size: int,
+        cache: bool,
+    ) -> WriteReport:
+        sector_size = Mmc.sector_size
+        sector_count = _get_sector_count(file, partitions)
+        extents = await _find_extents(file, cache=cache)
+        report = await self._write_extents_to_mmc(
+            file, extents, partitions, verify, chunk_size, cache
+        )
+        if not erased:
+            # Fill the gaps between the extents with null bytes
+            gaps = _get_gaps(extents, sector_count * sector_size, sector_size)
+            self.logger.info("Write %d null extents to the MMC", len(gaps))
+            await self._zero_fill_mmc(
+                [
+                    (
+                        partition.offset + gap.offset // sector_size,
+                        gap.length // sector_size,
+                    )
+                    for partition in partitions
+                    for gap in gaps
+                ]
+            )
+            gap_size = sum(gap.length for gap in gaps)
+            report = replace(
+                report, bytes_written=report.bytes_written + gap_size * len(partitions)
+            )
+        return report
+
+    async def _write_extents_to_mmc(
+        self,
+        file: Path,
+        extents: Sequence[FileExtent],
+        partitions: Sequence[MmcPartition],
+        verify: bool,
+        chunk_size: int,
+        cache: bool,
+    ) -> WriteReport:
+        """Write the given extents of the image to each of the MMC partitions.
+
+        We stream the extents through device memory one window at a time. This
+        way, the image doesn't have to fit in memory. We transfer each window
+        once and write it to all partitions.
+        """
+        sector_size = Mmc.sector_size
+        window_size = await self._get_memory_window_size()
+        extents = _split_extents(extents, window_size)
+        crcs = await _crc32_chunks(file, extents, cache=cache)
+        # Skip the extents that we wrote already (e.g., in a previous try)
+        pairs = [
+            (extent, crc, partition)
+            for extent, crc in zip(extents, crcs)
+            for partition in partitions
+        ]
+        written = await self._find_written(
+            [
+                _mmc_written_extent(partition, extent, crc)
+                for extent, crc, partition in pairs
+            ]
+        )
+        done = {
+            (extent, partition)
+            for (extent, _, partition), is_written in zip(pairs, written)
+            if is_written
+        }
+        bytes_transferred = 0
+        bytes_written = 0
+        extent_reports: list[ExtentReport] = []
+        for extent, crc in zip(extents, crcs):
+            extent_start = time.perf_counter()
+            remaining = [
+                partition for partition in partitions if (extent, partition) not in done
+            ]
+            if not remaining:
+                extent_reports.append(
+                    _extent_report(extent, 0, extent_start, resumed=True)
+                )
+                continue
+            await self.copy_range_to_memory(file, extent.offset, extent.length)
+            bytes_transferred += extent.length
+            extent_sector_count = -(-extent.length // sector_size)
+            for partition in remaining:
+                await self.write_memory_to_mmc(
+                    partition,
+                    sector_offset=extent.offset // sector_size,
+                    sector_count=extent_sector_count,
+                )
+                bytes_written += extent_sector_count * sector_size
+            retries = 0
+            if verify:
+                retries = await self._verify_mmc_extent(
+                    file, extent, remaining, chunk_size
+                )
+            for partition in remaining:
+                self._journal_written(_mmc_written_extent(partition, extent, crc))
+            extent_reports.append(_extent_report(extent, retries, extent_start))
+        return WriteReport(
+            size=file.stat().st_size,
+            bytes_transferred=bytes_transferred,
+            bytes_written=bytes_written,
+            extents=tuple(extent_reports),
+        )
 
     @deteriorate(DeviceCondition.USED)
     async def write_memory_to_mmc(
-        self, partition: MmcPartition, *, memory_address: Optional[MemoryAddress] = None
+        self,
+        partition: MmcPartition,
+        *,
+        sector_offset: Optional[int] = None,
+        sector_count: Optional[int] = None,
+        memory_address: Optional[MemoryAddress] = None,
     ) -> None:
         """Write from device memory to the given MMC partition.
 
-        Use this to write an in-memory file system image to the MMC.
+        Use this to write an in-memory file system image to the MMC. Writes
+        `sector_count` sectors starting `sector_offset` sectors into the
+        partition (defaults to the entire partition).
         """
+        if sector_offset is None:
+            sector_offset = 0
+        if sector_count is None:
+            sector_count = partition.length - sector_offset
         memory_address_hex = await self._resolve_memory_address_to_hex(memory_address)
-        self.logger.info(f'Write memory at {memory_address_hex} to "{partition}"')
+        self.logger.info(
+            f'Write memory at {memory_address_hex} to "{partition}" '
+            f"(offset:{sector_offset} count:{sector_count} sectors)"
+        )
         await self.run(
             f"mmc write {memory_address_hex} "
-            f"{hex(partition.offset)} "
-            f"{hex(partition.length)}"
+            f"{hex(partition.offset + sector_offset)} "
+            f"{hex(sector_count)}"
+        )
+
+    async def _write_compressed_image_to_mmc(
+        self,
+        file: Path,
+        compressed_file: Path,
+        partitions: Sequence[MmcPartition],
+        verify: bool,
+        chunk_size: int,
+    ) -> Optional[WriteReport]:
+        """Write the gzip-compressed image to the MMC with "gzwrite".
+
+        The device decompresses the image on the fly. This way, we only transfer
+        the compressed image. To verify the result, we need the decompressed
+        image (`file`) on the host as well.
+
+        Returns `None` (and does nothing) if U-boot doesn't have "gzwrite" or if
+        the compressed image doesn't fit in device memory.
+        """
+        # Early out if U-boot can't decompress the image
+        if not await self._probe_gzwrite():
+            return None
+        # Early out if the compressed image doesn't fit in device memory. Note
+        # that "gzwrite" needs the entire compressed image in memory.
+        window_size = await self._get_memory_window_size()
+        if compressed_file.stat().st_size > window_size:
+            self.logger.info(
+                "%s doesn't fit in device memory. "
+                "We fall back on uncompressed transfers.",
+                str(compressed_file),
+            )
+            return None
+        start = time.perf_counter()
+        size = _get_gzip_size(compressed_file)
+        sector_count = _get_sector_count(compressed_file, partitions, size=size)
+        extent = FileExtent(0, size)
+        # The gzip trailer tells us the CRC32 checksum of the image. Therefore,
+        # we don't need the decompressed image to resume a previous try.
+        crc = _get_gzip_crc32(compressed_file)
+        remaining = await self._find_remaining_partitions(extent, crc, partitions)
+        if not remaining:
+            return WriteReport(
+                size=size,
+                bytes_transferred=0,
+                bytes_written=0,
+                extents=(_extent_report(extent, 0, start, resumed=True),),
+            )
+        await self.copy_to_memory(compressed_file)
+        memory_address_hex = await self._resolve_memory_address_to_hex()
+        length_hex = hex(compressed_file.stat().st_size)
+        for partition in remaining:
+            self.logger.info(
+                f'Decompress memory at {memory_address_hex} to "{partition}" '
+                f"({sector_count} sectors)"
+            )
+            # Note that "gzwrite" takes the offset in bytes (not sectors)
+            offset_hex = hex(partition.offset * Mmc.sector_size)
+            await self.run(
+                f"gzwrite mmc 0 {memory_address_hex} {length_hex} "
+                f"{hex(_GZWRITE_BUFFER_SIZE)} {offset_hex}"
+            )
+        retries = 0
+        if verify:
+            await self._decompress_on_host(file, compressed_file)
+            retries = await self._verify_mmc_extent(file, extent, remaining, chunk_size)
+        for partition in remaining:
+            self._journal_written(_mmc_written_extent(partition, extent, crc))
+        return WriteReport(
+            size=size,
+            bytes_transferred=compressed_file.stat().st_size,
+            bytes_written=size * len(remaining),
+            extents=(_extent_report(extent, retries, start),),
+        )
+
+    async def _find_remaining_partitions(
+        self, extent: FileExtent, crc: int, partitions: Sequence[MmcPartition]
+    ) -> list[MmcPartition]:
+        """Return the partitions that don't have the given extent yet."""
+        written = await self._find_written(
+            [_mmc_written_extent(partition, extent, crc) for partition in partitions]
         )
+        return [
+            partition
+            for partition, is_written in zip(partitions, written)
+            if not is_written
+        ]
+
+    async def _get_memory_window_size(self) -> int:
+        """Return the number of bytes that fit at the default memory address.
+
+        We derive this from the RAM layout that "bdinfo" reports. U-boot itself
+        (code, heap, and stack) lives at the top of RAM. We stay clear of that.
+
+        Only probes on the first call. Returns a cached value on subsequent calls.
+        """
+        if self._memory_window_size is not None:
+            await checkpoint()
+            return self._memory_window_size
+        (result,) = await self.run_many(["bdinfo"], check_error_code=False)
+        window_size = None
+        if result.error_code == 0:
+            window_size = _parse_memory_window_size(
+                result.response, self._default_memory_address
+            )
+        if window_size is None:
+            window_size = _DEFAULT_MEMORY_WINDOW_SIZE
+            self.logger.warning(
+                'Could not determine the RAM layout from "bdinfo". '
+                "We assume that %s bytes fit in device memory.",
+                hex(window_size),
+            )
+        self.logger.info("Stream images in windows of %s bytes", hex(window_size))
+        self._memory_window_size = window_size
+        return window_size
+
+    async def _probe_gzwrite(self) -> bool:
+        """Return true if U-boot has the "gzwrite" command.
+
+        Only probes on the first call. Returns a cached value on subsequent calls.
+        """
+        if self._has_gzwrite is None:
+            (result,) = await self.run_many(["help gzwrite"], check_error_code=False)
+            self._has_gzwrite = result.error_code == 0
+            if not self._has_gzwrite:
+                self.logger.info(
+                    'U-boot has no "gzwrite" command. '
+                    "We fall back on uncompressed transfers."
+                )
+        return self._has_gzwrite
+
+    async def _decompress_on_host(
+        self, file: Path, compressed_file: Optional[Path]
+    ) -> None:
+        """Decompress the image on the host if we didn't do so already."""
+        if file.exists() or compressed_file is None:
+            await checkpoint()
+            return
+        self.logger.info("Decompress %s on the host", str(compressed_file))
+        await decompress_file(compressed_file, logger=self.logger)
+
+    async def _zero_fill_mmc(self, regions: Sequence[tuple[int, int]]) -> None:
+        """Write null bytes to the given regions of the MMC.
+
+        Each region is a sector offset (relative to the start of the MMC) and a
+        sector count. Unlike "mmc erase", this only touches the given sectors.
+
+        We fill a window of device memory with null bytes once and write said
+        window to each region. This way, we don't transfer anything.
+        """
+        # Early out if there is nothing to fill
+        if not regions:
+            await checkpoint()
+            return
+        sector_size = Mmc.sector_size
+        window_sector_count = await self._get_memory_window_size() // sector_size
+        buffer_sector_count = min(
+            window_sector_count, max(count for _, count in regions)
+        )
+        address_hex = await self._resolve_memory_address_to_hex()
+        commands = [f"mw.b {address_hex} 0 {hex(buffer_sector_count * sector_size)}"]
+        for offset, count in regions:
+            self._journal_erased("mmc", offset * sector_size, count * sector_size)
+            commands += [
+                f"mmc write {address_hex} {hex(offset + chunk.offset)} "
+                f"{hex(chunk.length)}"
+                for chunk in get_chunks(count, buffer_sector_count)
+            ]
+        await self.run_many(commands)
+
+    async def _erase_mmc_region(self, offset: int, length: int) -> None:
+        """Erase the given sectors of the MMC without touching any other sectors.
+
+        The MMC erases entire erase groups. Depending on the version, U-boot
+        silently rounds an unaligned "mmc erase" to said groups. Therefore, we
+        only erase the whole erase groups within the region. We fill the
+        unaligned head and tail of the region with null bytes instead.
+        """
+        group_sector_count = await self._get_mmc_erase_group_size() // Mmc.sector_size
+        end = offset + length
+        aligned_start = -(-offset // group_sector_count) * group_sector_count
+        aligned_end = end // group_sector_count * group_sector_count
+        # Early out if the region doesn't span a single erase group
+        if aligned_start >= aligned_end:
+            await self._zero_fill_mmc([(offset, length)])
+            return
+        await self._zero_fill_mmc(
+            [
+                (region_offset, region_length)
+                for region_offset, region_length in (
+                    (offset, aligned_start - offset),
+                    (aligned_end, end - aligned_end),
+                )
+                if region_length > 0
+            ]
+        )
+        await self.erase_mmc(aligned_start, aligned_end - aligned_start)
+
+    async def _get_mmc_erase_group_size(self) -> int:
+        """Return the erase group size of the MMC [bytes].
+
+        Only probes on the first call. Returns a cached value on subsequent calls.
+        """
+        if self._mmc_erase_group_size is not None:
+            await checkpoint()
+            return self._mmc_erase_group_size
+        (result,) = await self.run_many(["mmc info"], check_error_code=False)
+        match = _MMC_ERASE_GROUP_PATTERN.search(result.response)
+        if result.error_code == 0 and match is not None:
+            group_size = int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+        else:
+            group_size = _DEFAULT_MMC_ERASE_GROUP_SIZE
+            self.logger.warning(
+                'Could not determine the erase group size from "mmc info". '
+                "We assume %s bytes.",
+                hex(group_size),
+            )
+        self._mmc_erase_group_size = group_size
+        return group_size
 
     @deteriorate(DeviceCondition.USED)
-    async def write_image_to_flash(self, file: Path) -> None:
+    async def erase_mmc(self, offset: int, length: int) -> None:
+        """Erase the given sectors of the MMC."""
+        self.logger.info("Erase MMC (offset:%s length:%s)", hex(offset), hex(length))
+        self._journal_erased("mmc", offset * Mmc.sector_size, length * Mmc.sector_size)
+        await self.run(f"mmc erase {hex(offset)} {hex(length)}")
+
+    @deteriorate(DeviceCondition.USED)
+    async def write_image_to_flash(
+        self,
+        file: Path,
+        *,
+        erase: Optional[FlashErase] = None,
+        update: Optional[bool] = None,
+        delta: Optional[bool] = None,
+        verify: Optional[bool] = None,
+        chunk_size: Optional[int] = None,
+    ) -> WriteReport:
         """Write the given image file to the FLASH memory on this device.
 
-        Remember to erase the FLASH memory first.
+        Per default, we don't erase the FLASH memory first. Remember to do so
+        yourself or use the `erase` argument (see `FlashErase`).
+
+        Set `update=True` to write with "sf update". This skips the sectors that
+        already match the image. It also erases the sectors that don't. In this
+        mode, `erase="extents"` is implicit.
+
+        Set `delta=True` to only erase and write the chunks (of `chunk_size`
+        bytes) that differ from what is already on the device. We compare CRC32
+        checksums. In this mode, we ignore `erase` and `update`. The result is
+        the same as a full erase followed by a regular write.
+
+        Set `verify=True` to read each written extent back and compare CRC32
+        checksums chunk by chunk (of `chunk_size` bytes). We erase and write
+        the chunks that differ again.
+
+        We resume where a previous regular write left off (e.g., due to a USB
+        timeout). That is, we skip the extents that are in the device's write
+        journal (see `WriteJournal`) if the device still has them. In this case,
+        `erase="full"` spares said extents.
         """
+        if erase is None:
+            erase = "none"
+        if update is None:
+            update = False
+        if delta is None:
+            delta = False
+        if verify is None:
+            verify = False
+        if chunk_size is None:
+            chunk_size = _FLASH_CHUNK_SIZE
+        if chunk_size % _FLASH_SECTOR_SIZE != 0:
+            raise ValueError(f"Chunk size must be a multiple of {_FLASH_SECTOR_SIZE}")
+        start = time.perf_counter()
         # An image usually consists mostly of null-bytes. We can skip
         # said null bytes. This saves us a lot of transfer time.
         #
-        # We actually don't need to physically split the files anymore.
-        # This is a remnant from the days of the Xilinx' program_flash utility.
-        # TODO: Use offsets into the firmware image instead.
-        parts = split_file(file)
-        for part in parts:
-            await self.copy_to_memory(part.path)
-            length = part.path.stat().st_size
-            await self.write_memory_to_flash(part.offset, length)
+        # We transfer each non-null extent directly from the image. There
+        # is no need to split the image into separate files.
+        extents = await _find_extents(file)
+        if delta:
+            report = await self._write_image_to_flash_delta(
+                file, extents, verify, chunk_size
+            )
+        elif update:
+            report = await self._update_flash(file, extents, verify, chunk_size)
+        else:
+            report = await self._write_image_to_flash_extents(
+                file, extents, erase, verify, chunk_size
+            )
+        report = replace(report, duration=time.perf_counter() - start)
+        self.logger.info("Wrote %s to FLASH: %s", str(file), report)
+        return report
+
+    async def _write_image_to_flash_extents(
+        self,
+        file: Path,
+        extents: Sequence[FileExtent],
+        erase: FlashErase,
+        verify: bool,
+        chunk_size: int,
+    ) -> WriteReport:
+        # Stream the image through device memory one window at a time
+        extents = _split_extents(extents, await self._get_memory_window_size())
+        crcs = await _crc32_chunks(file, extents)
+        # Skip the extents that we wrote already (e.g., in a previous try)
+        await self._probe_flash()
+        written = await self._find_written(
+            [_flash_written_extent(extent, crc) for extent, crc in zip(extents, crcs)]
+        )
+        sectors_erased = 0
+        if erase == "full":
+            # Erase everything except the extents that we wrote already
+            kept = [extent for extent, done in zip(extents, written) if done]
+            for gap in _get_gaps(kept, _FLASH_SIZE, _FLASH_SECTOR_SIZE):
+                await self.erase_flash(gap.offset, gap.length)
+                sectors_erased += gap.length // _FLASH_SECTOR_SIZE
+        bytes_transferred = 0
+        extent_reports: list[ExtentReport] = []
+        for extent, crc, is_written in zip(extents, crcs, written):
+            extent_start = time.perf_counter()
+            if is_written:
+                extent_reports.append(
+                    _extent_report(extent, 0, extent_start, resumed=True)
+                )
+                continue
+            if erase == "extents":
+                await self.erase_flash(extent.offset, extent.length)
+                sectors_erased += -(-extent.length // _FLASH_SECTOR_SIZE)
+            await self.copy_range_to_memory(file, extent.offset, extent.length)
+            await self.write_memory_to_flash(extent.offset, extent.length)
+            bytes_transferred += extent.length
+            retries = 0
+            if verify:
+                retries = await self._verify_flash_extent(file, extent, chunk_size)
+            self._journal_written(_flash_written_extent(extent, crc))
+            extent_reports.append(_extent_report(extent, retries, extent_start))
+        # We don't know what the caller erased (if anything)
+        sectors_skipped = 0
+        if erase != "none":
+            sectors_skipped = _FLASH_SECTOR_COUNT - sectors_erased
+        return WriteReport(
+            size=file.stat().st_size,
+            bytes_transferred=bytes_transferred,
+            bytes_written=bytes_transferred,
+            sectors_erased=sectors_erased,
+            sectors_skipped=sectors_skipped,
+            extents=tuple(extent_reports),
+        )
+
+    async def _write_image_to_flash_delta(
+        self,
+        file: Path,
+        extents: Sequence[FileExtent],
+        verify: bool,
+        chunk_size: int,
+    ) -> WriteReport:
+        # We compare the entire FLASH memory. After a regular erase and write,
+        # everything outside the extents is erased.
+        chunks = get_chunks(_FLASH_SIZE, chunk_size)
+        expected = await _crc32_chunks(
+            file, chunks, extents=extents, fill=_FLASH_ERASED_BYTE
+        )
+        await self._probe_flash()
+        self.logger.info("Compare image with FLASH")
+        address_hex = await self._resolve_memory_address_to_hex()
+        actual = await self._crc32_device_regions(
+            [
+                f"sf read {address_hex} {hex(chunk.offset)} {hex(chunk.length)}"
+                for chunk in chunks
+            ],
+            [chunk.length for chunk in chunks],
+        )
+        changed = [chunk for chunk, e, a in zip(chunks, expected, actual) if e != a]
+        window_size = await self._get_memory_window_size()
+        bytes_transferred = 0
+        sectors_erased = 0
+        extent_reports: list[ExtentReport] = []
+        for run in merge_extents(changed):
+            sectors_erased += -(-run.length // _FLASH_SECTOR_SIZE)
+            await self.erase_flash(run.offset, run.length)
+            # Write the parts of the image that fall within the erased region
+            parts: list[FileExtent] = []
+            for extent in extents:
+                start = max(extent.offset, run.offset)
+                end = min(extent.end, run.end)
+                if start < end:
+                    parts.append(FileExtent(start, end - start))
+            for part in _split_extents(parts, window_size):
+                extent_start = time.perf_counter()
+                await self.copy_range_to_memory(file, part.offset, part.length)
+                await self.write_memory_to_flash(part.offset, part.length)
+                bytes_transferred += part.length
+                retries = 0
+                if verify:
+                    retries = await self._verify_flash_extent(file, part, chunk_size)
+                extent_reports.append(_extent_report(part, retries, extent_start))
+        return WriteReport(
+            size=file.stat().st_size,
+            bytes_transferred=bytes_transferred,
+            bytes_written=bytes_transferred,
+            chunks_compared=len(chunks),
+            chunks_changed=len(changed),
+            sectors_erased=sectors_erased,
+            sectors_skipped=_FLASH_SECTOR_COUNT - sectors_erased,
+            extents=tuple(extent_reports),
+        )
+
+    async def _update_flash(
+        self,
+        file: Path,
+        extents: Sequence[FileExtent],
+        verify: bool,
+        chunk_size: int,
+    ) -> WriteReport:
+        """Write the extents of the image to FLASH with "sf update"."""
+        await self._probe_flash()
+        address = await self._resolve_memory_address()
+        # Stream the image through device memory one window at a time
+        extents = _split_extents(extents, await self._get_memory_window_size())
+        bytes_written = 0
+        sectors_erased = 0
+        extent_reports: list[ExtentReport] = []
+        for extent in extents:
+            if extent.offset % _FLASH_SECTOR_SIZE != 0:
+                raise ValueError(f"Extent {extent} is not aligned to a FLASH sector")
+            extent_start = time.perf_counter()
+            await self.copy_range_to_memory(file, extent.offset, extent.length)
+            # "sf update" works on entire sectors. We pad the last sector with
+            # erased bytes so that we don't write garbage from memory.
+            sector_count = -(-extent.length // _FLASH_SECTOR_SIZE)
+            padded_length = sector_count * _FLASH_SECTOR_SIZE
+            padding = padded_length - extent.length
+            if padding:
+                await self.run(
+                    f"mw.b {hex(address + extent.length)} "
+                    f"{hex(_FLASH_ERASED_BYTE)} {hex(padding)}"
+                )
+            self.logger.info(
+                "Update FLASH (offset:%s length:%s)",
+                hex(extent.offset),
+                hex(padded_length),
+            )
+            response = await self.run(
+                f"sf update {hex(address)} {hex(extent.offset)} {hex(padded_length)}"
+            )
+            match = _SF_UPDATE_PATTERN.search(response)
+            # Assume the worst if we can't tell what "sf update" did
+            written = padded_length if match is None else int(match.group(1))
+            bytes_written += written
+            sectors_erased += written // _FLASH_SECTOR_SIZE
+            retries = 0
+            if verify:
+                retries = await self._verify_flash_extent(file, extent, chunk_size)
+            extent_reports.append(_extent_report(extent, retries, extent_start))
+        return WriteReport(
+            size=file.stat().st_size,
+            bytes_transferred=sum(extent.length for extent in extents),
+            bytes_written=bytes_written,
+            sectors_erased=sectors_erased,
+            sectors_skipped=_FLASH_SECTOR_COUNT - sectors_erased,
+            extents=tuple(extent_reports),
+        )
+
+    async def _verify_flash_extent(
+        self, file: Path, extent: FileExtent, chunk_size: int
+    ) -> int:
+        """Verify the given extent of the image in the FLASH memory.
+
+        We erase and write the chunks that differ again. Said chunks must start
+        at a sector boundary. Returns the number of rewritten chunks.
+        """
+        address_hex = await self._resolve_memory_address_to_hex()
+
+        def read_command(chunk: FileExtent) -> str:
+            return _flash_read_command(address_hex, chunk)
+
+        async def rewrite(chunk: FileExtent) -> None:
+            await self.erase_flash(chunk.offset, chunk.length)
+            await self.copy_range_to_memory(file, chunk.offset, chunk.length)
+            await self.write_memory_to_flash(chunk.offset, chunk.length)
+
+        return await self._verify_extent(
+            file, extent, chunk_size, read_command, rewrite
+        )
+
+    async def _verify_mmc_extent(
+        self,
+        file: Path,
+        extent: FileExtent,
+        partitions: Sequence[MmcPartition],
+        chunk_size: int,
+    ) -> int:
+        """Verify the given extent of the image in each of the MMC partitions.
+
+        We write the chunks that differ again. Returns the number of rewritten
+        chunks (across all partitions).
+        """
+        retries = 0
+        for partition in partitions:
+            retries += await self._verify_mmc_partition_extent(
+                file, extent, partition, chunk_size
+            )
+        return retries
+
+    async def _verify_mmc_partition_extent(
+        self,
+        file: Path,
+        extent: FileExtent,
+        partition: MmcPartition,
+        chunk_size: int,
+    ) -> int:
+        sector_size = Mmc.sector_size
+        address_hex = await self._resolve_memory_address_to_hex()
+
+        def read_command(chunk: FileExtent) -> str:
+            return _mmc_read_command(address_hex, partition, chunk)
+
+        async def rewrite(chunk: FileExtent) -> None:
+            await self.copy_range_to_memory(file, chunk.offset, chunk.length)
+            await self.write_memory_to_mmc(
+                partition,
+                sector_offset=chunk.offset // sector_size,
+                sector_count=-(-chunk.length // sector_size),
+            )
+
+        return await self._verify_extent(
+            file, extent, chunk_size, read_command, rewrite
+        )
+
+    async def _verify_extent(
+        self,
+        file: Path,
+        extent: FileExtent,
+        chunk_size: int,
+        read_command: Callable[[FileExtent], str],
+        rewrite: Callable[[FileExtent], Awaitable[None]],
+    ) -> int:
+        """Verify the given extent of the image on the device.
+
+        We split the extent into chunks and compare the CRC32 checksum of each
+        chunk with the device. `read_command` must copy the given chunk from
+        storage to the default memory address. We `rewrite` the chunks that
+        differ and compare them again. This way, a corrupt chunk only costs us
+        said chunk.
+
+        Returns the number of rewritten chunks. Raises `RuntimeError` if a chunk
+        still differs after `_MAX_REWRITE_ROUNDS` rewrites.
+        """
+        chunks = [
+            FileExtent(extent.offset + chunk.offset, chunk.length)
+            for chunk in get_chunks(extent.length, chunk_size)
+        ]
+        # The extent is at most one memory window. We checksum it directly
+        # so that we don't need the cache (and its analysis of the image).
+        expected = await _crc32_chunks(file, chunks, cache=False)
+        self.logger.info(
+            "Verify %s (offset:%s length:%s)",
+            str(file),
+            hex(extent.offset),
+            hex(extent.length),
+        )
+        retries = 0
+        for round_ in range(_MAX_REWRITE_ROUNDS + 1):
+            actual = await self._crc32_device_regions(
+                [read_command(chunk) for chunk in chunks],
+                [chunk.length for chunk in chunks],
+            )
+            failed = [i for i, (e, a) in enumerate(zip(expected, actual)) if e != a]
+            # Early out if everything matches
+            if not failed:
+                return retries
+            chunks = [chunks[i] for i in failed]
+            expected = [expected[i] for i in failed]
+            if round_ == _MAX_REWRITE_ROUNDS:
+                break
+            self.logger.warning(
+                "%d chunks failed verification. We write them again.", len(chunks)
+            )
+            for chunk in chunks:
+                await rewrite(chunk)
+            retries += len(chunks)
+        raise RuntimeError(
+            f"Could not write {file} (offset:{hex(chunks[0].offset)} "
+            f"length:{hex(chunks[0].length)}) after {_MAX_REWRITE_ROUNDS} rewrites"
+        )
+
+    async def _find_written(self, extents: Sequence[WrittenExtent]) -> list[bool]:
+        """Return true for each extent that is on the device already.
+
+        We look up each extent in the write journal. We only trust the journal
+        if the device agrees. To this end, we read each extent back into device
+        memory (one window at a time) and compare CRC32 checksums. This is cheap
+        compared to a write.
+        """
+        journal = self.device.metadata.write_journal
+        candidates = [
+            index for index, extent in enumerate(extents) if extent in journal.extents
+        ]
+        result = [False] * len(extents)
+        # Early out if there is nothing to resume
+        if not candidates:
+            await checkpoint()
+            return result
+        # Read each extent back in windows that fit in device memory
+        window_size = await self._get_memory_window_size()
+        address_hex = await self._resolve_memory_address_to_hex()
+        windows = [
+            (index, FileExtent(extents[index].offset + chunk.offset, chunk.length))
+            for index in candidates
+            for chunk in get_chunks(extents[index].length, window_size)
+        ]
+        window_crcs = await self._crc32_device_regions(
+            [
+                _read_command(address_hex, extents[index].target, window)
+                for index, window in windows
+            ],
+            [window.length for _, window in windows],
+        )
+        # Combine the checksums of the windows into a checksum for each extent
+        actual: dict[int, int] = {}
+        for (index, window), crc in zip(windows, window_crcs):
+            previous = actual.get(index)
+            if previous is None:
+                actual[index] = crc
+            else:
+                actual[index] = crc32_combine(previous, crc, window.length)
+        for index, crc in actual.items():
+            result[index] = crc == extents[index].crc32
+        self.logger.info(
+            "Resume write: %d of %d extents are on the device already",
+            sum(result),
+            len(result),
+        )
+        return result
+
+    def _journal_written(self, extent: WrittenExtent) -> None:
+        """Add the extent to the write journal in the device metadata."""
+        metadata = self.device.metadata
+        self.device.metadata = metadata.update(
+            write_journal=metadata.write_journal.add(extent)
+        )
+
+    def _journal_erased(self, target: WriteTarget, offset: int, length: int) -> None:
+        """Remove the erased region from the write journal in the device metadata."""
+        metadata = self.device.metadata
+        self.device.metadata = metadata.update(
+            write_journal=metadata.write_journal.forget(target, offset, length)
+        )
+
+    async def _crc32_device_regions(
+        self, read_commands: Sequence[str], lengths: Sequence[int]
+    ) -> list[int]:
+        """Return the CRC32 checksum of each region on the device.
+
+        Each read command must copy the region to the default memory address.
+        We batch the commands to save round trips.
+        """
+        address_hex = await self._resolve_memory_address_to_hex()
+        commands: list[str] = []
+        for read_command, length in zip(read_commands, lengths):
+            commands.append(read_command)
+            commands.append(f"crc32 {address_hex} {hex(length)}")
+        results = await self.run_many(commands)
+        # Every other result is from "crc32"
+        return [parse_crc32(result.response) for result in results[1::2]]
 
     @deteriorate(DeviceCondition.USED)
-    async def erase_flash(self) -> None:
-        """Erase the flash memory on this device."""
+    async def erase_flash(
+        self, offset: Optional[int] = None, length: Optional[int] = None
+    ) -> None:
+        """Erase the flash memory on this device.
+
+        Erases the entire FLASH memory per default. Otherwise, erases `length`
+        bytes from `offset`. We round the latter up to entire sectors.
+        """
+        if offset is None:
+            offset = 0
+        if length is None:
+            length = _FLASH_SIZE - offset
+        # Round up to the nearest sector
+        length = -(-length // _FLASH_SECTOR_SIZE) * _FLASH_SECTOR_SIZE
         await self._probe_flash()
-        self.logger.info("Erase FLASH memory")
-        size = 16 * 1024 ** 2  # 16 MiB
-        await self.run(f"sf erase 0 {hex(size)}")
+        self.logger.info(
+            "Erase FLASH memory (offset:%s length:%s)", hex(offset), hex(length)
+        )
+        self._journal_erased("flash", offset, length)
+        await self.run(f"sf erase {hex(offset)} {hex(length)}")
 
     async def _probe_flash(self) -> None:
         """Initialize the flash subsystem.
@@ -167,6 +1240,35 @@ class Uboot(SerialBase, ABC):
         self.logger.info("Copy %s to device memory at %s", str(file), address_hex)
         await self.run(f"tftpboot {address_hex} {file}")
 
+    @deteriorate(DeviceCondition.AS_NEW)
+    async def copy_range_to_memory(
+        self,
+        file: Path,
+        offset: int,
+        length: int,
+        *,
+        address: Optional[MemoryAddress] = None,
+    ) -> None:
+        """Copy the given byte range of the file to the device memory.
+
+        Unlike `copy_to_memory`, the file can be anywhere on the host.
+        """
+        address_hex = await self._resolve_memory_address_to_hex(address)
+        await self._initialize_network()
+        assert self._tftp_server is not None
+        name = self._tftp_server.add_virtual_file(file, offset, length)
+        self.logger.info(
+            "Copy %s (offset:%s length:%s) to device memory at %s",
+            str(file),
+            hex(offset),
+            hex(length),
+            address_hex,
+        )
+        try:
+            await self.run(f"tftpboot {address_hex} {name}")
+        finally:
+            self._tftp_server.remove_virtual_file(name)
+
     async def _resolve_memory_address_to_hex(
         self, address: Optional[MemoryAddress] = None
     ) -> str:
@@ -262,7 +1364,21 @@ class Uboot(SerialBase, ABC):
 
     async def save_env(self) -> None:
         """Save all U-boot environment variables to persistent storage."""
+        # We switch baud rate via the "baudrate" environment variable. We don't
+        # want to persist a non-default baud rate. Otherwise, the next boot
+        # starts at said baud rate. Therefore, we switch back first.
+        baud_rate = self.serial.baud_rate
+        await self._set_baud_rate(DEFAULT_BAUD_RATE)
         await self.run(f"saveenv")
+        # Return to the baud rate that we had before (if any)
+        await self._set_baud_rate(baud_rate)
+
+    async def _switch_baud_rate(self, baud_rate: int) -> bool:
+        # U-boot switches as soon as we set the "baudrate" environment variable.
+        # It then waits for a carriage return at the new baud rate.
+        return await self.serial.switch_baud_rate(
+            baud_rate, f"setenv baudrate {baud_rate}", confirm=b"\r"
+        )
 
     async def _initialize_network(self, *, force: bool = False) -> None:
         """Initialize the device for network communication.
@@ -284,17 +1400,22 @@ class Uboot(SerialBase, ABC):
         # fails, it returns with error code 1. Therefore, we ignore the
         # error code.
         await self.run("dhcp", check_error_code=False)
-        await self.run(f"setenv serverip {self._tftp_host}")
-        await self.run(f"setenv tftpdstp {self._tftp_port}")
-        # Increase block and window sizes to improve transfer speeds.
-        # In practice, this improves transfer speeds tenfold. E.g.,
-        # from ~1 MB/s to ~10 MB/s.
-        await self.run("setenv tftpblocksize 1468")
-        await self.run("setenv tftpwindowsize 16")
-        await self.run("setenv tftptimeout 1000")  # 1 second
-        # We exploit the "tftpboot" command and make it do arbitrary file transfers.
-        # In order to do so, we disable the "boot" aspect of it with `autostart=no`.
-        await self.run("setenv autostart no")
+        await self.run_many(
+            [
+                f"setenv serverip {self._tftp_host}",
+                f"setenv tftpdstp {self._tftp_port}",
+                # Increase block and window sizes to improve transfer speeds.
+                # In practice, this improves transfer speeds tenfold. E.g.,
+                # from ~1 MB/s to ~10 MB/s.
+                "setenv tftpblocksize 1468",
+                "setenv tftpwindowsize 16",
+                "setenv tftptimeout 1000",  # 1 second
+                # We exploit the "tftpboot" command and make it do arbitrary file
+                # transfers. In order to do so, we disable the "boot" aspect of it
+                # with `autostart=no`.
+                "setenv autostart no",
+            ]
+        )
         self._initialized_network = True
 
     async def _start_tftp_server(self) -> None:
@@ -306,6 +1427,7 @@ class Uboot(SerialBase, ABC):
         )
         assert self._stack is not None
         await self._stack.enter_async_context(tftp_server)
+        self._tftp_server = tftp_server
 
     async def _initialize_usb(self, *, force: bool = False) -> None:
         """Initialize the device for USB communication.
@@ -344,3 +1466,189 @@ class Uboot(SerialBase, ABC):
         # https://github.com/u-boot/u-boot/blob/a1e95e3805eacca1162f6049dceb9b1d2726cbf5/drivers/usb/host/ehci-hcd.c#L649
         await self.run("usb start")
         self._initialized_usb = True
+
+
+def _get_sector_count(
+    file: Path, partitions: Iterable[MmcPartition], *, size: Optional[int] = None
+) -> int:
+    """Return the number of MMC sectors that the file occupies.
+
+    Override the size of the file with `size` (e.g., for compressed files).
+
+    Raises `ValueError` if the file doesn't fit into all the partitions.
+    """
+    if size is None:
+        size = file.stat().st_size
+    # Round up to the nearest sector
+    sector_count = -(-size // Mmc.sector_size)
+    for partition in partitions:
+        if sector_count > partition.length:
+            raise ValueError(
+                f"Can't write {file} ({sector_count} sectors) to "
+                f'"{partition}". The image is too large.'
+            )
+    return sector_count
+
+
+async def _find_extents(file: Path, *, cache: bool = True) -> list[FileExtent]:
+    """Return the non-null extents of the image (see `util.find_extents`).
+
+    We read the entire image so we do so in a worker thread. Set `cache=False`
+    to bypass `IMAGE_CACHE`.
+    """
+    if cache:
+        return await run_sync(IMAGE_CACHE.find_extents, file)
+    return await run_sync(find_extents, file)
+
+
+async def _crc32_chunks(
+    file: Path,
+    chunks: Iterable[FileExtent],
+    *,
+    cache: bool = True,
+    extents: Optional[Sequence[FileExtent]] = None,
+    fill: Optional[int] = None,
+) -> list[int]:
+    """Return the CRC32 checksum of each chunk (see `util.crc32_chunks`).
+
+    Like `_find_extents`, we do so in a worker thread.
+    """
+    compute = IMAGE_CACHE.crc32_chunks if cache else crc32_chunks
+    return await run_sync(
+        partial(compute, file, list(chunks), extents=extents, fill=fill)
+    )
+
+
+def _get_gzip_crc32(file: Path) -> int:
+    """Return the CRC32 checksum of the uncompressed data in the gzip file.
+
+    Reads the checksum from the gzip trailer.
+    """
+    with file.open("rb") as io:
+        io.seek(-8, os.SEEK_END)
+        return int.from_bytes(io.read(4), "little")
+
+
+def _get_gzip_size(file: Path) -> int:
+    """Return the uncompressed size of the gzip file.
+
+    Reads the size from the gzip trailer. Note that the trailer only holds the
+    size modulo 4 GiB.
+    """
+    with file.open("rb") as io:
+        io.seek(-4, os.SEEK_END)
+        return int.from_bytes(io.read(4), "little")
+
+
+def _get_gaps(
+    extents: Iterable[FileExtent], size: int, block_size: int
+) -> list[FileExtent]:
+    """Return the blocks up to `size` that the extents don't touch.
+
+    Assumes that the extents are sorted.
+    """
+    gaps: list[FileExtent] = []
+    cursor = 0
+    for extent in (*extents, FileExtent(size, 0)):
+        start = extent.offset // block_size * block_size
+        if start > cursor:
+            gaps.append(FileExtent(cursor, start - cursor))
+        cursor = max(cursor, -(-extent.end // block_size) * block_size)
+    return gaps
+
+
+def _split_extents(extents: Iterable[FileExtent], max_length: int) -> list[FileExtent]:
+    """Split the extents into extents of at most `max_length` bytes."""
+    return [
+        FileExtent(extent.offset + chunk.offset, chunk.length)
+        for extent in extents
+        for chunk in get_chunks(extent.length, max_length)
+    ]
+
+
+def _parse_memory_window_size(bdinfo: str, address: int) -> Optional[int]:
+    """Return the number of bytes from `address` to the top of usable RAM.
+
+    Parses the response from U-boot's "bdinfo" command. Returns `None` if the
+    response doesn't have a RAM bank that contains `address`.
+    """
+    values: dict[str, list[int]] = {}
+    for match in _BDINFO_PATTERN.finditer(bdinfo):
+        values.setdefault(match.group(1), []).append(int(match.group(2), 16))
+    banks = zip(values.get("-> start", []), values.get("-> size", []))
+    end = next(
+        (start + size for start, size in banks if start <= address < start + size),
+        None,
+    )
+    if end is None:
+        return None
+    # U-boot relocates itself to the top of RAM. Its heap and stack are just
+    # below that.
+    for key, margin in (("relocaddr", 0), ("sp start", _STACK_MARGIN)):
+        for value in values.get(key, []):
+            if value > address:
+                end = min(end, value - margin)
+    window_size = (end - address) // _MEMORY_WINDOW_ALIGNMENT * _MEMORY_WINDOW_ALIGNMENT
+    if window_size <= 0:
+        return None
+    return window_size
+
+
+def _flash_read_command(address_hex: str, extent: FileExtent) -> str:
+    return f"sf read {address_hex} {hex(extent.offset)} {hex(extent.length)}"
+
+
+def _mmc_read_command(
+    address_hex: str, partition: MmcPartition, extent: FileExtent
+) -> str:
+    sector_size = Mmc.sector_size
+    return (
+        f"mmc read {address_hex} "
+        f"{hex(partition.offset + extent.offset // sector_size)} "
+        f"{hex(-(-extent.length // sector_size))}"
+    )
+
+
+def _read_command(address_hex: str, target: WriteTarget, region: FileExtent) -> str:
+    """Return command that copies the region of storage to device memory.
+
+    The region is in bytes relative to the start of the storage (see
+    `WrittenExtent`).
+    """
+    if target == "flash":
+        return _flash_read_command(address_hex, region)
+    sector_size = Mmc.sector_size
+    return (
+        f"mmc read {address_hex} {hex(region.offset // sector_size)} "
+        f"{hex(-(-region.length // sector_size))}"
+    )
+
+
+def _flash_written_extent(extent: FileExtent, crc: int) -> WrittenExtent:
+    return WrittenExtent(
+        target="flash", offset=extent.offset, length=extent.length, crc32=crc
+    )
+
+
+def _mmc_written_extent(
+    partition: MmcPartition, extent: FileExtent, crc: int
+) -> WrittenExtent:
+    # The journal uses byte offsets relative to the start of the MMC
+    return WrittenExtent(
+        target="mmc",
+        offset=partition.offset * Mmc.sector_size + extent.offset,
+        length=extent.length,
+        crc32=crc,
+    )
+
+
+def _extent_report(
+    extent: FileExtent, retries: int, start: float, *, resumed: bool = False
+) -> ExtentReport:
+    return ExtentReport(
+        offset=extent.offset,
+        length=extent.length,
+        retries=retries,
+        resumed=resumed,
+        duration=time.perf_counter() - start,
+    )
@@ -0,0 +1,63 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class ExtentReport:
+    """Summary of the write of a single extent of an image."""
+
+    # Where the extent is within the image [bytes]
+    offset: int
+    length: int
+    # Number of chunks that failed verification and that we wrote again
+    retries: int = 0
+    # We skipped the extent since it was on the device already (see `WriteJournal`)
+    resumed: bool = False
+    # From start to end of the write (including verification and retries) [s]
+    duration: float = 0.0
+
+
+@dataclass(frozen=True)
+class WriteReport:
+    """Summary of an image write to FLASH or MMC."""
+
+    # Number of bytes in the image
+    size: int
+    # Number of bytes that we sent to the device
+    bytes_transferred: int
+    # Number of bytes that the device wrote to storage
+    bytes_written: int
+    # Number of chunks that we compared with the device (delta mode only)
+    chunks_compared: int = 0
+    # Number of chunks that differed from the device (delta mode only)
+    chunks_changed: int = 0
+    # Number of FLASH sectors that we erased and left as is, respectively
+    sectors_erased: int = 0
+    sectors_skipped: int = 0
+    # Each extent that we wrote (in order)
+    extents: tuple[ExtentReport, ...] = ()
+    # From start to end of the write [s]
+    duration: float = 0.0
+
+    @property
+    def retries(self) -> int:
+        """Total number of chunks that we wrote again after verification."""
+        return sum(extent.retries for extent in self.extents)
+
+    def __str__(self) -> str:
+        result = (
+            f"{self.size} bytes image; {self.bytes_transferred} bytes transferred; "
+            f"{self.bytes_written} bytes written"
+        )
+        if self.chunks_compared:
+            result += f"; {self.chunks_changed}/{self.chunks_compared} chunks changed"
+        if self.sectors_erased or self.sectors_skipped:
+            result += (
+                f"; {self.sectors_erased} sectors erased; "
+                f"{self.sectors_skipped} sectors skipped"
+            )
+        resumed = sum(extent.resumed for extent in self.extents)
+        if resumed:
+            result += f"; {resumed}/{len(self.extents)} extents resumed"
+        if self.retries:
+            result += f"; {self.retries} chunks rewritten after verification"
+        return result + f" (took {self.duration:.2f} s)"
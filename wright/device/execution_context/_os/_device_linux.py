@@ -1,12 +1,23 @@
 from __future__ import annotations
 
+import base64
 import json
-from contextlib import asynccontextmanager
+from contextlib import AsyncExitStack, asynccontextmanager
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, AsyncIterator, Optional
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Iterable,
+    Optional,
+    Type,
+    TypeVar,
+)
 
 import anyio
+import asyncssh
 from anyio.abc import TaskGroup
+from pydantic import parse_raw_as
 
 from ....command_line import CommandLine, SerialCommandLine, SshCommandLine
 from ..._device_condition import DeviceCondition
@@ -16,10 +27,20 @@ from .._enter_context import enter_context
 from .._fw import DeviceUboot
 from ._linux import Linux
 from ._log_in import force_log_in_over_serial
+from ._python_worker import PythonWorker
 
 if TYPE_CHECKING:
     from ..._device import Device
 
+ParseType = TypeVar("ParseType")
+
+# Port of the SSH server on the device
+_SSH_PORT = 7910
+# Time between attempts to connect to the SSH server [s]
+_SSH_POLL_INTERVAL = 1
+# The BBP watcher (see `_WATCH_BBP_STATUS`) writes its process ID to this file
+_BBP_WATCHER_PID_FILE = "/tmp/wright_bbp_watcher.pid"
+
 
 class DeviceLinux(Linux):
     """The Linux distribution installed on the device.
@@ -30,9 +51,13 @@ class DeviceLinux(Linux):
     """
 
     def __init__(
-        self, device: "Device", tg: TaskGroup, kernel_log_level: Optional[int] = None
+        self,
+        device: "Device",
+        tg: TaskGroup,
+        kernel_log_level: Optional[int] = None,
+        ready_patterns: Optional[Iterable[str]] = None,
     ) -> None:
-        super().__init__(device, tg)
+        super().__init__(device, tg, ready_patterns)
         # Kernel logging messes with the serial output. That is, sometimes the
         # kernel will spam the serial line with driver info messages. Said
         # messages interfere with how we parse the serial line.
@@ -40,6 +65,12 @@ class DeviceLinux(Linux):
         self._kernel_log_level = kernel_log_level
         # SSH command line
         self._ssh: Optional[SshCommandLine] = None
+        # Whether we logged in over the serial command line. We skip the serial
+        # log-in if we can connect over SSH right away. In that case, the serial
+        # command line only gives us the log.
+        self._serial_logged_in = False
+        # Runs the code from `run_py`. We start it as we enter this context.
+        self._py_worker: Optional[PythonWorker] = None
 
     @property
     def command_line(self) -> CommandLine:
@@ -65,26 +96,56 @@ class DeviceLinux(Linux):
     async def unbock_data_partition(self) -> None:
         """Stop all processes/mounts that may use the data partition."""
         self.logger.info("Stop all services that may use the data partition")
-        await self.run("/etc/init.d/S99monit stop")
-        await self.run("/etc/init.d/S97dash stop")
-        await self.run("/etc/init.d/S96staten stop")
-        await self.run("/etc/init.d/S95mester stop")
-        await self.run("/etc/init.d/S94baxter stop")
-        await self.run("/etc/init.d/S93maskin stop")
-        await self.run("/etc/init.d/S92cellmate stop")
-        await self.run("/etc/init.d/S91frog stop")
-        await self.run("/etc/init.d/S82telegraf stop")
-        await self.run("/etc/init.d/S81influxdb stop")
-        await self.run("/etc/init.d/S70swupdate stop")
-        # HACK: crond doesn't use the data partition but it causes other issues
-        # due to sudden time shifts. Therefore, we also stop crond.
-        # Specifically, a time shift during `mkfs.ext4` causes `mkfs.ext4` to
-        # not return.
-        await self.run("/etc/init.d/S60crond stop")
-        # We introduced nginx in SW 4.12.0. Therefore, it won't be there on older
-        # systems. Hence the conditional command.
-        await self.run("[ -f /etc/init.d/S50nginx ] && /etc/init.d/S50nginx stop")
-        await self.run("/etc/init.d/S01rsyslogd stop")
+        await self.run_many(
+            [
+                "/etc/init.d/S99monit stop",
+                "/etc/init.d/S97dash stop",
+                "/etc/init.d/S96staten stop",
+                "/etc/init.d/S95mester stop",
+                "/etc/init.d/S94baxter stop",
+                "/etc/init.d/S93maskin stop",
+                "/etc/init.d/S92cellmate stop",
+                "/etc/init.d/S91frog stop",
+                "/etc/init.d/S82telegraf stop",
+                "/etc/init.d/S81influxdb stop",
+                "/etc/init.d/S70swupdate stop",
+                # HACK: crond doesn't use the data partition but it causes other
+                # issues due to sudden time shifts. Therefore, we also stop crond.
+                # Specifically, a time shift during `mkfs.ext4` causes `mkfs.ext4`
+                # to not return.
+                "/etc/init.d/S60crond stop",
+                # We introduced nginx in SW 4.12.0. Therefore, it won't be there on
+                # older systems. Hence the conditional command.
+                "[ -f /etc/init.d/S50nginx ] && /etc/init.d/S50nginx stop",
+                "/etc/init.d/S01rsyslogd stop",
+            ]
+        )
+
+    @deteriorate(DeviceCondition.AS_NEW)
+    async def run_py(self, py_code: str, **kwargs: Any) -> str:
+        """Run the given python code and return the response.
+
+        We run the code in a long-lived python process on the device. This way,
+        we only pay for the interpreter start-up once. We fall back on a new
+        python process for each call if you give any keyword arguments (e.g.,
+        `check_error_code`).
+        """
+        if kwargs:
+            return await super().run_py(py_code, **kwargs)
+        self._raise_if_not_entered()
+        self._raise_if_exited()
+        assert self._py_worker is not None
+        return await self._py_worker.run(py_code)
+
+    @deteriorate(DeviceCondition.AS_NEW)
+    async def run_py_parsed(
+        self, py_code: str, parse_as: Type[ParseType], **kwargs: Any
+    ) -> ParseType:
+        """Run the given python code and return the parsed response."""
+        if kwargs:
+            return await super().run_py_parsed(py_code, parse_as, **kwargs)
+        response = await self.run_py(py_code)
+        return parse_raw_as(parse_as, response)
 
     @deteriorate(DeviceCondition.AS_NEW)
     async def get_processes(self) -> dict[int, Process]:
@@ -94,10 +155,10 @@ class DeviceLinux(Linux):
     @deteriorate(DeviceCondition.AS_NEW)
     async def get_host_key(self) -> str:
         """Return the public host key for SSH."""
-        # Use the serial command line for this since we need the host
-        # key to initialize the SSH command line. I.e., we can't assume
-        # that the latter is ready yet.
-        return await self.serial.run("cat /etc/ssh/ssh_host_ed25519_key.pub")
+        # Use the preferred command line for this. We need the host key to
+        # initialize the SSH command line. I.e., we can't assume that the
+        # latter is ready yet. In that case, we fall back on serial.
+        return await self.run("cat /etc/ssh/ssh_host_ed25519_key.pub")
 
     @deteriorate(DeviceCondition.AS_NEW)
     async def set_electronics_reference(self) -> ElecRef:
@@ -106,8 +167,7 @@ class DeviceLinux(Linux):
         Returns the reference data (parsed contents of the JSON file).
         """
         await self._start_bbp(program_name="electronics_reference.bbp")
-        with anyio.fail_after(60):
-            await self._wait_for_bbp()
+        await self._wait_for_bbp(timeout=60)
         elec_ref_data = await self.read_file_as_json(
             Path("/media/config/individual/etc/electrical_test_reference.json")
         )
@@ -129,21 +189,59 @@ class DeviceLinux(Linux):
         """Read the given file and return its contents as a raw text string."""
         return await self.run(f"cat {file}")
 
-    async def _wait_for_bbp(self) -> None:
+    async def _wait_for_bbp(self, timeout: float) -> None:
         """Wait until the BBP is done.
 
-        Raises `RuntimeError` if the BBP failed or was cancelled.
+        We run a single watcher on the device. Said watcher tells us about each
+        change of the BBP state and stops when the BBP is done. This way, we
+        return (about) the moment that the BBP is done.
+
+        We stop the watcher if we time out or get cancelled (see
+        `_stop_bbp_watcher`). In any case, the watcher stops on its own after
+        `timeout` seconds.
+
+        Raises `RuntimeError` if the BBP failed or was cancelled. Raises
+        `TimeoutError` if the BBP isn't done within `timeout` seconds.
         """
-        while True:
-            status = await self.run_py_parsed(_GET_BBP_STATUS, PartialBbpStatus)
-            bbp_state = status.state
-            if bbp_state is BbpState.CANCELLED:
-                raise RuntimeError("User cancelled the BBP")
-            if bbp_state is BbpState.FAILED:
-                raise RuntimeError("The BBP failed")
-            if bbp_state is BbpState.COMPLETED:
-                break
-            await anyio.sleep(2)
+        bbp_state: Optional[BbpState] = None
+        py_code = _WATCH_BBP_STATUS.format(
+            pid_file=_BBP_WATCHER_PID_FILE, timeout=timeout
+        )
+        command = _py_code_to_line(py_code)
+        try:
+            with anyio.fail_after(timeout):
+                async with self.command_line.run_stream(command) as lines:
+                    async for line in lines:
+                        bbp_state = parse_raw_as(PartialBbpStatus, line).state
+                        self.logger.debug("BBP state: %s", bbp_state.value)
+        except BaseException:
+            # Shield this. We may get here due to a cancellation.
+            with anyio.move_on_after(5, shield=True):
+                await self._stop_bbp_watcher()
+            raise
+        if bbp_state is BbpState.CANCELLED:
+            raise RuntimeError("User cancelled the BBP")
+        if bbp_state is BbpState.FAILED:
+            raise RuntimeError("The BBP failed")
+        if bbp_state is not BbpState.COMPLETED:
+            raise RuntimeError("The BBP watcher stopped before the BBP was done")
+
+    async def _stop_bbp_watcher(self) -> None:
+        """Stop the BBP watcher on the device (if it still runs).
+
+        We need a second session for this so we only do so over SSH. Over
+        serial, the watcher blocks the command line until it stops on its own.
+        """
+        if self._ssh is None:
+            return
+        self.logger.debug("Stop the BBP watcher")
+        try:
+            await self._ssh.run(
+                f'kill "$(cat {_BBP_WATCHER_PID_FILE})" && rm {_BBP_WATCHER_PID_FILE}',
+                check_error_code=False,
+            )
+        except (OSError, asyncssh.Error) as exc:
+            self.logger.warning("Could not stop the BBP watcher: %s", exc)
 
     async def _start_bbp(self, program_name: str) -> None:
         """Start the given BBP.
@@ -172,6 +270,14 @@ class DeviceLinux(Linux):
                 await uboot.set_boot_args(loglevel="0")
             await uboot.boot_to_device_os()
 
+    async def _switch_baud_rate(self, baud_rate: int) -> bool:
+        # We can't run `stty` if we didn't log in over serial. There is no need
+        # for a higher baud rate in that case anyhow.
+        if not self._serial_logged_in:
+            self.logger.info("Keep the current baud rate since we use SSH")
+            return False
+        return await super()._switch_baud_rate(baud_rate)
+
     @asynccontextmanager
     async def _serial_cm(self) -> AsyncIterator[SerialCommandLine]:
         communication = self.device.link.communication
@@ -181,33 +287,113 @@ class DeviceLinux(Linux):
         # current working directory. For now, we simply don't change the
         # current working directory.
         prompt = f"root@{communication.hostname}:~# "
-        async with self._create_serial(prompt) as serial:
-            if not self._should_skip_boot():
-                # Wait until the serial prompt is just about to appear.
-                # We found the length of this sleep empirically.
-                await anyio.sleep(80)
-                with anyio.fail_after(140):
-                    # The authentication is at the default values
-                    await force_log_in_over_serial(serial, username="root", password="")
-            # Spam `echo` commands until the serial prompt appears
-            with anyio.fail_after(160):
-                await serial.force_prompt()
+        async with AsyncExitStack() as stack:
+            # Listen over serial in any case. E.g., to get the boot log.
+            serial: SerialCommandLine = await stack.enter_async_context(
+                self._create_serial(prompt)
+            )
+            # Connect over SSH as soon as the SSH server is up (if we know the
+            # host key in advance). This way, we skip the serial log-in.
+            host_key = self.device.metadata.ssh_host_key
+            if host_key is not None:
+                # The SSH server appears at about the same time as the serial
+                # prompt. We found the latter upper bound empirically.
+                timeout = 10 if self._should_skip_boot() else 80
+                self._ssh = await self._connect_ssh(host_key, timeout)
+            if self._ssh is not None:
+                stack.push_async_exit(self._ssh)
+            else:
+                await self._log_in_over_serial(serial)
             yield serial
 
-    async def __aenter__(self) -> DeviceLinux:
-        await super().__aenter__()
-        assert self._stack is not None
+    async def _log_in_over_serial(self, serial: SerialCommandLine) -> None:
+        if not self._should_skip_boot():
+            # Wait until the serial prompt is just about to appear.
+            # We found the upper bound empirically.
+            await self._wait_until_ready(serial, timeout=80)
+            with anyio.fail_after(140):
+                # The authentication is at the default values
+                await force_log_in_over_serial(serial, username="root", password="")
+        # Spam `echo` commands until the serial prompt appears
+        with anyio.fail_after(160):
+            await serial.force_prompt()
+        self._serial_logged_in = True
+
+    async def _connect_ssh(
+        self, host_key: str, timeout: float
+    ) -> Optional[SshCommandLine]:
+        """Connect over SSH as soon as the SSH server is up.
+
+        Returns the (entered) SSH command line. Returns `None` if we fail to
+        connect within `timeout` seconds or if the server presents another host
+        key than the given one. We retry on all other errors until the timeout.
+        """
+        host = self.device.link.communication.hostname
+        ssh = self._create_ssh(host_key)
+        with anyio.move_on_after(timeout):
+            while True:
+                # Poll the port until the SSH server accepts connections
+                try:
+                    stream = await anyio.connect_tcp(host, _SSH_PORT)
+                except OSError:
+                    await anyio.sleep(_SSH_POLL_INTERVAL)
+                    continue
+                await stream.aclose()
+                try:
+                    await ssh.__aenter__()
+                except asyncssh.HostKeyNotVerifiable as exc:
+                    # E.g., if someone replaced the config image (and thus the
+                    # host key) behind our back. There is no point in retrying.
+                    self.logger.warning(
+                        "Could not connect over SSH: %s. Will use serial.", exc
+                    )
+                    return None
+                except (OSError, asyncssh.Error) as exc:
+                    # The SSH server may accept connections before it is ready.
+                    # E.g., it may drop the connection during the handshake.
+                    self.logger.debug("SSH server not ready yet: %s", exc)
+                    await anyio.sleep(_SSH_POLL_INTERVAL)
+                    continue
+                self.logger.info("Connected over SSH")
+                return ssh
+        self.logger.warning(
+            "SSH server did not appear within %s seconds. Will use serial.", timeout
+        )
+        return None
+
+    def _create_ssh(self, host_key: str) -> SshCommandLine:
+        """Create an (unentered) SSH command line."""
         host = self.device.link.communication.hostname
-        host_key = await self.get_host_key()
         # Logger
         if self.logger is None:
             ssh_logger = None
         else:
             ssh_logger = self.logger.getChild("ssh")
-        self._ssh = SshCommandLine(
-            host=host, port=7910, host_key=host_key, username="root", logger=ssh_logger
+        return SshCommandLine(
+            host=host,
+            port=_SSH_PORT,
+            host_key=host_key,
+            username="root",
+            logger=ssh_logger,
+        )
+
+    async def __aenter__(self) -> DeviceLinux:
+        await super().__aenter__()
+        assert self._stack is not None
+        # Connect over SSH if we didn't do so already
+        if self._ssh is None:
+            host_key = await self.get_host_key()
+            # Remember the host key so that we can connect over SSH right away
+            # next time.
+            self.device.metadata = self.device.metadata.update(ssh_host_key=host_key)
+            ssh = self._create_ssh(host_key)
+            await self._stack.enter_async_context(ssh)
+            self._ssh = ssh
+        # Start the python worker now. This way, it lives exactly as long as this
+        # context (and the SSH connection).
+        self._py_worker = await self._stack.enter_async_context(
+            PythonWorker.start(self._ssh, self.logger.getChild("py_worker"))
         )
-        await self._stack.enter_async_context(self._ssh)
         return self
 
 
@@ -251,16 +437,46 @@ with urlopen(req):
     pass
 """
 
-_GET_BBP_STATUS = """
+
+def _py_code_to_line(py_code: str) -> str:
+    """Return a single-line command that runs the given python code.
+
+    Use this with `run_stream`. The latter appends an error code check to the
+    command line. This breaks a heredoc.
+    """
+    encoded = base64.b64encode(py_code.encode("utf-8")).decode("ascii")
+    return f"python3 -u -c 'import base64; exec(base64.b64decode(\"{encoded}\"))'"
+
+
+# Prints the BBP status (as JSON) on each change of the BBP state. Stops when
+# the BBP is done or after `timeout` seconds. A BBP takes tens of seconds so we
+# poll once per second. Writes its process ID to `pid_file` so that we can stop
+# it early.
+_WATCH_BBP_STATUS = """
+import json
+import os
+import time
 from urllib.request import Request, urlopen
-from urllib.error import HTTPError
 
+with open("{pid_file}", "w") as pid_io:
+    pid_io.write(str(os.getpid()))
 req = Request(
     url="http://localhost:8082/tasks/program",
     method="GET"
 )
-with urlopen(req) as io:
-    data = io.read()
-
-print(data.decode("utf-8"))
+deadline = time.monotonic() + {timeout}
+previous_state = None
+while time.monotonic() < deadline:
+    with urlopen(req) as io:
+        data = io.read()
+    status = json.loads(data)
+    state = status["state"]
+    if state != previous_state:
+        # One status per line
+        print(json.dumps(status), flush=True)
+        previous_state = state
+    if state in ("completed", "failed", "cancelled"):
+        break
+    time.sleep(1)
+os.remove("{pid_file}")
 """
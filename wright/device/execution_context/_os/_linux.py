@@ -2,18 +2,52 @@ from __future__ import annotations
 
 from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import Any, Type, TypeVar
+from typing import TYPE_CHECKING, Any, Iterable, Optional, Type, TypeVar
 
+import anyio
+from anyio.abc import TaskGroup
+
+from ....command_line import SerialCommandLine
 from ..._device_condition import DeviceCondition
 from .._deteriorate import deteriorate
 from .._serial_base import SerialBase
 
+if TYPE_CHECKING:
+    from ..._device import Device
+
 ParseType = TypeVar("ParseType")
 
+# Serial output that tells us that Linux is ready for us to log in
+_DEFAULT_READY_PATTERNS = (r"login:",)
+# Width of the serial console. The serial console has no window size. Therefore,
+# the shell assumes 80 columns.
+_TERMINAL_COLUMNS = 80
+
 
 class Linux(SerialBase, ABC):
     """Base class for Linux-based execution contexts."""
 
+    def __init__(
+        self,
+        device: "Device",
+        tg: TaskGroup,
+        ready_patterns: Optional[Iterable[str]] = None,
+    ) -> None:
+        super().__init__(device, tg)
+        # We wait for any of these regex patterns in the boot log before we log
+        # in. E.g., add a kernel/init milestone if the distribution doesn't
+        # print a "login:" prompt.
+        if ready_patterns is None:
+            ready_patterns = _DEFAULT_READY_PATTERNS
+        self._ready_patterns = tuple(ready_patterns)
+
+    def _get_max_line_length(self, prompt: str) -> Optional[int]:
+        # The shell's line editor wraps lines that don't fit on the terminal.
+        # This adds, e.g., carriage returns to the echo of the command line and
+        # then we don't recognize the echo. Therefore, we keep the entire line
+        # (and the prompt in front of it) within a single row of the terminal.
+        return _TERMINAL_COLUMNS - len(prompt) - 1
+
     @deteriorate(DeviceCondition.USED)
     async def reset_data(self) -> None:
         """Remove all data on this device."""
@@ -59,6 +93,24 @@ class Linux(SerialBase, ABC):
             result[words[0]] = words[1]
         return result
 
+    async def _wait_until_ready(
+        self, serial: SerialCommandLine, timeout: float
+    ) -> None:
+        """Wait until the boot log says that Linux is ready for us to log in.
+
+        Gives up silently after `timeout` seconds. This way, we still try to log
+        in if we somehow miss the milestone.
+        """
+        with anyio.move_on_after(timeout) as scope:
+            match = await serial.wait_for_output(*self._ready_patterns)
+            self.logger.debug('Linux is ready (found "%s")', match.group(0))
+        if scope.cancel_called:
+            self.logger.debug("Found no boot milestone. Will try to log in anyhow.")
+
+    async def _switch_baud_rate(self, baud_rate: int) -> bool:
+        # `stty` works on the terminal of the shell itself (the serial console)
+        return await self.serial.switch_baud_rate(baud_rate, f"stty {baud_rate}")
+
     @deteriorate(DeviceCondition.AS_NEW)
     async def run_py(self, py_code: str, **kwargs: Any) -> str:
         """Run the given python code and return the response."""
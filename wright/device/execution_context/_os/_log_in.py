@@ -14,15 +14,15 @@ async def force_log_in_over_serial(
     Keeps trying until the log-in succeeds.
     """
     # Spam serial line until we see the log-in prompt
-    old_prompt = serial._prompt
-    serial._prompt = "login:"
+    old_prompt = serial.prompt
+    serial.prompt = "login:"
     while True:
         await serial.write_line("")
         async with move_on_after(0.5):
             await serial.wait_for_prompt()
             break
     await log_in_over_serial(serial, **kwargs)
-    serial._prompt = old_prompt
+    serial.prompt = old_prompt
 
 
 async def log_in_over_serial(
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import json
+import shlex
+from contextlib import asynccontextmanager
+from itertools import count
+from logging import Logger
+from typing import AsyncIterator
+
+import anyio
+from asyncssh import SSHClientProcess
+
+from ....command_line import SshCommandLine
+
+
+class PythonWorker:
+    """Long-lived python process on the device that runs code on request.
+
+    This way, we only pay for the interpreter start-up (and the imports) once.
+    Each request runs in a fresh global namespace. Modules stay imported between
+    requests, though.
+
+    We talk to the worker in JSON lines. A request is `{"id": 0, "code": "..."}`.
+    A response is `{"id": 0, "stdout": "...", "error": null}`. The "error" is the
+    traceback if the code raised an exception.
+    """
+
+    def __init__(self, process: SSHClientProcess[str], logger: Logger) -> None:
+        self._process = process
+        self._logger = logger
+        # We send a single request at a time
+        self._lock = anyio.Lock()
+        self._request_ids = count()
+
+    @classmethod
+    @asynccontextmanager
+    async def start(
+        cls, ssh: SshCommandLine, logger: Logger
+    ) -> AsyncIterator[PythonWorker]:
+        """Start a worker over the given SSH command line.
+
+        We don't open a task group (or any other cancel scope). Therefore, it's
+        safe to keep the worker around in, e.g., an `AsyncExitStack`.
+        """
+        # We discard stderr. The responses carry the tracebacks anyhow. Moreover,
+        # an unread stderr may stall the worker due to SSH flow control.
+        command = f"python3 -u -c {shlex.quote(_WORKER_PY)} 2>/dev/null"
+        async with ssh.create_process(command) as process:
+            try:
+                yield cls(process, logger)
+            finally:
+                # The worker stops when it reaches the end of stdin
+                process.stdin.write_eof()
+
+    async def run(self, py_code: str) -> str:
+        """Run the given python code and return what it prints (stdout).
+
+        Raises `RuntimeError` if the code raised an exception.
+        """
+        async with self._lock:
+            request_id = next(self._request_ids)
+            request = {"id": request_id, "code": py_code}
+            self._process.stdin.write(json.dumps(request) + "\n")
+            while True:
+                line = await self._process.stdout.readline()
+                if not line:
+                    raise RuntimeError("The python worker stopped unexpectedly")
+                response = json.loads(line)
+                # Skip responses to earlier requests. E.g., if someone
+                # cancelled a request while the worker ran it.
+                if response["id"] == request_id:
+                    break
+        if response["error"] is not None:
+            self._logger.debug("Traceback from python worker:\n%s", response["error"])
+            raise RuntimeError(f"Python code failed:\n{response['error']}")
+        result = response["stdout"]
+        assert isinstance(result, str)
+        return result
+
+
+_WORKER_PY = """
+import contextlib
+import io
+import json
+import os
+import sys
+import traceback
+
+# Keep the original stdout for the responses. Anything else that writes to
+# stdout (e.g., a subprocess) goes to stderr (which we discard) instead.
+responses = os.fdopen(os.dup(1), "w")
+os.dup2(2, 1)
+
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    request = json.loads(line)
+    stdout = io.StringIO()
+    error = None
+    try:
+        with contextlib.redirect_stdout(stdout):
+            code = compile(request["code"], "<run_py>", "exec")
+            exec(code, {"__name__": "__main__"})
+    except SystemExit as exc:
+        if exc.code not in (None, 0):
+            error = "SystemExit: " + str(exc.code)
+    except Exception:
+        error = traceback.format_exc()
+    response = {"id": request["id"], "stdout": stdout.getvalue(), "error": error}
+    responses.write(json.dumps(response) + "\\n")
+    responses.flush()
+"""
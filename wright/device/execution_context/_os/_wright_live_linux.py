@@ -38,8 +38,9 @@ class WrightLiveLinux(Linux):
         # Sometimes, the data partition doesn't exist already or is corrupted.
         # In this case, the following `umount`s fail. Therefore, we ignore the
         # error code.
-        await self.run("umount /var/lib", check_error_code=False)
-        await self.run("umount /var/log", check_error_code=False)
+        await self.run_many(
+            ["umount /var/lib", "umount /var/log"], check_error_code=False
+        )
 
     async def _boot(self) -> None:
         async with enter_context(DeviceUboot, self.device) as uboot:
@@ -57,8 +58,8 @@ class WrightLiveLinux(Linux):
         async with self._create_serial(prompt) as serial:
             if not self._should_skip_boot():
                 # Wait until the serial prompt is just about to appear.
-                # We found the length of this sleep empirically.
-                await anyio.sleep(15)
+                # We found the upper bound empirically.
+                await self._wait_until_ready(serial, timeout=15)
                 # The authentication is at the default values
                 with anyio.fail_after(15):
                     await force_log_in_over_serial(serial, username="root", password="")
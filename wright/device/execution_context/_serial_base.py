@@ -1,11 +1,13 @@
 from abc import abstractmethod
 from contextlib import AsyncExitStack
+from datetime import datetime
 from types import TracebackType
 from typing import (
     TYPE_CHECKING,
     Any,
     AsyncContextManager,
     Optional,
+    Sequence,
     Type,
     TypeVar,
     cast,
@@ -13,7 +15,12 @@ from typing import (
 
 from anyio.abc import TaskGroup
 
-from ...command_line import CommandLine, SerialCommandLine
+from ...command_line import (
+    DEFAULT_BAUD_RATE,
+    CommandLine,
+    CommandResult,
+    SerialCommandLine,
+)
 from ._base import Base
 
 if TYPE_CHECKING:
@@ -51,6 +58,30 @@ class SerialBase(Base):
     def _serial_cm(self) -> AsyncContextManager[SerialCommandLine]:
         ...
 
+    @abstractmethod
+    async def _switch_baud_rate(self, baud_rate: int) -> bool:
+        """Switch the serial command line to the given baud rate.
+
+        Returns `True` on success and `False` if we fell back on the current
+        baud rate.
+        """
+        ...
+
+    async def _set_baud_rate(self, baud_rate: int) -> None:
+        """Switch the serial command line to the given baud rate.
+
+        Records the baud rate in the device metadata on success. This way,
+        a later context of the same type (that skips the boot) uses the same
+        baud rate right away.
+        """
+        # Early out if we are already at the given baud rate
+        if self.serial.baud_rate == baud_rate:
+            return
+        if await self._switch_baud_rate(baud_rate):
+            self.device.metadata = self.device.metadata.update(
+                baud_rate=None if baud_rate == DEFAULT_BAUD_RATE else baud_rate
+            )
+
     def _create_serial(self, prompt: str) -> SerialCommandLine:
         """Create an (unentered) serial command line.
 
@@ -62,14 +93,33 @@ class SerialBase(Base):
             serial_logger = None
         else:
             serial_logger = self._logger.getChild("serial")
+        # Transcript
+        transcript_dir = self.device.link.communication.serial_transcript_dir
+        if transcript_dir is None:
+            transcript = None
+        else:
+            timestamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+            transcript = transcript_dir / f"{timestamp}_{type(self).__name__}.jsonl"
         # Command line
         return SerialCommandLine(
             self._tg,
             self.device.link.communication.tty,
             prompt,
+            # The device may still be at a baud rate that a previous context
+            # switched to.
+            baud_rate=self.device.metadata.baud_rate,
+            max_line_length=self._get_max_line_length(prompt),
+            transcript=transcript,
             logger=serial_logger,
         )
 
+    def _get_max_line_length(self, prompt: str) -> Optional[int]:
+        """Return the maximum length of a command line after the given prompt.
+
+        `None` means the default of `SerialCommandLine`.
+        """
+        return None
+
     async def run(self, command: str, **kwargs: Any) -> str:
         """Run command and wait for the response."""
         return await self.command_line.run(command, **kwargs)
@@ -80,6 +130,12 @@ class SerialBase(Base):
         """Run command and wait for the parsed response."""
         return await self.command_line.run_parsed(command, parse_as, **kwargs)
 
+    async def run_many(
+        self, commands: Sequence[str], **kwargs: Any
+    ) -> list[CommandResult]:
+        """Run the commands in a batch and return the result of each command."""
+        return await self.command_line.run_many(commands, **kwargs)
+
     async def aclose(self) -> None:
         """Close this context.
 
@@ -90,13 +146,19 @@ class SerialBase(Base):
         self._raise_if_exited()
         assert self._stack is not None
         await self._stack.aclose()
-        self.device.metadata = self.device.metadata.update(execution_context=None)
+        self.device.metadata = self.device.metadata.update(
+            execution_context=None, baud_rate=None
+        )
 
     async def __aenter__(self) -> Derived:
         await self._boot_if_necessary()
         async with AsyncExitStack() as stack:
             # Listen over serial. E.g., to get the boot log.
             self._serial = await stack.enter_async_context(self._serial_cm())
+            # Switch to a higher baud rate (if the user opted in)
+            baud_rate = self.device.link.communication.baud_rate
+            if baud_rate is not None:
+                await self._set_baud_rate(baud_rate)
             # Mark this context as "entered"
             await super().__aenter__()
             # Transfer ownership to this instance
@@ -3,3 +3,4 @@ from ._frequency_sweep import FrequencySweep
 from ._elec_ref import ElecRef
 from ._branding import Branding
 from ._hardware_identifications import HardwareIdentificationGroup
+from ._write_journal import WriteJournal, WriteTarget, WrittenExtent
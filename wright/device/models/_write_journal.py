@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from typing import Literal
+
+from ...model import FrozenModel
+
+# Storage that we write images to
+WriteTarget = Literal["flash", "mmc"]
+
+
+class WrittenExtent(FrozenModel):
+    """Extent of an image that we wrote to the device's storage."""
+
+    target: WriteTarget
+    # Where the extent is within the storage [bytes]. For the MMC, this is
+    # relative to the start of the MMC (not the partition).
+    offset: int
+    length: int
+    # CRC32 checksum of the extent
+    crc32: int
+
+    @property
+    def end(self) -> int:
+        """End of the extent (exclusive) [bytes]."""
+        return self.offset + self.length
+
+
+class WriteJournal(FrozenModel):
+    """Extents that we wrote to the device's storage.
+
+    Use this to resume an interrupted image write (e.g., after a USB timeout).
+    Note that the journal is a hint and not the truth. Someone else may have
+    overwritten an extent since. Verify each extent on the device before you
+    skip it.
+    """
+
+    extents: tuple[WrittenExtent, ...] = ()
+
+    def add(self, extent: WrittenExtent) -> WriteJournal:
+        """Return copy of this journal with the given extent.
+
+        Replaces the extents that overlap the given extent.
+        """
+        journal = self.forget(extent.target, extent.offset, extent.length)
+        return journal.update(extents=journal.extents + (extent,))
+
+    def forget(self, target: WriteTarget, offset: int, length: int) -> WriteJournal:
+        """Return copy of this journal without the extents that overlap the region."""
+        end = offset + length
+        return self.update(
+            extents=tuple(
+                extent
+                for extent in self.extents
+                if extent.target != target
+                or extent.end <= offset
+                or extent.offset >= end
+            )
+        )
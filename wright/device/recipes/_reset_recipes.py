@@ -1,5 +1,6 @@
 import logging
 from pathlib import Path
+from typing import Optional
 
 import anyio
 
@@ -14,47 +15,155 @@ from ..execution_context import (
 _LOGGER = logging.getLogger(__name__)
 
 
-async def reset_firmware(device: Device, firmware_image: Path) -> None:
-    """Remove any existing firmware and write the given image to the device."""
+async def reset_firmware(
+    device: Device,
+    firmware_image: Path,
+    delta: Optional[bool] = None,
+    wipe: Optional[bool] = None,
+    update: Optional[bool] = None,
+    verify: Optional[bool] = None,
+) -> None:
+    """Remove any existing firmware and write the given image to the device.
+
+    Per default, we erase the entire FLASH memory first. Set `wipe=False` to
+    only erase the FLASH sectors that we write to. This saves time but leaves
+    the rest of the FLASH memory as is (e.g., an old U-boot environment).
+    Set `update=True` to skip the sectors that already match the image. This
+    implies `wipe=False`.
+
+    Set `delta=True` to only rewrite the parts that differ from the image.
+    Set `verify=True` to read back what we write and rewrite the parts that
+    are corrupt.
+    """
+    if delta is None:
+        delta = False
+    if wipe is None:
+        wipe = True
+    if update is None:
+        update = False
+    if verify is None:
+        verify = False
     with anyio.fail_after(110):
         async with enter_context(WrightLiveUboot, device) as uboot:
-            # First, erase the entire FLASH memory
-            await uboot.erase_flash()
-            # Second, write the firmware image to FLASH memory.
-            await uboot.write_image_to_flash(firmware_image)
+            report = await uboot.write_image_to_flash(
+                firmware_image,
+                erase="full" if wipe else "extents",
+                update=update,
+                delta=delta,
+                verify=verify,
+            )
+    device.logger.info(
+        "Reset firmware erased %d FLASH sectors and skipped %d",
+        report.sectors_erased,
+        report.sectors_skipped,
+    )
+    if report.retries:
+        device.logger.warning(
+            "Reset firmware rewrote %d chunks that failed verification",
+            report.retries,
+        )
 
 
 async def reset_operating_system(
     device: Device,
     operating_system_image: Path,
-    software_version: str
+    software_version: str,
+    compressed_operating_system_image: Optional[Path] = None,
+    delta: Optional[bool] = None,
+    verify: Optional[bool] = None,
 ) -> None:
-    """Remove any existing operating system and write the given images to the device."""
+    """Remove any existing operating system and write the given images to the device.
+
+    If we get a compressed version of the image, we let the device decompress it
+    (if it can). This saves transfer time.
+
+    Set `delta=True` to only rewrite the parts that differ from the image.
+    Set `verify=True` to read back what we write and rewrite the parts that
+    are corrupt.
+    """
+    if delta is None:
+        delta = False
+    if verify is None:
+        verify = False
     with anyio.fail_after(100):
         async with enter_context(DeviceUboot, device) as uboot:
-            await uboot.partition_mmc()
-            # We must power-cycle the device so that U-boot recognizes the
-            # new partitioning.
+            partitioned = await uboot.partition_mmc()
+        # We must power-cycle the device so that U-boot recognizes the
+        # new partitioning. Otherwise, we stay in U-boot.
+        if partitioned:
             await device.hard_power_off()
 
         async with enter_context(DeviceUboot, device) as uboot:
             # Write to both "system" partitions so that we have a working fall-back
             # in case of a broken (interrupted) software update. This is part of the
             # dual boot strategy.
-            await uboot.write_image_to_mmc(
-                operating_system_image, uboot.mmc.system0, uboot.mmc.system1
-            )
+            #
+            # We don't pass `erased=True`. Neither a new partition table nor
+            # "mmc erase" gives us null bytes outside the extents of the image
+            # (the latter may give us 0xFF). Stale data in the null extents can
+            # corrupt the new file system (e.g., in its journal or inode tables).
+            if delta:
+                await uboot.write_image_to_mmc(
+                    operating_system_image,
+                    uboot.mmc.system0,
+                    uboot.mmc.system1,
+                    compressed_file=compressed_operating_system_image,
+                    delta=True,
+                    verify=verify,
+                )
+            else:
+                await uboot.write_sparse_image_to_mmc(
+                    operating_system_image,
+                    uboot.mmc.system0,
+                    uboot.mmc.system1,
+                    compressed_file=compressed_operating_system_image,
+                    verify=verify,
+                )
             # Write software version
             # TODO: Find a better point in time to do this. Maybe even as a separate step.
             await uboot.set_env("software_version", software_version)
 
 
-async def reset_config(device: Device, config_image: Path) -> None:
-    """Remove any existing config and write the given images to the device."""
+async def reset_config(
+    device: Device,
+    config_image: Path,
+    delta: Optional[bool] = None,
+    verify: Optional[bool] = None,
+    ssh_host_key: Optional[str] = None,
+) -> None:
+    """Remove any existing config and write the given images to the device.
+
+    Set `delta=True` to only rewrite the parts that differ from the image.
+    Set `verify=True` to read back what we write and rewrite the parts that
+    are corrupt.
+
+    Give the public SSH host key in the config image (if you know it) so that
+    `DeviceLinux` can connect over SSH right away.
+    """
+    if delta is None:
+        delta = False
+    if verify is None:
+        verify = False
     with anyio.fail_after(60):
         async with enter_context(DeviceUboot, device) as uboot:
-            # There is a single copy of the config image
-            await uboot.write_image_to_mmc(config_image, uboot.mmc.config)
+            # There is a single copy of the config image. Each device gets its
+            # own config image so there is no point in caching it. Like the
+            # operating system image, we fill the null extents (no `erased=True`).
+            if delta:
+                await uboot.write_image_to_mmc(
+                    config_image,
+                    uboot.mmc.config,
+                    delta=True,
+                    verify=verify,
+                    cache=False,
+                )
+            else:
+                await uboot.write_sparse_image_to_mmc(
+                    config_image, uboot.mmc.config, verify=verify, cache=False
+                )
+    # The config image contains the SSH host key. Any key that we knew
+    # beforehand is stale now.
+    device.metadata = device.metadata.update(ssh_host_key=ssh_host_key)
 
 
 async def reset_data(device: Device) -> None:
@@ -1 +1,8 @@
-from ._swupdate import DeviceBundle, DiskImage, MultiBundle, extract_swu
+from ._image_cache import IMAGE_CACHE, ImageCache
+from ._swupdate import (
+    DeviceBundle,
+    DiskImage,
+    MultiBundle,
+    decompress_file,
+    extract_swu,
+)
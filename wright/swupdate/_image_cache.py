@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import threading
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional, Sequence
+
+from ..util import (
+    TEMP_DIR,
+    FileExtent,
+    crc32_chunks,
+    crc32_combine,
+    find_extents,
+    get_chunks,
+)
+
+# Identifies a specific version of a file. If someone rewrites the file, we
+# get a new key and thus a new digest.
+_FileKey = tuple[int, int, int, int]
+# Bump this whenever the cached results change meaning (e.g., if someone changes
+# the default arguments of `util.find_extents`). We discard the entries of all
+# other versions.
+_CACHE_VERSION = 2
+# Size of the blocks that we checksum ahead of time. We combine the block
+# checksums into the checksum of any chunk (see `ImageCache.crc32_chunks`). This
+# matches the default granularity of `util.find_extents`. Therefore, we can
+# combine the checksum of each extent from whole blocks (except for the last
+# block of the file).
+_BLOCK_SIZE = 64 * 1024  # 64 KiB
+# We keep the analysis of this many images (the most recently used ones)
+_MAX_IMAGES = 16
+# We keep the digests of this many file versions (the most recent ones)
+_MAX_INDEX_ENTRIES = 256
+
+
+class ImageCache:
+    """Persistent cache of image analysis results (extents and checksums).
+
+    We key the cache by the SHA-256 digest of the image contents. This way, we
+    analyze each image once. Even if, e.g., several SWU files contain the same
+    image or if we provision devices from several processes.
+
+    We only hash an image once per version of the file (see `digest`).
+
+    We store a fixed number of entries per image: The extents (per set of
+    parameters) and the checksum of each block of the image. We derive the
+    checksum of any chunk from the latter. Moreover, we only keep the most
+    recently used images. This way, the cache stays bounded. Don't use the
+    cache for one-off images (e.g., a per-device config image). They only push
+    the useful entries out.
+
+    The analysis of an image takes seconds. Call the methods from a worker
+    thread (e.g., with `anyio.to_thread.run_sync`). It's safe to do so from
+    several threads at once.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self._directory = directory
+        self._root = directory / f"v{_CACHE_VERSION}"
+        self._digests: dict[_FileKey, str] = {}
+        # In-memory copy of the entries that we used in this process
+        self._entries: dict[tuple[str, str], Any] = {}
+        # Serializes the analysis. This way, we analyze each image only once
+        # even if several threads ask for it at the same time.
+        self._lock = threading.RLock()
+
+    def digest(self, file: Path) -> str:
+        """Return the SHA-256 digest of the file contents.
+
+        We remember the digest of each version of the file (as given by the
+        file stats). This way, we don't hash the same file twice.
+        """
+        stat = file.stat()
+        key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest is not None:
+                return digest
+            index_file = self._root / "index" / "-".join(map(str, key))
+            try:
+                digest = index_file.read_text()
+                _touch(index_file)
+            except FileNotFoundError:
+                digest = _hash_file(file)
+                _write_atomically(index_file, digest)
+                self._prune()
+            self._digests[key] = digest
+            return digest
+
+    def find_extents(
+        self,
+        file: Path,
+        *,
+        granularity: Optional[int] = None,
+        max_gap: Optional[int] = None,
+    ) -> list[FileExtent]:
+        """Return the non-null extents of the file (see `util.find_extents`)."""
+
+        def compute() -> list[tuple[int, int]]:
+            extents = find_extents(file, granularity=granularity, max_gap=max_gap)
+            return [(extent.offset, extent.length) for extent in extents]
+
+        parameters = {"granularity": granularity, "max_gap": max_gap}
+        raw_extents = self._get(file, "extents", parameters, compute)
+        return [FileExtent(offset, length) for offset, length in raw_extents]
+
+    def crc32_chunks(
+        self,
+        file: Path,
+        chunks: Iterable[FileExtent],
+        *,
+        extents: Optional[Sequence[FileExtent]] = None,
+        fill: Optional[int] = None,
+    ) -> list[int]:
+        """Return the CRC32 checksum of each chunk (see `util.crc32_chunks`).
+
+        We combine the cached block checksums into the checksum of each chunk.
+        We only read the partial blocks (if any) at either end of each chunk.
+
+        We don't cache the checksums of anything but the plain file contents.
+        I.e., we compute the checksums directly if you give us `extents` or
+        `fill` or if a chunk extends beyond the end of the file.
+        """
+        chunks = list(chunks)
+        size = file.stat().st_size
+        if (
+            extents is not None
+            or fill is not None
+            or any(chunk.end > size for chunk in chunks)
+        ):
+            return crc32_chunks(file, chunks, extents=extents, fill=fill)
+        block_crcs = self._get_block_crcs(file)
+        with file.open("rb") as io:
+            result: list[int] = []
+            for chunk in chunks:
+                # Head: From the start of the chunk to the first block boundary
+                head_end = min(-(-chunk.offset // _BLOCK_SIZE) * _BLOCK_SIZE, chunk.end)
+                io.seek(chunk.offset)
+                crc = zlib.crc32(io.read(head_end - chunk.offset))
+                # Body: Whole blocks
+                cursor = head_end
+                while cursor + _BLOCK_SIZE <= chunk.end:
+                    block_crc = block_crcs[cursor // _BLOCK_SIZE]
+                    crc = crc32_combine(crc, block_crc, _BLOCK_SIZE)
+                    cursor += _BLOCK_SIZE
+                # Tail: From the last block boundary to the end of the chunk
+                io.seek(cursor)
+                crc = zlib.crc32(io.read(chunk.end - cursor), crc)
+                result.append(crc)
+        return result
+
+    def prepare(self, file: Path) -> None:
+        """Analyze the image ahead of time.
+
+        This way, the first write of the image is as cheap as the rest.
+        """
+        self.find_extents(file)
+        self._get_block_crcs(file)
+
+    def _get_block_crcs(self, file: Path) -> list[int]:
+        def compute() -> list[int]:
+            return crc32_chunks(file, get_chunks(file.stat().st_size, _BLOCK_SIZE))
+
+        parameters = {"block_size": _BLOCK_SIZE}
+        return self._get(file, "crc32-blocks", parameters, compute)
+
+    def _get(
+        self,
+        file: Path,
+        kind: str,
+        parameters: Any,
+        compute: Callable[[], Any],
+    ) -> Any:
+        """Return the cached result or compute (and cache) it."""
+        with self._lock:
+            return self._get_locked(file, kind, parameters, compute)
+
+    def _get_locked(
+        self,
+        file: Path,
+        kind: str,
+        parameters: Any,
+        compute: Callable[[], Any],
+    ) -> Any:
+        digest = self.digest(file)
+        raw_parameters = json.dumps(parameters, sort_keys=True).encode()
+        parameters_digest = hashlib.sha256(raw_parameters).hexdigest()[:16]
+        entry_name = f"{kind}-{parameters_digest}.json"
+        image_dir = self._root / "images" / digest
+        try:
+            result = self._entries[(digest, entry_name)]
+        except KeyError:
+            pass
+        else:
+            _touch(image_dir)
+            return result
+        entry_file = image_dir / entry_name
+        try:
+            result = json.loads(entry_file.read_text())
+        except (FileNotFoundError, ValueError):
+            result = compute()
+            _write_atomically(entry_file, json.dumps(result))
+            self._prune()
+        _touch(image_dir)
+        self._entries[(digest, entry_name)] = result
+        return result
+
+    def _prune(self) -> None:
+        """Remove the least recently used entries and those of other versions.
+
+        Best effort. Another process may prune the cache at the same time.
+        """
+        for path in _list_dir(self._directory):
+            if path != self._root:
+                _remove(path)
+        images = _list_dir(self._root / "images")
+        for path in _least_recently_used(images, _MAX_IMAGES):
+            _remove(path)
+        index_files = _list_dir(self._root / "index")
+        for path in _least_recently_used(index_files, _MAX_INDEX_ENTRIES):
+            _remove(path)
+        # Forget the entries of the images that we just pruned
+        self._entries = {
+            key: value
+            for key, value in self._entries.items()
+            if (self._root / "images" / key[0]).exists()
+        }
+
+
+def _hash_file(file: Path) -> str:
+    digest = hashlib.sha256()
+    with file.open("rb") as io:
+        # We can't map an empty file
+        if os.fstat(io.fileno()).st_size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(io.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+            digest.update(mapping)
+    return digest.hexdigest()
+
+
+def _write_atomically(file: Path, text: str) -> None:
+    """Write the text to the file in one go.
+
+    Other processes either see the old file (if any) or the new file. Never
+    a partially written file.
+
+    Best effort. E.g., another process may prune the directory in the meantime.
+    In that case, we simply don't cache the text.
+    """
+    temp_file = file.with_name(f"{file.name}.{os.getpid()}.tmp")
+    try:
+        file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file.write_text(text)
+        os.replace(temp_file, file)
+    except OSError:
+        temp_file.unlink(missing_ok=True)
+
+
+def _list_dir(directory: Path) -> list[Path]:
+    try:
+        return list(directory.iterdir())
+    except FileNotFoundError:
+        return []
+
+
+def _least_recently_used(paths: Sequence[Path], keep: int) -> list[Path]:
+    """Return all but the `keep` most recently used paths."""
+
+    def mtime(path: Path) -> float:
+        try:
+            return path.stat().st_mtime
+        except FileNotFoundError:
+            return 0.0
+
+    return sorted(paths, key=mtime, reverse=True)[keep:]
+
+
+def _touch(path: Path) -> None:
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def _remove(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+# Shared between all users in this process
+IMAGE_CACHE = ImageCache(TEMP_DIR / "image_cache")
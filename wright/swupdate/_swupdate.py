@@ -13,6 +13,7 @@ from anyio.to_thread import run_sync
 from ..model import FrozenModel
 from ..subprocess import run_process
 from ..util import TEMP_DIR
+from ._image_cache import IMAGE_CACHE
 
 _CPIO_EXE = "cpio"
 _CHECKSUM_FILE_NAME = "swu-checksum"
@@ -23,6 +24,9 @@ class DiskImage(FrozenModel):
 
     file: Path
     version: str
+    # The original gzip-compressed image from the SWU file (if any). Note that
+    # `file` may not exist yet if we didn't decompress it.
+    compressed_file: Optional[Path] = None
 
 
 class DeviceBundle(FrozenModel):
@@ -46,9 +50,18 @@ class MultiBundle(FrozenModel):
         swu: Path,
         dest_dir: Optional[Path] = None,
         *,
+        decompress: Optional[bool] = None,
         logger: Optional[Logger] = None,
     ) -> MultiBundle:
-        """Return an instance created from the given SWUpdate file."""
+        """Return an instance created from the given SWUpdate file.
+
+        Set `decompress=False` to skip the decompression of the images on the
+        host. Use this if the device can decompress the images itself (see
+        `DiskImage.compressed_file`).
+
+        We analyze the (decompressed) images ahead of time (see `ImageCache`).
+        This way, each device that we write the images to benefits.
+        """
         # TODO: We call this function from different processes.
         # E.g.: hilt, wright CLI, and wright GUI. Therefore, there is a
         # race condition between these processes and the `swu_dir` cache.
@@ -56,6 +69,8 @@ class MultiBundle(FrozenModel):
         # file system-level lock. Maybe a simple lock file will do.
         if dest_dir is None:
             dest_dir = TEMP_DIR
+        if decompress is None:
+            decompress = True
         # Use the stats (e.g., last modified) of the given SWU file as a
         # fingerprint. We prefer this `stat`-based approach over, e.g.,
         # a CRC32 checksum since the former is a lot faster.
@@ -68,15 +83,32 @@ class MultiBundle(FrozenModel):
         # existing record.
         if not swu_dir.exists():
             await extract_swu(swu, swu_dir, logger=logger)
-            await decompress_files(swu_dir, logger=logger)
+            if decompress:
+                await decompress_files(swu_dir, logger=logger)
             store_checksum(swu, checksum_file)
         # Get version and device bundles
         version, device_bundles = await parse_swu(sw_description_file)
+        await prepare_device_bundles(device_bundles, logger=logger)
         # Get checksum
         checksum = checksum_file.read_text()
         return cls(checksum=checksum, version=version, device_bundles=device_bundles)
 
 
+async def prepare_device_bundles(
+    device_bundles: dict[str, DeviceBundle], *, logger: Optional[Logger] = None
+) -> None:
+    """Analyze the images of each bundle ahead of time (see `ImageCache`).
+
+    Skips the images that don't exist (e.g., because we didn't decompress them).
+    """
+    for bundle in device_bundles.values():
+        for image in (bundle.firmware, bundle.operating_system):
+            if image.file.exists():
+                if logger is not None:
+                    logger.debug(f"Analyze {image.file}")
+                await run_sync(IMAGE_CACHE.prepare, image.file)
+
+
 async def extract_swu(
     swu: Path, dest_dir: Path, *, logger: Optional[Logger] = None
 ) -> None:
@@ -100,27 +132,44 @@ async def decompress_files(
 
     This creates a new file next to the compressed file.
     """
-    if chunk_size is None:
-        chunk_size = 2 ** 20  # 1 MiB
     gz_files = (gz_file for gz_file in directory.glob("*.gz") if gz_file.is_file())
     async with anyio.create_task_group() as tg:
         for gz_file in gz_files:
-            if logger is not None:
-                logger.debug(f"Decompress {gz_file}")
             tg.start_soon(_decompress_file, gz_file, chunk_size, logger)
 
 
-async def _decompress_file(*args: Any) -> None:
-    await run_sync(_decompress_file_sync, *args)
+async def decompress_file(
+    gz_file: Path,
+    *,
+    chunk_size: Optional[int] = None,
+    logger: Optional[Logger] = None,
+) -> Path:
+    """Decompress the given `.gz` file.
+
+    This creates a new file next to the compressed file. Returns the path
+    of said new file.
+    """
+    await _decompress_file(gz_file, chunk_size, logger)
+    return gz_file.with_suffix("")
+
+
+async def _decompress_file(
+    gz_file: Path, chunk_size: Optional[int], logger: Optional[Logger]
+) -> None:
+    if chunk_size is None:
+        chunk_size = 2 ** 20  # 1 MiB
+    if logger is not None:
+        logger.debug(f"Decompress {gz_file}")
+    await run_sync(_decompress_file_sync, gz_file, chunk_size, logger)
 
 
 def _decompress_file_sync(
     gz_file: Path,
     chunk_size: int,
-    logger: Logger,
+    logger: Optional[Logger],
 ) -> None:
     uncompressed = gz_file.with_suffix("")
-    if uncompressed.exists():
+    if uncompressed.exists() and logger is not None:
         logger.warning(
             f"The file {uncompressed} already exists. "
             f"We override it with the decompressed contents of {gz_file}."
@@ -183,12 +232,12 @@ def _parse_image(image: dict[str, str], directory: Path) -> DiskImage:
     """Create a `DiskImage` based on the given image dict."""
     filename = image["filename"]
     file = directory / filename
-    # If there is a decompressed version of the file, prefer that over the
-    # compressed version.
+    # Refer to the decompressed version of the file even if it doesn't exist
+    # (yet). Keep the compressed version around as well.
     if file.suffix == ".gz":
-        uncompressed = file.with_suffix("")
-        if uncompressed.is_file():
-            file = uncompressed
+        return DiskImage(
+            file=file.with_suffix(""), version=image["version"], compressed_file=file
+        )
     return DiskImage(file=file, version=image["version"])
 
 
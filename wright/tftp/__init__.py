@@ -1 +1,2 @@
+from ._protocol import TransferStats, VirtualFile
 from ._tftp import AsyncTFTPServer
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import mmap
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+# Identifies a specific version of a file. If someone rewrites the file, we
+# get a new key and thus a new mapping.
+_FileKey = tuple[int, int, int, int]
+
+
+@dataclass
+class MappedFile:
+    """Read-only, memory-mapped file."""
+
+    path: Path
+    key: _FileKey
+    size: int
+    # We keep a single `memoryview` into the mapping. Slices of this view
+    # don't copy the underlying data.
+    view: memoryview
+    _mapping: Optional[mmap.mmap]
+    _references: int = field(default=0)
+
+    def close(self) -> None:
+        """Unmap the file."""
+        self.view.release()
+        if self._mapping is not None:
+            self._mapping.close()
+
+
+class FileCache:
+    """Memory-mapped files shared between concurrent transfers.
+
+    We map each file once and share the mapping between all transfers of said
+    file. We unmap the file when the last transfer releases it.
+    """
+
+    def __init__(self) -> None:
+        self._files: dict[_FileKey, MappedFile] = {}
+
+    def acquire(self, path: Path) -> MappedFile:
+        """Return a mapping of the given file.
+
+        Remember to `release` the mapping when you are done with it.
+        """
+        with path.open("rb") as io:
+            stat = os.fstat(io.fileno())
+            key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            file = self._files.get(key)
+            if file is None:
+                file = _map(path, io.fileno(), key, stat.st_size)
+                self._files[key] = file
+        file._references += 1  # pylint: disable=protected-access
+        return file
+
+    def release(self, file: MappedFile) -> None:
+        """Release a mapping from `acquire`."""
+        file._references -= 1  # pylint: disable=protected-access
+        if file._references > 0:  # pylint: disable=protected-access
+            return
+        del self._files[file.key]
+        file.close()
+
+
+def _map(path: Path, fd: int, key: _FileKey, size: int) -> MappedFile:
+    # We can't map an empty file
+    if size == 0:
+        return MappedFile(path, key, size, memoryview(b""), None)
+    mapping = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    # We read the file front to back. Let the kernel know so that it can
+    # read ahead aggressively.
+    if hasattr(mapping, "madvise"):
+        mapping.madvise(mmap.MADV_SEQUENTIAL)
+    return MappedFile(path, key, size, memoryview(mapping), mapping)
+
+
+# Shared between all TFTP servers in this process
+FILE_CACHE = FileCache()
@@ -1,79 +1,426 @@
-# HACK: The following is a hack to py3tftp so that it can serve files
-# from other directories than the CWD.
-#
-# py3tftp is not typed. Therefore, we ignore a lot of type-related
-# errors here and use `Any` a lot.
-#
-# pylint: disable-all
+"""Read-only TFTP server (RFC 1350) with option extensions.
 
+We support the following options:
+
+  * blksize (RFC 2348)
+  * timeout and tsize (RFC 2349)
+  * windowsize (RFC 7440)
+
+We only serve files (read requests). We reject write requests.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
 import os
+import struct
+import time
+from dataclasses import dataclass
+from enum import IntEnum
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Mapping, Optional, cast
 
-from py3tftp.file_io import FileReader, FileWriter  # type: ignore
-from py3tftp.netascii import Netascii  # type: ignore
-from py3tftp.protocols import TFTPServerProtocol  # type: ignore
+from ._file_cache import FILE_CACHE, MappedFile
 
+_LOGGER = logging.getLogger(__name__)
 
-def patch_py3tftp() -> None:
-    """Monkeypatch various classes from py3tftp."""
-    _original__init__ = TFTPServerProtocol.__init__
+Address = tuple[str, int]
 
-    def _patched__init__(self: Any, *args: Any, directory: Path, **kwargs: Any) -> None:
-        _original__init__(self, *args, **kwargs)
-        self._directory = directory
+_DEFAULT_BLOCK_SIZE = 512
+# Largest block size allowed by RFC 2348
+_MAX_BLOCK_SIZE = 65464
+# Largest window size allowed by RFC 7440
+_MAX_WINDOW_SIZE = 65535
+_DEFAULT_TIMEOUT = 2.0
+# Number of times that we resend a window before we give up
+_MAX_RETRIES = 5
 
-    def _patched_select_file_handler(self: Any, packet: Any) -> Any:
-        """Return the file handler that corresponds to the packet."""
-        if packet.is_wrq():
-            return lambda filename, opts: FileWriter(
-                filename, self._directory, opts, packet.mode
-            )
-        else:
-            return lambda filename, opts: FileReader(
-                filename, self._directory, opts, packet.mode
-            )
 
-    TFTPServerProtocol.__init__ = _patched__init__
-    TFTPServerProtocol.select_file_handler = _patched_select_file_handler
+class _Opcode(IntEnum):
+    RRQ = 1
+    WRQ = 2
+    DATA = 3
+    ACK = 4
+    ERROR = 5
+    OACK = 6
 
-    def _file_reader__init__(
-        self: Any, fname: Any, directory: Path, chunk_size: int = 0, mode: Any = None
-    ) -> None:
-        self._f = None
-        self.fname = _sanitize_fname(fname, directory)
-        self.chunk_size = chunk_size
-        self._f = self._open_file()
-        self.finished = False
 
-        if mode == b"netascii":
-            self._f = Netascii(self._f)
+class _ErrorCode(IntEnum):
+    FILE_NOT_FOUND = 1
+    ACCESS_VIOLATION = 2
+    ILLEGAL_OPERATION = 4
+    UNKNOWN_TRANSFER_ID = 5
+
+
+@dataclass(frozen=True)
+class VirtualFile:
+    """Byte range of a file that we serve as if it was a file of its own."""
+
+    path: Path
+    offset: int
+    length: int
+
+
+@dataclass(frozen=True)
+class TransferStats:
+    """Statistics of a completed file transfer."""
+
+    # As requested by the client
+    filename: str
+    remote: Address
+    # Number of bytes transferred
+    size: int
+    # From the read request until the last acknowledgement [s]
+    duration: float
+    # Number of data blocks sent including retransmissions
+    blocks_sent: int
+    # Number of data blocks that we had to resend
+    retransmits: int
+    # Options that we agreed on with the client (e.g., "blksize")
+    options: dict[str, int]
 
-    FileReader.__init__ = _file_reader__init__
+    @property
+    def throughput(self) -> float:
+        """Return the average throughput [bytes/s]."""
+        if self.duration <= 0:
+            return float("inf")
+        return self.size / self.duration
 
-    def _file_writer__init__(
-        self: Any, fname: Any, directory: Path, chunk_size: int, mode: Any = None
+    def __str__(self) -> str:
+        options = " ".join(f"{key}={value}" for key, value in self.options.items())
+        return (
+            f"{self.filename}: {self.size} bytes in {self.duration:.2f} s "
+            f"({self.throughput / 1e6:.2f} MB/s, {self.retransmits} retransmits, "
+            f"options: {options or 'none'})"
+        )
+
+
+class TFTPServerProtocol(asyncio.DatagramProtocol):
+    """Accept read requests and start a transfer for each of them.
+
+    Each transfer gets its own UDP port (the "transfer ID" in TFTP terms).
+
+    We look up the requested file name in `virtual_files` first. If it's not
+    there, we look for the file in `directory`.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        *,
+        directory: Path,
+        virtual_files: Optional[Mapping[str, VirtualFile]] = None,
+        on_transfer: Optional[Callable[[TransferStats], None]] = None,
     ) -> None:
-        self._f = None
-        self.fname = _sanitize_fname(fname, directory)
-        self.chunk_size = chunk_size
-        self._f = self._open_file()
+        self._host = host
+        self._directory = directory.absolute()
+        self._virtual_files = virtual_files if virtual_files is not None else {}
+        self._on_transfer = on_transfer
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        # Transfers in progress (client address and file name)
+        self._active: set[tuple[Address, str]] = set()
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self._transport = cast(asyncio.DatagramTransport, transport)
 
-        if mode == b"netascii":
-            self._f = Netascii(self._f)
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        for task in self._tasks:
+            task.cancel()
 
-    FileWriter.__init__ = _file_writer__init__
+    def datagram_received(self, data: bytes, addr: Any) -> None:
+        assert self._transport is not None
+        try:
+            opcode, filename, mode, options = _parse_request(data)
+        except ValueError as exc:
+            _LOGGER.debug("Ignore malformed request from %s: %s", addr, exc)
+            return
+        if opcode != _Opcode.RRQ:
+            self._send_error(
+                addr, _ErrorCode.ILLEGAL_OPERATION, "Only read requests are supported"
+            )
+            return
+        if mode != "octet":
+            self._send_error(
+                addr, _ErrorCode.ILLEGAL_OPERATION, "Only octet mode is supported"
+            )
+            return
+        virtual_file = self._virtual_files.get(filename)
+        if virtual_file is None:
+            path = self._resolve(filename)
+            if path is None:
+                self._send_error(addr, _ErrorCode.ACCESS_VIOLATION, "Access violation")
+                return
+        else:
+            path = virtual_file.path
+        # The client may resend its request if our response is slow. Ignore
+        # said duplicates.
+        key = (addr, filename)
+        if key in self._active:
+            return
+        try:
+            file = FILE_CACHE.acquire(path)
+        except OSError:
+            self._send_error(addr, _ErrorCode.FILE_NOT_FOUND, "File not found")
+            return
+        if virtual_file is None:
+            offset, length = 0, file.size
+        else:
+            offset, length = virtual_file.offset, virtual_file.length
+        # The file may have changed since someone registered the virtual file
+        if offset + length > file.size:
+            FILE_CACHE.release(file)
+            self._send_error(addr, _ErrorCode.FILE_NOT_FOUND, "File too short")
+            return
+        self._active.add(key)
+        transfer = _ReadTransfer(filename, file, offset, length, addr, options)
+        task = asyncio.get_running_loop().create_task(self._transfer(transfer))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _transfer(self, transfer: _ReadTransfer) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: transfer, local_addr=(self._host, 0)
+            )
+            try:
+                stats = await transfer.done
+            finally:
+                transport.close()
+        except Exception as exc:  # pylint: disable=broad-except
+            _LOGGER.warning(
+                "Transfer of %s to %s failed: %s",
+                transfer.filename,
+                transfer.remote,
+                exc,
+            )
+            return
+        finally:
+            self._active.discard((transfer.remote, transfer.filename))
+            FILE_CACHE.release(transfer.file)
+        _LOGGER.info("Sent %s", stats)
+        if self._on_transfer is not None:
+            self._on_transfer(stats)
 
-    def _sanitize_fname(fname: bytes, directory: Path) -> Path:
-        path = (directory / os.fsdecode(fname)).absolute()
+    def _resolve(self, filename: str) -> Optional[Path]:
+        """Return the path of the given file or `None` if it's off-limits."""
+        path = Path(os.path.normpath(self._directory / filename))
         # Verify that the path is within the directory
-        if not path.is_relative_to(directory):
-            raise FileNotFoundError
-        # Verify that the path is not reserved
-        if path.is_reserved():
-            raise FileNotFoundError
+        if not path.is_relative_to(self._directory):
+            return None
         return path
 
+    def _send_error(self, addr: Address, code: _ErrorCode, message: str) -> None:
+        assert self._transport is not None
+        _LOGGER.debug("Send error to %s: %s", addr, message)
+        self._transport.sendto(_error_packet(code, message), addr)
+
+
+class _ReadTransfer(asyncio.DatagramProtocol):
+    """Send a single file to a single client.
+
+    We send up to `windowsize` blocks in a row and then wait for the client to
+    acknowledge the last of them (RFC 7440). If the client acknowledges an
+    earlier block, it lost the blocks that follow. We then resend from there.
+    If the client doesn't respond at all, we resend the entire window.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        filename: str,
+        file: MappedFile,
+        offset: int,
+        length: int,
+        remote: Address,
+        options: dict[str, str],
+    ):
+        self.filename = filename
+        self.file = file
+        self.remote = remote
+        self._offset = offset
+        self._length = length
+        self._start = time.perf_counter()
+        self._options = _negotiate(options, length)
+        self._block_size = self._options.get("blksize", _DEFAULT_BLOCK_SIZE)
+        self._window_size = self._options.get("windowsize", 1)
+        self._timeout = float(self._options.get("timeout", _DEFAULT_TIMEOUT))
+        # We always end with a block that is shorter than the block size. This
+        # may be an empty block.
+        self._last_block = length // self._block_size + 1
+        # Block numbers are 16 bit on the wire. We count beyond that internally
+        # and wrap around to 0 (not 1) on the wire. Block 0 is the option
+        # acknowledgement (if any).
+        self._acked = 0
+        self._next = 1
+        self._highest_sent = 0
+        self._awaiting_oack = bool(self._options)
+        self._retries = 0
+        self._blocks_sent = 0
+        self._retransmits = 0
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        loop = asyncio.get_running_loop()
+        self.done: asyncio.Future[TransferStats] = loop.create_future()
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self._transport = cast(asyncio.DatagramTransport, transport)
+        if self._awaiting_oack:
+            self._send_oack()
+        else:
+            self._send_window()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._finish(exception=exc or ConnectionAbortedError("Transfer closed"))
+
+    def error_received(self, exc: Exception) -> None:
+        self._finish(exception=exc)
+
+    def datagram_received(self, data: bytes, addr: Any) -> None:
+        if addr != self.remote:
+            self._send(
+                _error_packet(_ErrorCode.UNKNOWN_TRANSFER_ID, "Unknown transfer ID"),
+                addr,
+            )
+            return
+        if len(data) < 4:
+            return
+        opcode, block = struct.unpack_from("!HH", data)
+        if opcode == _Opcode.ERROR:
+            message = data[4:].split(b"\0", 1)[0].decode(errors="replace")
+            self._finish(exception=ConnectionAbortedError(f"Client error: {message}"))
+            return
+        if opcode != _Opcode.ACK:
+            return
+        if self._awaiting_oack:
+            if block == 0:
+                self._awaiting_oack = False
+                self._retries = 0
+                self._send_window()
+            return
+        # Map the 16-bit block number to our internal block count. We ignore
+        # acknowledgements outside the current window (e.g., duplicates).
+        delta = (block - self._acked) & 0xFFFF
+        if not 1 <= delta <= self._next - 1 - self._acked:
+            return
+        self._acked += delta
+        self._retries = 0
+        if self._acked == self._last_block:
+            self._finish()
+            return
+        # If the client acknowledged an earlier block in the window, it lost
+        # the rest. Either way, we continue right after the acknowledged block.
+        self._send_window()
+
+    def _send_oack(self) -> None:
+        payload = b"".join(
+            f"{key}\0{value}\0".encode() for key, value in self._options.items()
+        )
+        self._send(struct.pack("!H", _Opcode.OACK) + payload)
+        self._restart_timer()
+
+    def _send_window(self) -> None:
+        first = self._acked + 1
+        last = min(self._acked + self._window_size, self._last_block)
+        for block in range(first, last + 1):
+            self._send(self._data_packet(block))
+            self._blocks_sent += 1
+            if block <= self._highest_sent:
+                self._retransmits += 1
+        self._highest_sent = max(self._highest_sent, last)
+        self._next = last + 1
+        self._restart_timer()
+
+    def _data_packet(self, block: int) -> bytearray:
+        start = (block - 1) * self._block_size
+        end = min(start + self._block_size, self._length)
+        # This is the only copy of the data (from the mapping into the packet)
+        packet = bytearray(struct.pack("!HH", _Opcode.DATA, block & 0xFFFF))
+        packet += self.file.view[self._offset + start : self._offset + end]
+        return packet
+
+    def _restart_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_later(self._timeout, self._on_timeout)
+
+    def _on_timeout(self) -> None:
+        self._retries += 1
+        if self._retries > _MAX_RETRIES:
+            self._finish(exception=TimeoutError("Client stopped responding"))
+            return
+        if self._awaiting_oack:
+            self._send_oack()
+        else:
+            self._send_window()
+
+    def _send(self, packet: bytes, addr: Optional[Address] = None) -> None:
+        assert self._transport is not None
+        self._transport.sendto(packet, addr or self.remote)
+
+    def _finish(self, *, exception: Optional[BaseException] = None) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        if self.done.done():
+            return
+        if exception is not None:
+            self.done.set_exception(exception)
+            return
+        stats = TransferStats(
+            filename=self.filename,
+            remote=self.remote,
+            size=self._length,
+            duration=time.perf_counter() - self._start,
+            blocks_sent=self._blocks_sent,
+            retransmits=self._retransmits,
+            options=self._options,
+        )
+        self.done.set_result(stats)
+
+
+def _parse_request(data: bytes) -> tuple[int, str, str, dict[str, str]]:
+    """Parse a read/write request into opcode, filename, mode, and options."""
+    if len(data) < 2:
+        raise ValueError("Packet too short")
+    (opcode,) = struct.unpack_from("!H", data)
+    if opcode not in (_Opcode.RRQ, _Opcode.WRQ):
+        raise ValueError(f"Unexpected opcode {opcode}")
+    fields = data[2:].split(b"\0")
+    # The packet ends with a null byte so the last field is empty
+    if len(fields) < 3 or fields[-1] != b"":
+        raise ValueError("Missing null terminator")
+    filename, mode, *raw_options = (field.decode() for field in fields[:-1])
+    if len(raw_options) % 2 != 0:
+        raise ValueError("Option without value")
+    options = {
+        key.lower(): value for key, value in zip(raw_options[::2], raw_options[1::2])
+    }
+    return opcode, filename, mode.lower(), options
+
+
+def _negotiate(requested: dict[str, str], file_size: int) -> dict[str, int]:
+    """Return the options that we accept out of the requested ones.
+
+    We silently ignore options that we don't support or don't understand.
+    """
+    result: dict[str, int] = {}
+    for key, raw_value in requested.items():
+        try:
+            value = int(raw_value)
+        except ValueError:
+            continue
+        if key == "blksize" and value >= 8:
+            result[key] = min(value, _MAX_BLOCK_SIZE)
+        elif key == "windowsize" and value >= 1:
+            result[key] = min(value, _MAX_WINDOW_SIZE)
+        elif key == "timeout" and 1 <= value <= 255:
+            result[key] = value
+        elif key == "tsize":
+            # The client sends 0 and we respond with the actual size
+            result[key] = file_size
+    return result
+
 
-# Apply the patch on import
-patch_py3tftp()
+def _error_packet(code: _ErrorCode, message: str) -> bytes:
+    return struct.pack("!HH", _Opcode.ERROR, code) + message.encode() + b"\0"
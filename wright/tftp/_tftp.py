@@ -1,14 +1,13 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
 import logging
-from asyncio.protocols import BaseProtocol
-from asyncio.transports import BaseTransport
 from pathlib import Path
 from types import TracebackType
-from typing import Optional, Type, cast
+from typing import Callable, Optional, Type
 
-from ._protocol import TFTPServerProtocol
+from ._protocol import TFTPServerProtocol, TransferStats, VirtualFile
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -16,27 +15,73 @@ _LOGGER = logging.getLogger(__name__)
 class AsyncTFTPServer:
     """TFTP server.
 
-    Serves files from the current working directory.
+    Serves files (read-only) from the given directory. In addition, serves
+    virtual files: Byte ranges of files anywhere on the host. Use the latter to
+    transfer parts of a large image without copying said parts to separate files.
+
+    We log the statistics of each completed transfer. Give us `on_transfer` if
+    you want them as well. We don't keep them around.
     """
 
-    def __init__(self, host: str, port: int, *, directory: Path) -> None:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        *,
+        directory: Path,
+        on_transfer: Optional[Callable[[TransferStats], None]] = None,
+    ) -> None:
         self._host = host
         self._port = port
         self._directory = directory
-        self._transport: Optional[BaseTransport] = None
-        self._protocol: Optional[BaseProtocol] = None
+        self._on_transfer = on_transfer
+        self._transport: Optional[asyncio.BaseTransport] = None
+        self._virtual_files: dict[str, VirtualFile] = {}
+        # Number of `add_virtual_file` calls (minus the `remove_virtual_file`
+        # calls) per virtual file name
+        self._virtual_file_references: dict[str, int] = {}
 
-    async def __aenter__(self) -> AsyncTFTPServer:
-        loop = asyncio.get_event_loop()
+    def add_virtual_file(self, path: Path, offset: int, length: int) -> str:
+        """Serve the given byte range of the file under a virtual file name.
 
-        def _protocol_factory() -> BaseProtocol:
-            protocol = TFTPServerProtocol(
-                self._host, loop, directory=self._directory, extra_opts=None
+        Returns the virtual file name. The name is unique to the (resolved) path
+        and the byte range. If you add the same range twice, we serve it until
+        you remove it twice.
+        """
+        size = path.stat().st_size
+        if offset < 0 or length < 0 or offset + length > size:
+            raise ValueError(
+                f"Range (offset:{offset} length:{length}) is outside of "
+                f"{path} (size:{size})"
             )
-            return cast(BaseProtocol, protocol)
+        # Files with the same name (in different directories) get different
+        # virtual file names.
+        path_digest = hashlib.sha256(str(path.resolve()).encode()).hexdigest()[:16]
+        name = f"{path.name}__{path_digest}__offset_{offset}__length_{length}"
+        self._virtual_files[name] = VirtualFile(path, offset, length)
+        self._virtual_file_references[name] = (
+            self._virtual_file_references.get(name, 0) + 1
+        )
+        return name
+
+    def remove_virtual_file(self, name: str) -> None:
+        """Stop serving the virtual file (see `add_virtual_file`)."""
+        self._virtual_file_references[name] -= 1
+        if self._virtual_file_references[name] > 0:
+            return
+        del self._virtual_file_references[name]
+        del self._virtual_files[name]
 
-        self._transport, self._protocol = await loop.create_datagram_endpoint(
-            _protocol_factory, local_addr=(self._host, self._port)
+    async def __aenter__(self) -> AsyncTFTPServer:
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: TFTPServerProtocol(
+                self._host,
+                directory=self._directory,
+                virtual_files=self._virtual_files,
+                on_transfer=self._on_transfer,
+            ),
+            local_addr=(self._host, self._port),
         )
         return self
 
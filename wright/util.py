@@ -1,79 +1,210 @@
 from __future__ import annotations
 
+import mmap
+import os
 import socket
+import zlib
 from dataclasses import dataclass
+from functools import lru_cache
 from itertools import chain
 from pathlib import Path
 from types import TracebackType
-from typing import Any, Callable, List, Optional, Type
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Type
 
 TEMP_DIR = Path("/tmp/wright")
 
 
 @dataclass(frozen=True)
-class FilePart:
-    """Part of a larger file identified by an offset into said file."""
+class FileExtent:
+    """Byte range within a file."""
 
-    path: Path
     offset: int
+    length: int
 
+    @property
+    def end(self) -> int:
+        """Return the offset just past the last byte of this extent."""
+        return self.offset + self.length
 
-def split_file(file_path: Path, *, chunk_size: Optional[int] = None) -> List[FilePart]:
-    r"""Split file into parts while skipping null-bytes.
+
+def find_extents(
+    file_path: Path,
+    *,
+    granularity: Optional[int] = None,
+    max_gap: Optional[int] = None,
+) -> List[FileExtent]:
+    r"""Return the non-null byte ranges of the given file.
 
     Imagine that the following byte sequence represents a large file:
 
         10110111100100000000000000000010101000000000101110
 
-    First, we split it into chunks:
+    First, we split it into chunks of `granularity` bytes:
 
         | C0 | C1 | C2 | C3 | C4 | C5 | C6 | C7 | C8 | C9 |
         10110111100100000000000000000010101000000000101110
 
-    Then, we output the non-null chunks into separate files:
+    Then, we return the ranges of consecutive non-null chunks:
 
         | C0 | C1 | C2 | C3 | C4 | C5 | C6 | C7 | C8 | C9 |
         10110111100100000000000000000010101000000000101110
         \_____________/               \___/     \________/
-            Part 0                    Part 1      Part 2
+           Extent 0                  Extent 1   Extent 2
+
+        Extent 0: C0–C2 (offset 0, length 15)
+        Extent 1:    C6 (offset 30, length 5)
+        Extent 2: C8–C9 (offset 40, length 10)
 
-        Part 0: C0–C2 goes into "part_offset0.bin"
-        Part 1:    C6 goes into "part_offset30.bin"
-        Part 2: C8–C9 goes into "part_offset40.bin"
+    This way, the caller can skip most of the null-bytes.
 
-    This way, we effectively skip most of the null-bytes.
+    The default granularity is the erase sector size of the QSPI FLASH (64 KiB).
+    This way, each extent starts on a sector boundary.
+
+    Each extent costs the caller a round trip or two (e.g., a transfer and a
+    write command). Therefore, we merge extents that are only `max_gap` bytes
+    apart (or less). E.g., `max_gap=0` only merges adjacent chunks.
     """
-    result = []
     # Default arguments
-    if chunk_size is None:
-        chunk_size = 1024 * 1024  # 1 MiB
-    # The sentinel is a series of null bytes. When we reach the
-    # sentinel while reading the file, we start skipping.
-    sentinel = bytes(chunk_size)
+    if granularity is None:
+        granularity = 64 * 1024  # 64 KiB
+    if max_gap is None:
+        max_gap = 4 * granularity
+    result: List[FileExtent] = []
+    sentinel = bytes(granularity)
     with file_path.open("rb") as io:
-        done = False
-        while not done:
-            part_data = bytes()
-            offset = io.tell()
-            # Read until we reach the sentinel or there is no more data
-            while chunk := io.read(chunk_size):
-                if chunk == sentinel:
-                    break
-                part_data += chunk
-            else:
-                done = True
-            # If there is no data to write out (it was all null bytes),
-            # we early out.
-            if not part_data:
-                continue
-            # Otherwise, we write the data out to as a file.
-            part_path = TEMP_DIR / f"{file_path.name}__offset_{offset}.bin"
-            with part_path.open("wb") as part_io:
-                part_io.write(part_data)
-            result.append(FilePart(part_path, offset))
+        size = os.fstat(io.fileno()).st_size
+        # We can't map an empty file
+        if size == 0:
+            return result
+        with mmap.mmap(io.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+            for offset in range(0, size, granularity):
+                # We copy a single chunk at a time out of the mapping. This is
+                # our peak memory use. The comparison is a simple `memcmp`.
+                chunk = mapping[offset : offset + granularity]
+                if chunk == sentinel[: len(chunk)]:
+                    continue
+                if result and offset - result[-1].end <= max_gap:
+                    previous = result.pop()
+                    result.append(
+                        FileExtent(
+                            previous.offset, offset + len(chunk) - previous.offset
+                        )
+                    )
+                else:
+                    result.append(FileExtent(offset, len(chunk)))
     return result
 
 
+def get_chunks(size: int, chunk_size: int) -> list[FileExtent]:
+    """Split `size` bytes into chunks of `chunk_size` bytes.
+
+    The last chunk may be shorter than the rest.
+    """
+    return [
+        FileExtent(offset, min(chunk_size, size - offset))
+        for offset in range(0, size, chunk_size)
+    ]
+
+
+def crc32_chunks(
+    file: Path,
+    chunks: Iterable[FileExtent],
+    *,
+    extents: Optional[Sequence[FileExtent]] = None,
+    fill: Optional[int] = None,
+) -> list[int]:
+    """Return the CRC32 checksum of each chunk of the file.
+
+    If you give us `extents`, we only use the file contents within said extents.
+    We use `fill` for all other bytes (also for bytes beyond the end of the file).
+    Use this to compute the checksums of, e.g., erased FLASH memory with only the
+    given extents written to it.
+    """
+    if fill is None:
+        fill = 0
+    fill_byte = bytes([fill])
+    with file.open("rb") as io:
+        size = os.fstat(io.fileno()).st_size
+        if extents is None:
+            extents = [FileExtent(0, size)]
+        # We can't map an empty file
+        mapping = mmap.mmap(io.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+    view = memoryview(mapping if mapping is not None else b"")
+    try:
+        result: list[int] = []
+        for chunk in chunks:
+            crc = 0
+            cursor = chunk.offset
+            for extent in extents:
+                start = max(extent.offset, chunk.offset)
+                end = min(extent.end, chunk.end, size)
+                if start >= end:
+                    continue
+                crc = zlib.crc32(fill_byte * (start - cursor), crc)
+                crc = zlib.crc32(view[start:end], crc)
+                cursor = end
+            crc = zlib.crc32(fill_byte * (chunk.end - cursor), crc)
+            result.append(crc)
+        return result
+    finally:
+        view.release()
+        if mapping is not None:
+            mapping.close()
+
+
+def crc32_combine(crc1: int, crc2: int, length2: int) -> int:
+    """Return the CRC32 checksum of A followed by B.
+
+    Give us the checksum of A (`crc1`), the checksum of B (`crc2`), and the length
+    of B in bytes (`length2`). This is a port of zlib's `crc32_combine`. Use it to,
+    e.g., combine the checksums of an extent that we read back window by window.
+    """
+    return _gf2_matrix_times(_crc32_shift_operator(length2), crc1) ^ crc2
+
+
+@lru_cache(maxsize=64)
+def _crc32_shift_operator(length: int) -> tuple[int, ...]:
+    """Return the operator that appends `length` null bytes to a CRC32 checksum.
+
+    The operator is a 32x32 matrix over GF(2). Each entry is a column.
+    """
+    # Operator that appends a single null bit
+    odd = [0xEDB88320] + [1 << row for row in range(31)]
+    # Operators for two and four null bits
+    even = _gf2_matrix_square(odd)
+    odd = _gf2_matrix_square(even)
+    # Start with the identity operator. We then apply the operator for each set
+    # bit in `length` (starting from one byte).
+    result = [1 << row for row in range(32)]
+    while length > 0:
+        even = _gf2_matrix_square(odd)
+        if length & 1:
+            result = [_gf2_matrix_times(even, column) for column in result]
+        length >>= 1
+        if length == 0:
+            break
+        odd = _gf2_matrix_square(even)
+        if length & 1:
+            result = [_gf2_matrix_times(odd, column) for column in result]
+        length >>= 1
+    return tuple(result)
+
+
+def _gf2_matrix_times(matrix: Sequence[int], vector: int) -> int:
+    result = 0
+    row = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[row]
+        vector >>= 1
+        row += 1
+    return result
+
+
+def _gf2_matrix_square(matrix: Sequence[int]) -> list[int]:
+    return [_gf2_matrix_times(matrix, column) for column in matrix]
+
+
 def get_local_ip() -> Any:
     """Return the local IP address of this machine.
 
@@ -120,6 +251,12 @@ class DelimitedBuffer:
         for line in lines:
             self._on_next(line)
 
+    def flush(self) -> None:
+        """Output whatever may be in the buffer."""
+        if self._buffer:
+            self._on_next(self._buffer)
+            self._buffer = ""
+
     def __enter__(self) -> DelimitedBuffer:
         return self
 
@@ -130,5 +267,4 @@ class DelimitedBuffer:
         traceback: Optional[TracebackType],
     ) -> None:
         """Output whatever may be in the buffer at exit."""
-        if self._buffer:
-            self._on_next(self._buffer)
+        self.flush()